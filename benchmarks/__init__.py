@@ -0,0 +1 @@
+"""Micro-benchmarks for ATLAS internals. Run each module with `python -m benchmarks.<name>`."""
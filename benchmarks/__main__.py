@@ -0,0 +1,209 @@
+"""
+Benchmark of the whole agent loop, replaying recorded HASS payloads and token streams with the `fake` provider.
+
+    python -m benchmarks [--recording benchmarks/recordings/weather_lookup.json] [--token-delay 0.005]
+
+Reports per-stage latency of `ATLAS.process_hass_user` (parse, each LLM turn, sandbox exec, serialization,
+time to the first spoken sentence), allocations per request, time to first u_out with and without reasoning
+(set a `--token-delay` for it to mean anything), and throughput of the bottle app under concurrency.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
+import json
+import math
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from . import common
+
+RECORDING = os.path.join(os.path.dirname(__file__), "recordings", "weather_lookup.json")
+
+class Stages:
+    """Collects stage durations. Stages are timed by wrapping the functions that implement them."""
+    def __init__(self):
+        self.durations: dict[str, list[float]] = collections.defaultdict(list)
+        self.lock = threading.Lock()
+        # per-request turn counters; a context variable, so the agent threads of a request share their request's
+        self.turns: contextvars.ContextVar[collections.Counter] = contextvars.ContextVar("benchmark_turns", default=None)
+    def record(self, stage: str, duration: float):
+        with self.lock:
+            self.durations[stage].append(duration)
+    def turn(self, agent: str) -> int:
+        turns = self.turns.get()
+        if turns is None:
+            turns = collections.Counter()
+            self.turns.set(turns)
+        with self.lock:
+            turns[agent] += 1
+            return turns[agent]-1
+    def new_request(self):
+        self.turns.set(collections.Counter())
+
+def instrument(atlas, stages: Stages, recording: dict, real_sandbox: bool):
+    from core import llm, models
+    from core.agents import sys_worker
+    agent_names = {id(agent.llm): agent.name for agent in atlas.agents.agents}
+
+    class TimedCompletion(llm.Completion):
+        def __init__(self, completion: llm.Completion, stage: str):
+            super().__init__(completion._chunks)
+            self.stage = stage
+            self.start = time.perf_counter()
+            self.recorded = False
+        def __iter__(self):
+            first = True
+            for chunk in super().__iter__():
+                if first:
+                    stages.record(self.stage+".ttft", time.perf_counter()-self.start)
+                    first = False
+                yield chunk
+            self._record()
+        def close(self):
+            super().close()
+            self._record()
+        def _record(self):
+            if not self.recorded:
+                self.recorded = True
+                stages.record(self.stage, time.perf_counter()-self.start)
+
+    complete = llm.LLM.complete
+    def timed_complete(self, *args, **kwargs):
+        agent = agent_names.get(id(self), self.provider_name)
+        return TimedCompletion(complete(self, *args, **kwargs), f"llm.{agent}[{stages.turn(agent)}]")
+    llm.LLM.complete = timed_complete
+
+    run_sandboxed = sys_worker.run_sandboxed
+    sandbox_calls = collections.Counter() # env ids are unique per sys_worker task
+    def timed_run_sandboxed(code: str, env_id: str, *args, **kwargs) -> str:
+        t = time.perf_counter()
+        try:
+            if real_sandbox:
+                return run_sandboxed(code, env_id, *args, **kwargs)
+            results = recording.get("python_results") or [""]
+            with stages.lock:
+                sandbox_calls[env_id] += 1
+                call = sandbox_calls[env_id]-1
+            return results[min(call, len(results)-1)]
+        finally:
+            stages.record("sandbox", time.perf_counter()-t)
+    sys_worker.run_sandboxed = timed_run_sandboxed
+
+    generate_response_payload = models.hass.generate_response_payload
+    def timed_generate_response_payload(*args, **kwargs):
+        t = time.perf_counter()
+        payload = generate_response_payload(*args, **kwargs)
+        json.dumps(payload)
+        stages.record("serialize", time.perf_counter()-t)
+        return payload
+    models.hass.generate_response_payload = timed_generate_response_payload
+
+def run_in_process(atlas, stages: Stages, payload: dict, requests: int):
+    from core import models
+    for _ in range(requests):
+        stages.new_request()
+        t = time.perf_counter()
+        first_u_out = []
+        def on_u_out(segment: str):
+            if not first_u_out:
+                first_u_out.append(time.perf_counter()-t)
+        prompt = models.hass.PromptPayload(copy.deepcopy(payload))
+        stages.record("parse", time.perf_counter()-t)
+        atlas.process_hass_user(prompt, on_u_out)
+        stages.record("total", time.perf_counter()-t)
+        if first_u_out:
+            stages.record("first_u_out", first_u_out[0])
+
+def compare_reasoning(atlas, payload: dict, requests: int) -> dict[str, float]:
+    """Mean time to the first u_out with every agent in each reasoning mode."""
+    from core import agents
+    policies = {agent: agent.reasoning for agent in atlas.agents.agents}
+    results = {}
+    try:
+        for mode in ("think", "no_think"):
+            for agent in policies:
+                agent.set_reasoning(agents.ReasoningPolicy(mode))
+            stages = Stages()
+            run_in_process(atlas, stages, payload, requests)
+            results[mode] = statistics.mean(stages.durations["first_u_out"] or [math.nan])
+    finally:
+        for agent, policy in policies.items():
+            agent.set_reasoning(policy)
+    return results
+
+def measure_allocations(atlas, stages: Stages, payload: dict) -> tuple[int, int]:
+    """Returns `(peak bytes, allocated blocks still alive)` for one request."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    run_in_process(atlas, stages, payload, 1)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(i.count_diff for i in after.compare_to(before, "filename"))
+    return peak, blocks
+
+def run_http(url: str, payload: dict, requests: int, concurrency: int) -> float:
+    def one(i: int):
+        data = copy.deepcopy(payload)
+        data["conversation_id"] = f"{payload.get('conversation_id')}-{i}"
+        common.post(url, data)
+    t = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    return requests/(time.perf_counter()-t)
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values)*p), len(values)-1)]
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--recording", default=RECORDING)
+    argparser.add_argument("--requests", type=int, default=20)
+    argparser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    argparser.add_argument("--token-delay", type=float, default=0.0, help="seconds between fake tokens")
+    argparser.add_argument("--first-token-delay", type=float, default=0.0, help="seconds before the first fake token")
+    argparser.add_argument("--real-sandbox", action="store_true", help="run python calls instead of replaying `python_results`")
+    args = argparser.parse_args()
+
+    with open(args.recording) as f:
+        recording = json.load(f)
+    folder = tempfile.mkdtemp()
+    common.write_config(folder, {
+        "recording": os.path.abspath(args.recording),
+        "token_delay": args.token_delay,
+        "first_token_delay": args.first_token_delay
+    })
+    stages = Stages()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        main_module, httpd, base_url = common.serve_app(folder)
+        instrument(main_module.atlas, stages, recording, args.real_sandbox)
+        run_in_process(main_module.atlas, stages, recording["payload"], args.requests)
+        latencies = {k: list(v) for k, v in stages.durations.items()}
+        peak, blocks = measure_allocations(main_module.atlas, stages, recording["payload"])
+        reasoning = compare_reasoning(main_module.atlas, recording["payload"], args.requests)
+        throughput = [(c, run_http(base_url+"/process_hass_user", recording["payload"], args.requests, c)) for c in args.concurrency]
+    httpd.shutdown()
+
+    print(f"{'stage':<22} {'n':>5} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for stage, values in sorted(latencies.items(), key=lambda i: (i[0] == "total", i[0])):
+        print(f"{stage:<22} {len(values):>5} {statistics.mean(values)*1000:>9.3f} "
+              f"{percentile(values, 0.5)*1000:>9.3f} {percentile(values, 0.95)*1000:>9.3f}")
+    print(f"\nallocations: {peak/1024:.1f} KiB peak, {blocks} blocks retained per request")
+    saved = reasoning["think"]-reasoning["no_think"]
+    print(f"time to first u_out: {reasoning['think']*1000:.3f} ms thinking, {reasoning['no_think']*1000:.3f} ms without "
+          f"(saves {saved*1000:.3f} ms, {saved/reasoning['think']*100:.0f}%)")
+    print()
+    for concurrency, rps in throughput:
+        print(f"concurrency {concurrency:>3}: {rps:8.1f} req/s")
+
+if __name__ == "__main__":
+    main()
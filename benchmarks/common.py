@@ -0,0 +1,49 @@
+"""Shared setup for benchmarks that run the whole app against the `fake` provider."""
+
+import json
+import os
+import threading
+import urllib.request
+import wsgiref.simple_server
+
+import toml
+
+TOKEN = "benchmark-token"
+
+def write_config(folder: str, provider_options: dict = None):
+    """Writes a config folder where every agent uses the `fake` provider."""
+    with open(os.path.join(folder, "llm_providers.toml"), "w") as f:
+        toml.dump({"fake": {"provider": "fake", "api_key": "", **(provider_options or {})}}, f)
+    with open(os.path.join(folder, "agent_backends.toml"), "w") as f:
+        toml.dump({i: {"provider": "fake", "model_name": "fake"} for i in ("supervisor", "sys_worker")}, f)
+    with open(os.path.join(folder, "config.toml"), "w") as f:
+        # repeated payloads would otherwise be answered from the response cache after the first,
+        # and the one benchmark user rate limited
+        toml.dump({"database": {"path": ":memory:"}, "cache": {"enabled": False}, "admission": {"user_rate": 0}}, f)
+    os.makedirs(os.path.join(folder, "auth"), exist_ok=True)
+    with open(os.path.join(folder, "auth", "auth_tokens"), "w") as f:
+        f.write(TOKEN+"\n")
+
+class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def serve_app(folder: str):
+    """Imports `main` with the config in `folder` and serves it on a free port. Returns `(main, httpd, base_url)`."""
+    os.environ["ATLAS_CONFIG"] = folder
+    import main
+    httpd = wsgiref.simple_server.make_server(
+        "127.0.0.1", 0, main.app,
+        server_class=main.ThreadingWSGIServer,
+        handler_class=QuietHandler
+    )
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return main, httpd, f"http://127.0.0.1:{httpd.server_port}"
+
+def post(url: str, payload: dict, timeout: float = 60) -> dict:
+    req = urllib.request.Request(
+        url, data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json", "Authorization": TOKEN}
+    )
+    with urllib.request.urlopen(req, timeout=timeout) as r:
+        return json.load(r)
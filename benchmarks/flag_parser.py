@@ -0,0 +1,68 @@
+"""Compares the incremental flag tokenizer against the old per-character regex rescan."""
+
+import argparse
+import re
+import time
+
+from core.agents import supervisor
+
+LEGACY_FLAGS = {
+    r"<think>": ("think", True),
+    r"</think>": ("think", False),
+    r"<u_out>": ("u_out", True),
+    r"</u_out>": ("u_out", False),
+    r"<continue_conversation />": ("continue_conversation", True),
+    r"<\|agent\| (?P<agent_name>[^>]+)>": ("agent", True),
+    r"</\|agent\|>": ("agent", False)
+}
+
+def legacy_parse(docstr: str):
+    """The parser as it was before `FlagTokenizer`: every regex over the whole response."""
+    for pattern, flag in LEGACY_FLAGS.items():
+        matches = list(re.finditer(pattern, docstr))
+        if not matches:
+            continue
+        if matches[-1].span()[1] == len(docstr):
+            return flag
+    return None
+
+def make_response(size: int) -> str:
+    think = "Let me <consider> what the user wants, step by step. "
+    body = "<think>" + think*(size//len(think)) + "</think>"
+    return body + "<u_out>Sure, give me a second.</u_out><|agent| sys_worker>Look up the weather.</|agent|>"
+
+def run_legacy(text: str) -> int:
+    response = ""
+    found = 0
+    for char in text:
+        response += char
+        if legacy_parse(response):
+            found += 1
+    return found
+
+def run_tokenizer(text: str) -> int:
+    parser = supervisor.FlagParser()
+    found = 0
+    for char in text:
+        if parser.feed(char):
+            found += 1
+    return found
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 16000])
+    args = argparser.parse_args()
+    print(f"{'chars':>8} {'legacy (ms)':>12} {'tokenizer (ms)':>15} {'speedup':>8}")
+    for size in args.sizes:
+        text = make_response(size)
+        t = time.perf_counter()
+        legacy_found = run_legacy(text)
+        legacy = time.perf_counter()-t
+        t = time.perf_counter()
+        found = run_tokenizer(text)
+        tokenizer = time.perf_counter()-t
+        assert found == legacy_found, (found, legacy_found)
+        print(f"{len(text):>8} {legacy*1000:>12.2f} {tokenizer*1000:>15.2f} {legacy/tokenizer:>7.0f}x")
+
+if __name__ == "__main__":
+    main()
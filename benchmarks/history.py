@@ -0,0 +1,88 @@
+"""
+Cost of serializing long conversation histories for providers (`History.to_messages`).
+
+    python -m benchmarks.history [--messages 500] [--turns 200]
+
+Grows a history of `--messages` messages by a user, tool and assistant message per turn, serializing it
+the way the agent loop does each turn: the whole history for the LLM, the last few messages, and the
+new messages of the response payload. Compares with the serialization `History` used to do.
+"""
+
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+
+from core import models
+
+def legacy_to_messages(history: models.chat.History, i: int = None) -> list[dict]:
+    """What `History.to_messages` used to do: reverse, slice and rebuild every dict on each call."""
+    messages = []
+    for message in list(reversed(history.history))[:i]:
+        d = {"role": message.role, "content": message.content}
+        if isinstance(message, models.chat.ToolMessage):
+            d["tool_call_id"] = message.tool_call_id
+        messages.append(d)
+    return list(reversed(messages))
+
+def cached_to_messages(history: models.chat.History, i: int = None) -> list[dict]:
+    return history.to_messages(i)
+
+def text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(("the", "light", "kitchen", "turn", "on", "weather", "today", "is", "sunny")) for _ in range(words))
+
+def build(messages: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    roles = ("user", "tool", "assistant")
+    return [
+        {"role": roles[i%3], "content": text(rng, rng.randint(5, 60)), **({"tool_call_id": "sys_worker"} if i%3 == 1 else {})}
+        for i in range(messages)
+    ]
+
+def run(to_messages, payload: list[dict], turns: int, window: int) -> dict[str, list[float]]:
+    history = models.chat.History(payload)
+    rng = random.Random(1)
+    latencies = {"full": [], "window": [], "since": []}
+    for _ in range(turns):
+        since = len(history.history)
+        history.add_user(text(rng, 10))
+        history.add_tool(text(rng, 30), "sys_worker")
+        t = time.perf_counter()
+        to_messages(history)
+        latencies["full"].append(time.perf_counter()-t)
+        t = time.perf_counter()
+        to_messages(history, window)
+        latencies["window"].append(time.perf_counter()-t)
+        history.add_assistant(text(rng, 20))
+        t = time.perf_counter()
+        to_messages(history)[since:]
+        latencies["since"].append(time.perf_counter()-t)
+    return latencies
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--messages", type=int, default=500, help="history length before the first turn")
+    argparser.add_argument("--turns", type=int, default=200)
+    argparser.add_argument("--window", type=int, default=10, help="`i` of the windowed view")
+    args = argparser.parse_args()
+
+    payload = build(args.messages)
+    assert legacy_to_messages(models.chat.History(payload)) == models.chat.History(payload).to_messages()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    history = models.chat.History(payload)
+    history.to_messages()
+    size = sum(i.size_diff for i in tracemalloc.take_snapshot().compare_to(before, "filename"))
+    tracemalloc.stop()
+    print(f"{args.messages} messages, {size/args.messages:.0f} bytes per message (with its serialized form)")
+
+    print(f"{'view':<8} {'serialization':<14} {'mean us':>9} {'p50 us':>9} {'max us':>9}")
+    for name, to_messages in (("legacy", legacy_to_messages), ("cached", cached_to_messages)):
+        for view, values in run(to_messages, payload, args.turns, args.window).items():
+            print(f"{view:<8} {name:<14} {statistics.mean(values)*1e6:>9.1f} "
+                  f"{statistics.median(values)*1e6:>9.1f} {max(values)*1e6:>9.1f}")
+
+if __name__ == "__main__":
+    main()
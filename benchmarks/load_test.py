@@ -0,0 +1,51 @@
+"""
+Load test: N simultaneous requests through the bottle app on the threaded server, with the `fake` provider echoing.
+Checks every response belongs to its own request and compares throughput against sequential requests.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import os
+import tempfile
+import time
+
+from . import common
+
+def request(url: str, i: int) -> bool:
+    payload = {
+        "input_text": f"request number {i}",
+        "timest": time.time(),
+        "history": [],
+        "conversation_id": f"load-{i}",
+        "user_info": {"name": "Load", "is_admin": False, "is_owner": False, "id": f"user-{i%4}"}
+    }
+    data = common.post(url, payload)["data"]
+    return data["tts_text"] == f"You said: request number {i}"
+
+def run(url: str, requests: int, concurrency: int) -> tuple[float, int]:
+    t = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda i: request(url, i), range(requests)))
+    return time.perf_counter()-t, results.count(False)
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument("--requests", type=int, default=64)
+    argparser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    argparser.add_argument("--delay", type=float, default=0.002, help="seconds per fake token")
+    args = argparser.parse_args()
+    folder = tempfile.mkdtemp()
+    common.write_config(folder, {"token_delay": args.delay})
+    _, httpd, base_url = common.serve_app(folder)
+    url = base_url+"/process_hass_user"
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = [(c, *run(url, args.requests, c)) for c in args.concurrency]
+    base = args.requests/results[0][1]
+    for concurrency, elapsed, wrong in results:
+        rps = args.requests/elapsed
+        print(f"concurrency {concurrency:>3}: {rps:8.1f} req/s ({rps/base:4.1f}x), {wrong} wrong responses")
+    httpd.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Latency of the household memory store (`core.memory`) at scale, on synthetic household facts.
+
+    python -m benchmarks.memory_store [--memories 100000] [--queries 200]
+
+Reports bulk insert rate, the time to open the store (loading the embedding matrix),
+and search latency per mode, plus a single add.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from core import memory
+
+PEOPLE = ["Alice", "Bob", "Carol", "Dave", "Erin", "Frank", "Grace", "Heidi", "Ivan", "Judy"]
+THINGS = [
+    "coffee", "tea", "jazz", "pizza", "peanuts", "cats", "dogs", "tennis", "chess", "sushi", "rain", "mornings",
+    "the garage", "the thermostat", "the porch light", "the dishwasher", "the blue car", "the garden", "the attic"
+]
+TEMPLATES = [
+    "{person} likes {thing}",
+    "{person} is allergic to {thing}",
+    "{person} doesn't like {thing} before {hour}",
+    "The code for {thing} is {number}",
+    "{person} usually checks {thing} at {hour}",
+    "{person}'s birthday is on day {day} of month {month}",
+    "Remember to service {thing} every {day} days",
+    "{person} asked to be reminded about {thing} on {weekday}"
+]
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+def fact(rng: random.Random) -> str:
+    return rng.choice(TEMPLATES).format(
+        person=rng.choice(PEOPLE), thing=rng.choice(THINGS), hour=f"{rng.randint(5, 23)}:00",
+        number=rng.randint(1000, 9999), day=rng.randint(1, 28), month=rng.randint(1, 12), weekday=rng.choice(WEEKDAYS)
+    )
+
+def query(rng: random.Random) -> str:
+    return rng.choice([
+        "what is the code for {thing}",
+        "is {person} allergic to anything",
+        "when is {person}'s birthday",
+        "what does {person} like",
+        "{thing} reminder"
+    ]).format(person=rng.choice(PEOPLE), thing=rng.choice(THINGS))
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values)*p), len(values)-1)]
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--memories", type=int, default=100000)
+    argparser.add_argument("--queries", type=int, default=200)
+    argparser.add_argument("--k", type=int, default=5)
+    argparser.add_argument("--dim", type=int, default=256, help="hashing embedder dimensions")
+    args = argparser.parse_args()
+
+    rng = random.Random(0)
+    path = os.path.join(tempfile.mkdtemp(), "memory.db")
+    store = memory.MemoryStore(path, memory.HashingEmbedder(args.dim))
+    t = time.perf_counter()
+    for start in range(0, args.memories, 5000):
+        store.add_many([fact(rng) for _ in range(min(5000, args.memories-start))])
+    insert = time.perf_counter()-t
+
+    t = time.perf_counter()
+    store = memory.MemoryStore(path, memory.HashingEmbedder(args.dim))
+    load = time.perf_counter()-t
+
+    queries = [query(rng) for _ in range(args.queries)]
+    latencies = {}
+    for mode in ("vector", "keyword", "hybrid"):
+        store.search(queries[0], args.k, mode) # warm up
+        values = latencies[mode] = []
+        for q in queries:
+            t = time.perf_counter()
+            store.search(q, args.k, mode)
+            values.append(time.perf_counter()-t)
+    adds = []
+    for _ in range(20):
+        t = time.perf_counter()
+        store.add(fact(rng))
+        adds.append(time.perf_counter()-t)
+    latencies["add"] = adds
+
+    print(f"{len(store)} memories, {os.path.getsize(path)/2**20:.1f} MiB on disk")
+    print(f"bulk insert: {args.memories/insert:.0f} memories/s, open: {load*1000:.1f} ms")
+    print(f"{'operation':<10} {'n':>5} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for operation, values in latencies.items():
+        print(f"{operation:<10} {len(values):>5} {statistics.mean(values)*1000:>9.3f} "
+              f"{percentile(values, 0.5)*1000:>9.3f} {percentile(values, 0.95)*1000:>9.3f}")
+
+if __name__ == "__main__":
+    main()
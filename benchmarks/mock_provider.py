@@ -0,0 +1,87 @@
+"""
+Local mock of a Cerebras/OpenAI-compatible chat completions endpoint, for testing providers offline.
+Point a provider at it with `base_url = "http://127.0.0.1:8055"` in `llm_providers.toml`
+(`"http://127.0.0.1:8055/v1"` for an `openai` provider).
+
+Streams are picked like the `fake` provider does (see `core.llm.fake.select_chunks`):
+recorded turns with `--recording`, otherwise an echo of the last user message.
+"""
+
+import argparse
+import http.server
+import json
+import time
+
+from core.llm import fake
+
+def make_handler(recording: dict = None, delay: float = 0.0):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *args):
+            pass
+        def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def do_GET(self):
+            if self.path.startswith("/v1/tcp_warming"):
+                return self._send(200, b'""')
+            self._send(404, b'{"error": "not found"}')
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.startswith("/v1/chat/completions"):
+                return self._send(404, b'{"error": "not found"}')
+            chunks = fake.select_chunks(recording, body["messages"], body.get("stop"))
+            base = {
+                "id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "mock"), "system_fingerprint": "mock"
+            }
+            if not body.get("stream"):
+                message = {"role": "assistant", "content": "".join(chunks)}
+                return self._send(200, json.dumps({
+                    **base, "object": "chat.completion",
+                    "choices": [{"index": 0, "message": message, "finish_reason": "stop"}]
+                }).encode())
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            def event(data: str):
+                data = f"data: {data}\n\n".encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode()+data+b"\r\n")
+                self.wfile.flush()
+            try:
+                for chunk in chunks:
+                    if delay:
+                        time.sleep(delay)
+                    event(json.dumps({**base, "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]}))
+                event(json.dumps({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+                event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError): # the client stopped the stream
+                self.close_connection = True
+    return Handler
+
+def serve(host: str = "127.0.0.1", port: int = 0, recording: dict = None, delay: float = 0.0) -> http.server.ThreadingHTTPServer:
+    """Creates the server; call `serve_forever` on it (port 0 picks a free one, see `server_port`)."""
+    return http.server.ThreadingHTTPServer((host, port), make_handler(recording, delay))
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--host", default="127.0.0.1")
+    argparser.add_argument("--port", type=int, default=8055)
+    argparser.add_argument("--recording", help="recording JSON to replay, see benchmarks/recordings")
+    argparser.add_argument("--delay", type=float, default=0.0, help="seconds per streamed token")
+    args = argparser.parse_args()
+    recording = None
+    if args.recording:
+        with open(args.recording) as f:
+            recording = json.load(f)
+    server = serve(args.host, args.port, recording, args.delay)
+    print(f"Mock provider on http://{args.host}:{server.server_port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Per-token overhead of the agent stream pipeline, replaying recorded provider streams."""
+
+import argparse
+import contextlib
+import glob
+import json
+import os
+import time
+
+from core import models
+from core.llm import LLM
+from core.agents import supervisor, sys_worker
+
+RECORDINGS = os.path.join(os.path.dirname(__file__), "recordings")
+
+READERS = {
+    "supervisor": supervisor.StreamReader,
+    "sys_worker": sys_worker.StreamReader
+}
+
+class ReplayLLM(LLM):
+    """Yields a recorded stream chunk by chunk."""
+    def __init__(self, chunks: list[str]):
+        super().__init__("replay")
+        self.chunks = chunks
+    def _complete(self, messages: list, temperature: float = None, stop: str = None, model: str = None):
+        yield from self.chunks
+
+def per_char(stream):
+    """What `LLM.complete` used to hand to the stream readers."""
+    for chunk in stream:
+        yield from chunk
+
+def load_streams(path: str = RECORDINGS) -> list[tuple[str, list[str]]]:
+    streams = []
+    for file in sorted(glob.glob(os.path.join(path, "*.json"))):
+        with open(file) as f:
+            recording = json.load(f)
+        for agent, turns in recording["streams"].items():
+            streams.extend((agent, chunks) for chunks in turns)
+    return streams
+
+def replay(streams, chunked: bool) -> float:
+    history = models.chat.History([])
+    t = time.perf_counter()
+    for agent, chunks in streams:
+        stream = ReplayLLM(chunks).complete(history)
+        for _ in READERS[agent](stream if chunked else per_char(stream)):
+            pass
+    return time.perf_counter()-t
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument("--recordings", default=RECORDINGS)
+    argparser.add_argument("--repeat", type=int, default=200)
+    args = argparser.parse_args()
+    streams = load_streams(args.recordings)*args.repeat
+    tokens = sum(len(chunks) for _, chunks in streams)
+    chars = sum(len("".join(chunks)) for _, chunks in streams)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        char_time = replay(streams, chunked=False)
+        chunk_time = replay(streams, chunked=True)
+    print(f"{len(streams)} streams, {tokens} tokens, {chars} chars")
+    print(f"per-char: {char_time*1e6/tokens:8.2f} us/token")
+    print(f"chunked:  {chunk_time*1e6/tokens:8.2f} us/token ({char_time/chunk_time:.1f}x)")
+
+if __name__ == "__main__":
+    main()
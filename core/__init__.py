@@ -1,6 +1,14 @@
 """Core ATLAS functionality."""
 
 from . import (
+    tracing,
+    cancellation,
+    admission,
+    auth,
     models,
+    database,
+    context,
+    router,
+    cache,
     atlas
 )
@@ -0,0 +1,211 @@
+"""Admission control: per-user rate limits and fair, prioritized concurrency limits per LLM provider."""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+
+from . import cancellation, tracing
+
+# priorities of LLM completions, lowest first
+INTERACTIVE = 0 # turns a user is waiting on (supervisor, pre-router)
+BACKGROUND = 1 # agent jobs (sys_worker)
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+QUEUE_DEPTH = tracing.registry.gauge("atlas_admission_queue_depth", "LLM completions waiting for a provider slot, by provider.")
+QUEUE_SECONDS = tracing.registry.histogram(
+    "atlas_admission_queue_seconds", "Time LLM completions waited for a provider slot, by provider and priority."
+)
+REJECTED = tracing.registry.counter("atlas_admission_rejected_total", "Requests and LLM completions turned away, by reason.")
+
+BUSY = "I'm handling a lot of requests right now. Please try again in a moment."
+RATE_LIMITED = "You're asking faster than I can keep up. Please wait a few seconds and try again."
+
+class Rejected(Exception):
+    """Work turned away. `tts_text` can be spoken to the user, `retry_after` is in seconds."""
+    def __init__(self, reason: str, message: str, tts_text: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.tts_text = tts_text
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Holds up to `burst` tokens, refilled at `rate` per second."""
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    def take(self) -> float:
+        """Takes a token. Returns 0, or the seconds until one is available (none is taken then)."""
+        now = time.monotonic()
+        self.tokens = min(self.tokens+(now-self.updated)*self.rate, self.burst)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1-self.tokens)/self.rate
+
+class UserLimiter:
+    """
+    A token bucket per user: on average `rate` requests per second, in bursts of up to `burst`.
+    Buckets of the `max_users` most recently seen users are kept; a forgotten user starts with a full bucket.
+    """
+    def __init__(self, rate: float, burst: float, max_users: int = 4096):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+    def admit(self, user_id: str):
+        """Raises `Rejected` if `user_id` is over their rate."""
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+                while len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(user_id)
+            wait = bucket.take()
+        if wait:
+            REJECTED.inc(reason="rate_limited")
+            raise Rejected("rate_limited", f"User `{user_id}` is over their request rate", RATE_LIMITED, wait)
+
+class _Waiter:
+    __slots__ = ("priority", "turn", "order", "granted", "abandoned")
+    def __init__(self, priority: int, turn: int, order: int):
+        self.priority = priority
+        self.turn = turn
+        self.order = order
+        self.granted = False
+        self.abandoned = False
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.turn, self.order) < (other.priority, other.turn, other.order)
+
+class ProviderGate:
+    """
+    At most `max_concurrent` completions of one provider stream at once. Others queue: higher priority first,
+    then users take turns (a user with many queued completions doesn't hold up the others), then in arrival order.
+    A completion is turned away at once if `max_queue` are already waiting, or after `queue_timeout` seconds.
+    """
+    MAX_USERS = 1024 # turns kept before those of users who are no longer ahead are forgotten
+    def __init__(self, provider: str, max_concurrent: int, max_queue: int = 32, queue_timeout: float = 15):
+        self.provider = provider
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self._queue: list[_Waiter] = [] # heap, abandoned waiters are skipped when popped
+        self._waiting = 0
+        self._turns: dict[str, int] = {} # user -> turn of their next queued completion
+        self._clock = 0 # turn being served; a user with no turn (or an older one) queues at it
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+    def acquire(self, user_id: str = None, priority: int = INTERACTIVE):
+        """Waits for a slot, to be given back with `release`. Raises `Rejected`, or `Cancelled` if the request is."""
+        start = time.perf_counter()
+        with self._condition:
+            if self.running < self.max_concurrent and not self._waiting:
+                self.running += 1
+                QUEUE_SECONDS.observe(0, provider=self.provider, priority=PRIORITY_NAMES[priority])
+                return
+            if self._waiting >= self.max_queue:
+                REJECTED.inc(reason="queue_full")
+                raise Rejected(
+                    "queue_full", f"Provider `{self.provider}` has {self._waiting} completions queued", BUSY, self.queue_timeout
+                )
+            turn = max(self._turns.get(user_id, 0), self._clock)
+            self._turns[user_id] = turn+1
+            waiter = _Waiter(priority, turn, next(self._order))
+            heapq.heappush(self._queue, waiter)
+            self._waiting += 1
+            QUEUE_DEPTH.set(self._waiting, provider=self.provider)
+        deadline = time.monotonic()+self.queue_timeout
+        token = cancellation.current()
+        if token is not None:
+            token.add_callback(self._wake)
+        try:
+            with self._condition:
+                while not waiter.granted:
+                    remaining = deadline-time.monotonic()
+                    if remaining <= 0 or (token is not None and token.cancelled):
+                        break
+                    self._condition.wait(remaining)
+                if not waiter.granted:
+                    waiter.abandoned = True
+                    self._waiting -= 1
+                    QUEUE_DEPTH.set(self._waiting, provider=self.provider)
+        finally:
+            if token is not None:
+                token.remove_callback(self._wake)
+            QUEUE_SECONDS.observe(time.perf_counter()-start, provider=self.provider, priority=PRIORITY_NAMES[priority])
+        if not waiter.granted:
+            cancellation.check()
+            REJECTED.inc(reason="queue_timeout")
+            raise Rejected(
+                "queue_timeout", f"No slot of provider `{self.provider}` freed up in {self.queue_timeout:g} seconds",
+                BUSY, self.queue_timeout
+            )
+    def release(self):
+        with self._condition:
+            self.running -= 1
+            while self.running < self.max_concurrent and self._queue:
+                waiter = heapq.heappop(self._queue)
+                if waiter.abandoned:
+                    continue
+                waiter.granted = True
+                self.running += 1
+                self._waiting -= 1
+                self._clock = max(self._clock, waiter.turn)
+            if len(self._turns) > self.MAX_USERS:
+                self._turns = {i: j for i, j in self._turns.items() if j > self._clock}
+            QUEUE_DEPTH.set(self._waiting, provider=self.provider)
+            self._condition.notify_all()
+    def _wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+class ProviderGates:
+    """
+    A `ProviderGate` per provider name, created on first use with `limits[name]` (or `max_concurrent`) slots.
+    Providers with 0 slots aren't limited.
+    """
+    def __init__(self, max_concurrent: int = 0, max_queue: int = 32, queue_timeout: float = 15, limits: dict[str, int] = None):
+        self.configure(max_concurrent, max_queue, queue_timeout, limits)
+    def configure(self, max_concurrent: int, max_queue: int, queue_timeout: float, limits: dict[str, int] = None):
+        """Completions already running or queued keep the gates they were counted against."""
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.limits = limits or {}
+        self._gates: dict[str, ProviderGate] = {}
+        self._lock = threading.Lock()
+    def get(self, provider: str) -> ProviderGate:
+        """The gate of `provider`, `None` if it isn't limited."""
+        gate = self._gates.get(provider)
+        if gate is not None:
+            return gate
+        max_concurrent = self.limits.get(provider, self.max_concurrent)
+        if not max_concurrent:
+            return None
+        with self._lock:
+            return self._gates.setdefault(provider, ProviderGate(provider, max_concurrent, self.max_queue, self.queue_timeout))
+
+providers = ProviderGates()
+
+_user: contextvars.ContextVar[str] = contextvars.ContextVar("admission_user", default=None)
+
+@contextmanager
+def as_user(user_id: str):
+    """Completions started inside it (agent threads included) queue as `user_id`'s."""
+    token = _user.set(user_id)
+    try:
+        yield
+    finally:
+        _user.reset(token)
+
+def current_user() -> str:
+    return _user.get()
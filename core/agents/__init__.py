@@ -4,18 +4,66 @@ from dataclasses import dataclass
 
 from .. import (
     models,
-    llm
+    llm,
+    tracing
 )
 
+SERVED = tracing.registry.counter("atlas_model_tier_total", "Agent runs by the cascade tier (and model) that finished them.")
+ESCALATIONS = tracing.registry.counter("atlas_model_escalations_total", "Model cascade escalations by agent and reason.")
+THINK_CUTOFFS = tracing.registry.counter("atlas_think_cutoffs_total", "Turns re-prompted without thinking after reaching `max_think_tokens`.")
+
+@dataclass
+class ReasoningPolicy:
+    """
+    When an agent may think before answering.
+    `mode` is `think`, `no_think`, or `auto`: no thinking for turns answering a request of at most `simple_words` words.
+    Past `max_think_tokens` streamed think deltas, the reasoning is cut off and the turn re-prompted without it.
+    """
+    mode: str = "think"
+    max_think_tokens: int = None
+    simple_words: int = 8
+    def __post_init__(self):
+        if self.mode not in ("think", "no_think", "auto"):
+            raise ValueError(f"Unknown reasoning mode: {self.mode}")
+    def think(self, request: str) -> bool:
+        if self.mode == "auto":
+            return len(request.split()) > self.simple_words
+        return self.mode == "think"
+
+def without_thinking(history: models.chat.History) -> models.chat.History:
+    """Copy of `history` with the no-think switch on its last message."""
+    result = models.chat.History([])
+    result.history = list(history.history)
+    if result.history:
+        last = result.history[-1]
+        result.history[-1] = models.chat.create_message(
+            last.role, last.content+" "+llm.NO_THINK, getattr(last, "tts_text", None), getattr(last, "tool_call_id", "")
+        )
+    return result
+
 class Agent:
     """An abstract base class for all ATLAS agents. For __some__ consistency."""
-    def __init__(self, name: str, _llm: llm.LLM, model_name: str):
+    def __init__(self, name: str, _llm: llm.LLM, model_name: str, models: list[str] = None):
         self.name = name
         self.llm = _llm
-        self.llm.set_model_name(model_name)
-    def process(self, prompt: models.hass.PromptPayload) -> bool:
+        self.models = models or [model_name]
+        self.llm.set_model_name(self.models[0])
+        self.reasoning = ReasoningPolicy()
+        self.timeout: float = None # seconds the supervisor waits for this agent's report
+    def set_reasoning(self, reasoning: ReasoningPolicy):
+        self.reasoning = reasoning
+    def cascade(self) -> "Cascade":
+        return Cascade(self)
+    def prepare(self) -> "Preparation":
+        """
+        Called as soon as an invocation of this agent starts streaming, to warm up for it.
+        The result is passed to `process` as `preparation`, or released if the invocation is abandoned.
+        Agents with nothing to warm up return `None`.
+        """
+        return None
+    def process(self, prompt: models.hass.PromptPayload, **kwargs) -> bool:
         """Process the prompt and return a response. Returns `continue_conversation`"""
-        resp = self._process(prompt)
+        resp = self._process(prompt, **kwargs)
         if isinstance(resp, tuple):
             resp_text = resp[0]
             tts_text = resp[1]
@@ -25,6 +73,38 @@ class Agent:
         prompt.history.add_assistant(resp)
         return resp
 
+class Preparation:
+    """Resources an agent set up ahead of an invocation."""
+    def release(self):
+        """Frees them if the invocation never happens."""
+
+class Cascade:
+    """
+    Model tier of one agent run. Starts on the first (cheapest) model of `Agent.models`
+    and moves up a tier, for the rest of the run, on each `escalate`.
+    """
+    def __init__(self, agent: Agent):
+        self.agent = agent.name
+        self.models = agent.models
+        self.tier = 0
+    @property
+    def model_name(self) -> str:
+        return self.models[self.tier]
+    @property
+    def last(self) -> bool:
+        """Whether it's on the last model, so the run can't be escalated any more."""
+        return self.tier+1 >= len(self.models)
+    def escalate(self, reason: str) -> bool:
+        """Returns `False` if already on the last model."""
+        if self.last:
+            return False
+        self.tier += 1
+        ESCALATIONS.inc(agent=self.agent, reason=reason)
+        tracing.console.print(f"[ESCALATE {self.agent}]: {reason}, now on {self.model_name}")
+        return True
+    def served(self):
+        SERVED.inc(agent=self.agent, tier=str(self.tier), model=self.model_name)
+
 @dataclass
 class Agents:
     agents: list[Agent]
@@ -54,4 +134,7 @@ def factory(agent_config: models.config.AgentConfig) -> Agent:
     _llm = llm.factory(agent_config.provider_config)
     if agent_config.name not in _AGENTS_LIST:
         raise ValueError(f"Unknown agent: {agent_config.name}")
-    return _AGENTS_LIST[agent_config.name](agent_config.name, _llm, agent_config.model_name)
+    agent = _AGENTS_LIST[agent_config.name](agent_config.name, _llm, agent_config.model_name, agent_config.models)
+    agent.set_reasoning(ReasoningPolicy(agent_config.think, agent_config.max_think_tokens))
+    agent.timeout = agent_config.timeout
+    return agent
@@ -0,0 +1,165 @@
+"""Incremental flag tokenizer shared by the agent stream readers."""
+
+from dataclasses import dataclass, replace
+from typing import Iterator, Union
+
+@dataclass
+class Flag:
+    type: str
+    start: bool
+    params: dict = None # only set on flags returned for parametrised tags
+
+class _Node:
+    __slots__ = ("children", "flag", "param", "after_param")
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.flag: Flag = None
+        self.param: str = None # name of the parameter starting at this node
+        self.after_param: _Node = None
+
+class FlagTrie:
+    """
+    Compiled table of flag tags.
+    Tags are literal strings, optionally with a single `{name}` parameter which matches one or more
+    characters up to the literal character that follows it (eg. `<|agent| {agent_name}>`).
+    Every tag must start with the same lead character, which may not appear anywhere else in a tag
+    or parameter. That way a lead character always restarts matching and no failure links are needed.
+    """
+    def __init__(self, flags: dict[str, Flag]):
+        self.root = _Node()
+        self.lead: str = None
+        for tag, flag in flags.items():
+            self._add(tag, flag)
+    def _add(self, tag: str, flag: Flag):
+        if self.lead is None:
+            self.lead = tag[0]
+        if tag[0] != self.lead or self.lead in tag[1:]:
+            raise ValueError(f"Tag `{tag}` must start with `{self.lead}` and not contain it again")
+        node = self.root
+        i = 0
+        while i < len(tag):
+            if tag[i] == "{":
+                end = tag.index("}", i)
+                if end+1 >= len(tag):
+                    raise ValueError(f"Parameter in tag `{tag}` must be followed by a literal character")
+                if node.param is None:
+                    node.param = tag[i+1:end]
+                    node.after_param = _Node()
+                elif node.param != tag[i+1:end]:
+                    raise ValueError(f"Conflicting parameters in tag `{tag}`")
+                node = node.after_param
+                i = end+1
+                continue
+            node = node.children.setdefault(tag[i], _Node())
+            i += 1
+        node.flag = flag
+
+class FlagTokenizer:
+    """
+    Streaming flag matcher. Keeps its state between characters, so each `feed` is O(1) amortised
+    instead of rescanning the whole response.
+    """
+    flags: FlagTrie = None
+    def __init__(self, flags: FlagTrie = None):
+        if flags is not None:
+            self.flags = flags
+        self._node: _Node = None
+        self._param_node: _Node = None # set while capturing a parameter
+        self._param: list[str] = []
+        self._params: dict = {}
+        self.match_length = 0 # length of the tag matched (or being matched)
+    @property
+    def matching(self) -> bool:
+        """Whether the text fed last may be the start of a tag."""
+        return self._node is not None or self._param_node is not None
+    def reset(self):
+        self._node = None
+        self._param_node = None
+        self._param = []
+        self._params = {}
+        self.match_length = 0
+    def feed(self, char: str) -> Union[Flag, None]:
+        """Feed one character. Returns the flag whose tag ends at this character, if any."""
+        if char == self.flags.lead:
+            self.reset()
+            node = self.flags.root
+        elif self._param_node is not None:
+            node = self._param_node
+            if char not in node.after_param.children:
+                self._param.append(char)
+                self.match_length += 1
+                return None
+            self._params[node.param] = "".join(self._param)
+            self._param = []
+            self._param_node = None
+            node = node.after_param
+        elif self._node is None:
+            return None
+        else:
+            node = self._node
+            if node.param is not None and char not in node.children:
+                if char in node.after_param.children:
+                    # empty parameter
+                    self.reset()
+                    return None
+                self._param_node = node
+                self._param.append(char)
+                self.match_length += 1
+                return None
+        nxt = node.children.get(char)
+        if nxt is None:
+            self.reset()
+            return None
+        self.match_length += 1
+        if nxt.flag is None:
+            self._node = nxt
+            return None
+        flag = nxt.flag
+        if self._params:
+            flag = replace(flag, params=self._params)
+        match_length = self.match_length
+        self.reset()
+        self.match_length = match_length
+        return flag
+    def split(self, chunk: str) -> Iterator[tuple[str, Union[Flag, None]]]:
+        """
+        Split a chunk at flag boundaries. Yields `(segment, flag)` where `segment` ends with the
+        character that completed `flag`; the last segment has no flag.
+        Text outside of a (possible) tag is skipped over without being fed character by character.
+        Tags spanning chunks are fine since the state is kept between calls.
+        """
+        start = i = 0
+        n = len(chunk)
+        while i < n:
+            if self._node is None and self._param_node is None:
+                i = chunk.find(self.flags.lead, i)
+                if i == -1:
+                    break
+            flag = self.feed(chunk[i])
+            i += 1
+            if flag:
+                yield chunk[start:i], flag
+                start = i
+        if start < n:
+            yield chunk[start:], None
+
+class TextBuffer:
+    """Append-only text accumulator, joined lazily instead of with repeated `+=`."""
+    __slots__ = ("_parts",)
+    def __init__(self, text: str = ""):
+        self._parts = [text] if text else []
+    def __bool__(self):
+        return any(self._parts)
+    def __str__(self):
+        return self.getvalue()
+    def append(self, text: str):
+        self._parts.append(text)
+    def getvalue(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+    def strip_tag(self, tag_length: int) -> str:
+        """Drop the closing tag that ends the buffer and strip whitespace. Returns the new value."""
+        text = self.getvalue()[:-tag_length].strip()
+        self._parts = [text] if text else []
+        return text
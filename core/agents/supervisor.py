@@ -1,15 +1,20 @@
 """Supervisor agent for ATLAS."""
 
-from typing import Iterable, Literal, Union
-from dataclasses import dataclass
+from typing import Callable, Iterable, Union
+import concurrent.futures
+import contextvars
+import time
 
-from . import Agent, Agents
+from . import Agent, Agents, Preparation, THINK_CUTOFFS, without_thinking
+from .stream import Flag, FlagTrie, FlagTokenizer, TextBuffer
 from .. import (
-    models
+    models,
+    cache,
+    cancellation,
+    context,
+    tracing
 )
 
-import re
-
 SYSTEM = """
 You are a specialized agent within ATLAS, a multi-agent AI architecture designed to solve complex problems through collaborative intelligence.
 ATLAS functions as a committee of AI agents with diverse strengths and capabilities, working in concert toward shared objectives.
@@ -57,7 +62,8 @@ You can invoke an agent by outputting in the following format:
 
 You need to provide detailed information (when available) in natural language to the agent as its prompt.
 You will receive the agent's messages as a reponse.
-Do not output anything after an agent invocation. Only invoke an agent at the end of your response.
+When a request needs several independent tasks, invoke several agents (or the same agent several times) one after another; they run in parallel.
+Do not output anything after agent invocations. Only invoke agents at the end of your response.
 
 When you need to use an agent:
 1. Call the agent using proper tool syntax
@@ -68,7 +74,7 @@ Available agents:
 - sys_worker: System Worker.
     Has access to a full Python runtime, other system tools and the Internet.
     Useful for performing system operations, data processing, or accessing external information.
-    Has access to a personal memory store.
+    Has access to the household's memory store, shared by all its users: say who a fact or request is about.
     Give detailed information about the goal it needs to achieve.    
 
 Remember that agents may not always be able to accomplish the given task but will always report back with relevant details.
@@ -76,43 +82,25 @@ Remember that agents may not always be able to accomplish the given task but wil
 [You are currently under development, so not all external tools may be functional.]
 """
 
-@dataclass
-class Flag:
-    type: Literal[
-        "think",
-        "u_out",
-        "continue_conversation",
-        "agent"
-    ]
-    start: bool
-    params: dict = None # set later manually
-
-class FlagParser:
-    flags: dict[str, Flag] = {
-        r"<think>": Flag("think", True),
-        r"</think>": Flag("think", False),
-        r"<u_out>": Flag("u_out", True),
-        r"</u_out>": Flag("u_out", False),
-        r"<continue_conversation />": Flag("continue_conversation", True),
-        r"<\|agent\| (?P<agent_name>[^>]+)>": Flag("agent", True),
-        r"</\|agent\|>": Flag("agent", False)
-    }
-    
-    @classmethod
-    def parse(self, docstr: str) -> Union[Flag, None]:
-        """
-        Go through each flag trigger, check if the last match is at the end.
-        """
-        for pattern, flag in self.flags.items():
-            matches = list(re.finditer(pattern, docstr))
-            if not matches:
-                continue
-            last_match = matches[-1]
-            match_end = last_match.span()[1]
-            if match_end == len(docstr):
-                flag.params = last_match.groupdict()
-                return flag
-        return None
+class FlagParser(FlagTokenizer):
+    flags = FlagTrie({
+        "<think>": Flag("think", True),
+        "</think>": Flag("think", False),
+        "<u_out>": Flag("u_out", True),
+        "</u_out>": Flag("u_out", False),
+        "<continue_conversation />": Flag("continue_conversation", True),
+        "<|agent| {agent_name}>": Flag("agent", True),
+        "</|agent|>": Flag("agent", False)
+    })
+
+SPECULATIVE = tracing.registry.counter(
+    "atlas_speculative_preparations_total", "Agent preparations started while an invocation streamed, by whether it was used."
+)
+
+# closing tags of tool calls, generation stops there (unless several agent invocations per turn are allowed)
+STOP_SEQUENCES = {
+    "agent": "</|agent|>"
+}
 
 class FlagStater:
     """Keeps state of stream flags"""
@@ -130,115 +118,443 @@ class FlagStater:
         self.__dict__[flag.type] = flag.start
 
 class StreamManager:
-    """Manages stream elements"""
-    response = ""
-    u_out = ""
-    agent = {
-        "agent_name": None,
-        "prompt": None
-    }
-    continue_conversation = False
+    """Manages stream elements. All state is per instance, so concurrent streams don't share anything."""
     def __init__(self):
         self.flag_keeper = FlagStater()
-    def feed_char(self, char: str):
-        self.response += char
+        self.agent = {
+            "agent_name": None,
+            "prompt": None
+        }
+        self.continue_conversation = False
+        self._response = TextBuffer()
+        self._u_out = TextBuffer() # the currently open u_out segment
+        self._agent_prompt = TextBuffer()
+        self.u_out_segments: list[str] = [] # closed u_out segments, in order
+        self.invocations: list[dict] = [] # closed agent invocations, in order
+        self._trailing = TextBuffer() # text outside of flags since the last invocation
+    @property
+    def response(self) -> str:
+        return self._response.getvalue()
+    @property
+    def u_out(self) -> str:
+        segments = self.u_out_segments
+        if self._u_out:
+            segments = segments+[self._u_out.getvalue()]
+        return "\n".join(segments)
+    @property
+    def trailing_text(self) -> bool:
+        """Whether anything but whitespace or another invocation followed the last agent invocation."""
+        return bool(self.invocations) and not self._trailing.getvalue().isspace() and bool(self._trailing)
+    def drop_trailing(self):
+        """Removes what followed the last agent invocation from the response."""
+        if self.invocations and self._trailing:
+            text = self._response.getvalue()
+            self._response = TextBuffer(text[:len(text)-len(self._trailing.getvalue())])
+            self._trailing = TextBuffer()
+    def feed(self, text: str):
+        """Feed a stream segment. A segment never runs past the tag of a flag."""
+        self._response.append(text)
+        if self.invocations and not self.flag_keeper.any():
+            self._trailing.append(text)
         if self.flag_keeper.think is True:
             return
         if self.flag_keeper.u_out:
-            self.u_out += char
+            self._u_out.append(text)
         if self.flag_keeper.agent:
-            self.agent["prompt"] += char
-    def handle_flag(self, flag: Flag):
+            self._agent_prompt.append(text)
+    def handle_flag(self, flag: Flag, tag_length: int = 0):
         if self.flag_keeper.any() is True and flag.start == True:
             # allows only one flag to be active at once. nested flags are ignored.
             return
+        was_active = getattr(self.flag_keeper, flag.type)
         self.flag_keeper.set_flag(flag)
-        if flag.type == "u_out" and flag.start == True and self.u_out:
-            self.u_out += "\n"
-        if flag.type == "u_out" and flag.start == False:
-            self.u_out = self.u_out[:-8].strip()
-        if flag.type == "agent" and flag.start == False:
-            self.agent["prompt"] = self.agent["prompt"][:-8].strip()
+        if flag.type == "u_out" and flag.start == True:
+            self._u_out = TextBuffer()
+        if flag.type == "u_out" and flag.start == False and was_active:
+            segment = self._u_out.strip_tag(tag_length)
+            self._u_out = TextBuffer()
+            if segment:
+                self.u_out_segments.append(segment)
+        if flag.type == "agent" and flag.start == False and was_active:
+            self.agent["prompt"] = self._agent_prompt.strip_tag(tag_length)
+            self.invocations.append(dict(self.agent))
+            self._trailing = TextBuffer()
         if flag.type == "agent" and flag.start == True:
             self.agent["agent_name"] = flag.params["agent_name"]
             self.agent["prompt"] = ""
+            self._agent_prompt = TextBuffer()
+            self._trailing = TextBuffer()
         if flag.type == "continue_conversation":
             self.continue_conversation = flag.start
 
 class StreamReader:
-    def __init__(self, stream: Iterable[str]):
-        self.stream = stream
+    """
+    Splits a completion into flags. With `max_think_tokens`, stops (setting `think_cut`) once reasoning runs longer.
+    Also stops at the first text after agent invocations, which would be the model making up their reports.
+    """
+    def __init__(self, stream: Iterable[str], max_think_tokens: int = None):
+        self.completion = stream
+        self.stream = iter(stream)
         self.mstream = StreamManager()
+        self.parser = FlagParser()
+        self.max_think_tokens = max_think_tokens
+        self.think_tokens = 0
+        self.think_cut = False
+        self._segments = None
     def __iter__(self):
         return self
     def __next__(self):
-        for i in self.stream:
-            self.mstream.feed_char(i)
-            print(i, end="", flush=True)
-            flag = FlagParser.parse(self.mstream.response)
-            if flag:
-                self.mstream.handle_flag(flag)
-                return flag
-        raise StopIteration
+        while True:
+            if self._segments is None:
+                chunk = next(self.stream, None)
+                if chunk is None:
+                    chunk = self._stopped_tag()
+                    if chunk is None:
+                        raise StopIteration
+                elif self.mstream.flag_keeper.think:
+                    self.think_tokens += 1
+                    if self.max_think_tokens is not None and self.think_tokens > self.max_think_tokens:
+                        self.think_cut = True
+                        self.close()
+                        raise StopIteration
+                tracing.console.write(chunk)
+                self._segments = self.parser.split(chunk)
+            for segment, flag in self._segments:
+                self.mstream.feed(segment)
+                if flag:
+                    self.mstream.handle_flag(flag, self.parser.match_length)
+                    return flag
+                if self.mstream.trailing_text and not self.parser.matching:
+                    self.close()
+                    raise StopIteration
+            self._segments = None
+    def _stopped_tag(self) -> Union[str, None]:
+        """
+        The provider leaves out the stop sequence that ended generation.
+        If it stopped inside a flag whose closing tag is a stop sequence, that tag is rebuilt.
+        """
+        if getattr(self.completion, "finish_reason", None) != "stop":
+            return None
+        for flag_type, tag in STOP_SEQUENCES.items():
+            if getattr(self.mstream.flag_keeper, flag_type):
+                return tag
+        return None
+    def close(self):
+        """Stops the underlying stream, eg. once a tool call is complete."""
+        if hasattr(self.completion, "close"):
+            self.completion.close()
     def finish(self):
         return self.mstream.response, self.mstream.u_out, self.mstream.continue_conversation
 
+class Invocation:
+    """One agent invocation submitted to an `AgentDispatcher`."""
+    __slots__ = ("agent", "future", "preparation", "started")
+    def __init__(self, agent: Agent, preparation: Preparation = None):
+        self.agent = agent
+        self.future: concurrent.futures.Future = None
+        self.preparation = preparation
+        self.started: float = None # when `process` was called
+    def cancel(self):
+        """Cancels it if it hasn't started; its preparation, which `process` would have released, is released."""
+        if not self.future.cancelled() and self.future.cancel() and self.preparation is not None:
+            self.preparation.release()
+
+class AgentDispatcher:
+    """
+    Runs the agent invocations of one turn, up to `max_workers` at once, and collects their reports in order.
+    An agent that doesn't report within its `timeout` (counted from when it starts) gets an error report instead;
+    its thread is left to finish. Invocations carry the request's cancellation token, and collecting stops
+    as soon as the request is cancelled.
+    """
+    def __init__(self, max_workers: int = 1):
+        self.max_workers = max_workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="agent")
+    def run(self, calls: list[tuple[Agent, str]]) -> list[str]:
+        return self.collect([self.submit(agent, prompt) for agent, prompt in calls])
+    def submit(self, agent: Agent, prompt: str, preparation: Preparation = None) -> Invocation:
+        invocation = Invocation(agent, preparation)
+        kwargs = {"preparation": preparation} if preparation is not None else {}
+        context = contextvars.copy_context()
+        def process():
+            invocation.started = time.monotonic()
+            return context.run(agent.process, prompt, **kwargs)
+        invocation.future = self._executor.submit(process)
+        return invocation
+    def collect(self, submitted: list[Invocation]) -> list[str]:
+        """Reports of submitted invocations, in order. Ends the turn: nothing can be submitted after."""
+        try:
+            return self._collect(submitted)
+        finally:
+            self.shutdown()
+    def _collect(self, submitted: list[Invocation]) -> list[str]:
+        reports = []
+        for invocation in submitted:
+            agent = invocation.agent
+            try:
+                reports.append(self._result(invocation))
+            except cancellation.Cancelled:
+                for other in submitted:
+                    other.cancel()
+                raise
+            except concurrent.futures.TimeoutError:
+                invocation.cancel()
+                cache.mark_uncacheable("agent_error")
+                reports.append(f"ERROR: Agent `{agent.name}` did not report back within {agent.timeout:g} seconds.")
+            except Exception as e:
+                cache.mark_uncacheable("agent_error")
+                reports.append(f"ERROR: Agent `{agent.name}` failed: {e!r}")
+        return reports
+    @staticmethod
+    def _result(invocation: Invocation) -> str:
+        future = invocation.future
+        cancelled = concurrent.futures.Future()
+        with cancellation.on_cancel(lambda: cancelled.set_result(None)):
+            if invocation.agent.timeout is None:
+                concurrent.futures.wait([future, cancelled], return_when=concurrent.futures.FIRST_COMPLETED)
+            else:
+                while not future.done() and not cancelled.done():
+                    # until it has started, its timeout starts no earlier than now
+                    start = invocation.started or time.monotonic()
+                    timeout = start+invocation.agent.timeout-time.monotonic()
+                    if timeout <= 0:
+                        break
+                    concurrent.futures.wait([future, cancelled], timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+        cancellation.check()
+        return future.result(0)
+    def shutdown(self):
+        """Threads of agents still running are left to finish."""
+        self._executor.shutdown(wait=False)
+
+class SpeculativeDispatch:
+    """
+    Prepares the invoked agent as soon as an `<|agent|>` tag opens, and submits the invocation
+    the moment it closes instead of after the stream ends. `abort` cleans up what wasn't used.
+    With `hold`, as long as the turn may still be retried, invocations are only submitted by `collect`
+    once it's kept, so that a retried turn doesn't run them (and their side effects) twice.
+    """
+    def __init__(self, dispatcher: AgentDispatcher, agents: dict[str, Agent], hold: bool = False):
+        self.dispatcher = dispatcher
+        self.agents = agents
+        self.hold = hold
+        self.submitted: list[Invocation] = []
+        self.held: list[tuple[Agent, str, Preparation]] = []
+        self._preparation: tuple[str, Preparation] = None # (agent name, preparation) of the open invocation
+    def opened(self, agent_name: str):
+        self._release()
+        agent = self.agents.get(agent_name)
+        preparation = agent.prepare() if agent is not None else None
+        if preparation is not None:
+            self._preparation = (agent_name, preparation)
+    def closed(self, invocation: dict):
+        agent = self.agents.get(invocation["agent_name"])
+        preparation = None
+        if self._preparation is not None and self._preparation[0] == invocation["agent_name"]:
+            preparation = self._preparation[1]
+            self._preparation = None
+            SPECULATIVE.inc(agent=invocation["agent_name"], outcome="used")
+        if agent is None:
+            return
+        if self.hold:
+            self.held.append((agent, invocation["prompt"], preparation))
+        else:
+            self.submitted.append(self.dispatcher.submit(agent, invocation["prompt"], preparation))
+    def collect(self) -> list[str]:
+        self._release()
+        for agent, prompt, preparation in self.held:
+            self.submitted.append(self.dispatcher.submit(agent, prompt, preparation))
+        self.held = []
+        return self.dispatcher.collect(self.submitted)
+    def abort(self):
+        """The turn is retried or ended without invocations: releases the preparations and cancels what hasn't started."""
+        self._release()
+        for invocation in self.submitted:
+            invocation.cancel()
+        for _, _, preparation in self.held:
+            if preparation is not None:
+                preparation.release()
+        self.submitted = []
+        self.held = []
+        self.dispatcher.shutdown()
+    def _release(self):
+        if self._preparation is not None:
+            agent_name, preparation = self._preparation
+            self._preparation = None
+            preparation.release()
+            SPECULATIVE.inc(agent=agent_name, outcome="released")
+
+class UOutEmitter:
+    """
+    Passes `<u_out>` segments on to `on_u_out` as they close. What a discarded turn said can't be taken back,
+    so when a turn is generated again, segments repeating (in order) what was already said are skipped.
+    """
+    def __init__(self, on_u_out: Callable[[str], None]):
+        self.on_u_out = on_u_out
+        self.spoken: list[str] = [] # segments said for the current turn, over its attempts
+        self._position = 0 # segments of the current attempt
+    def emit(self, segment: str):
+        if self._position < len(self.spoken) and self.spoken[self._position] == segment:
+            self._position += 1
+            return
+        del self.spoken[self._position:]
+        self.spoken.append(segment)
+        self._position += 1
+        self.on_u_out(segment)
+    def retry(self):
+        """The turn is thrown away and generated again."""
+        self._position = 0
+    def accept(self):
+        """The turn is kept, the next one starts afresh."""
+        self.spoken = []
+        self._position = 0
+
 class SupervisorAgent(Agent):
     TEMPERATURE = 0.5
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.context_budget = context.ContextBudget()
+        self.set_max_parallel_agents(1)
+        self.speculative = False
+    def set_speculative(self, speculative: bool):
+        """Prepare invoked agents while their invocation streams and start them as soon as it closes."""
+        self.speculative = speculative
+    def set_max_parallel_agents(self, max_parallel_agents: int):
+        """
+        Agent invocations acted on per turn, all of them run in parallel (each turn of each request has its own threads).
+        With more than one, generation can't stop at the first closing tag (the provider's stop sequence),
+        so the stream is cut at the first text after the invocations.
+        """
+        self.max_parallel_agents = max_parallel_agents
+        self.llm.set_stop_sequence(list(STOP_SEQUENCES.values()) if max_parallel_agents == 1 else None)
     def delegate_agents(self, agents: Agents):
         self.agents = agents
-    def _handle_stream(self, stream: Iterable[str]) -> dict:
-        streamr = StreamReader(stream)
+    def set_context_budget(self, context_budget: context.ContextBudget):
+        self.context_budget = context_budget
+    def _handle_stream(
+            self,
+            stream: Iterable[str],
+            on_u_out: Callable[[str], None] = None,
+            max_think_tokens: int = None,
+            speculative: SpeculativeDispatch = None
+        ) -> dict:
+        streamr = StreamReader(stream, max_think_tokens)
+        emitted = 0
+        dispatched = 0
         for f in streamr:
-            if f.type == "agent" and f.start == False:
-                agent_invocation = streamr.mstream.agent
-                response, u_out, continue_conversation = streamr.finish()
-                return {
-                    "_": "agent_invocation",
-                    "response": response,
-                    "u_out": u_out,
-                    "continue_conversation": continue_conversation,
-                    "agent_invocation": agent_invocation
-                }
+            if on_u_out is not None and len(streamr.mstream.u_out_segments) > emitted:
+                for segment in streamr.mstream.u_out_segments[emitted:]:
+                    on_u_out(segment)
+                emitted = len(streamr.mstream.u_out_segments)
+            if speculative is not None and f.type == "agent" and dispatched < self.max_parallel_agents:
+                if f.start and streamr.mstream.flag_keeper.agent:
+                    speculative.opened(streamr.mstream.agent["agent_name"])
+                elif not f.start and len(streamr.mstream.invocations) > dispatched:
+                    dispatched = len(streamr.mstream.invocations)
+                    speculative.closed(streamr.mstream.invocations[-1])
+            if not streamr.mstream.invocations:
+                continue
+            if f.type == "agent" and (f.start or len(streamr.mstream.invocations) < self.max_parallel_agents):
+                continue
+            # anything else after the invocations isn't acted on
+            streamr.close()
+            break
+        streamr.mstream.drop_trailing()
         response, u_out, continue_conversation = streamr.finish()
+        if streamr.mstream.invocations:
+            return {
+                "_": "agent_invocation",
+                "response": response,
+                "u_out": u_out,
+                "continue_conversation": continue_conversation,
+                "agent_invocations": streamr.mstream.invocations[:self.max_parallel_agents]
+            }
         return {
-            "_": "finish",
+            "_": "think_cut" if streamr.think_cut else "finish",
             "response": response,
             "u_out": u_out,
-            "continue_conversation": continue_conversation
+            "continue_conversation": continue_conversation,
+            "unclosed": any(getattr(streamr.mstream.flag_keeper, i) for i in ("think", "u_out", "agent")) # ended inside a tag
         }
-    def _process(self, prompt: models.hass.PromptPayload):
+    @tracing.traced("supervisor.process")
+    def _process(self, prompt: models.hass.PromptPayload, on_u_out: Callable[[str], None] = None):
+        """
+        `on_u_out` is called with each `<u_out>` segment as soon as it closes.
+        A segment already said by a turn that was retried isn't said again.
+        """
         prompt_text = self._generate_hass_user_prompt(prompt)
         prompt.history.add_user(prompt_text)
         u_out = ""
+        cascade = self.cascade()
+        think = self.reasoning.think(prompt.text or "")
+        agents = {i.name: i for i in self.agents.agents}
+        emitter = UOutEmitter(on_u_out) if on_u_out is not None else None
         while True:
-            result = self._handle_stream(
-                self.llm.complete(prompt.history, SYSTEM, self.TEMPERATURE)
-            )
+            history, system_prompt = self.context_budget.fit(prompt.history, SYSTEM, prompt.conversation_id)
+            speculative = SpeculativeDispatch(
+                AgentDispatcher(self.max_parallel_agents), agents, hold=not cascade.last
+            ) if self.speculative else None
+            try:
+                result = self._handle_stream(
+                    self.llm.complete(history if think else without_thinking(history), system_prompt, self.TEMPERATURE, cascade.model_name),
+                    emitter.emit if emitter is not None else None,
+                    self.reasoning.max_think_tokens if think else None,
+                    speculative
+                )
+            except BaseException:
+                if speculative is not None:
+                    speculative.abort()
+                raise
+            if speculative is not None and result["_"] != "agent_invocation":
+                speculative.abort()
+            tracing.console.print()
+            if result["_"] == "think_cut":
+                THINK_CUTOFFS.inc(agent=self.name)
+                think = False
+                if emitter is not None:
+                    emitter.retry()
+                continue
+            think = self.reasoning.think(prompt.text or "")
+            if result["_"] == "finish" and result["unclosed"] and cascade.escalate("unclosed_tag"):
+                if emitter is not None:
+                    emitter.retry()
+                continue
             u_out += result["u_out"]
-            print()
             if result["_"] == "finish":
-                print("\n")
+                tracing.console.print("\n")
+                cascade.served()
                 return result["response"], u_out, result["continue_conversation"]
             if result["_"] == "agent_invocation":
-                print(f"[AGENT_INVOCATION {result['agent_invocation']['agent_name']}]:", result["agent_invocation"]["prompt"])
-                agent_invocation = result["agent_invocation"]
-                agent = None
-                for i in self.agents.agents:
-                    if agent_invocation["agent_name"] == i.name:
-                        agent = i
-                        break
-                if agent is None:
-                    prompt.history.add_tool(
-                        f"ERROR: Agent `{agent_invocation['agent_name']}` not found. Report if surprising after re-verification.",
-                        "agent_invoker"
-                    )
+                invocations = result["agent_invocations"]
+                for agent_invocation in invocations:
+                    tracing.console.print(f"[AGENT_INVOCATION {agent_invocation['agent_name']}]:", agent_invocation["prompt"])
+                if any(i["agent_name"] not in agents for i in invocations) and cascade.escalate("unknown_agent"):
+                    if speculative is not None:
+                        speculative.abort()
+                    u_out = u_out[:len(u_out)-len(result["u_out"])]
+                    if emitter is not None:
+                        emitter.retry()
                     continue
+                if emitter is not None:
+                    emitter.accept()
                 prompt.history.add_assistant(result["response"], u_out)
-                agent_report = agent.process(agent_invocation["prompt"])
-                prompt.history.add_tool(agent_report, agent_invocation["agent_name"])
+                if speculative is not None:
+                    reports = iter(speculative.collect())
+                else:
+                    calls = [(agents[i["agent_name"]], i["prompt"]) for i in invocations if i["agent_name"] in agents]
+                    reports = iter(AgentDispatcher(self.max_parallel_agents).run(calls))
+                for agent_invocation in invocations:
+                    if agent_invocation["agent_name"] in agents:
+                        prompt.history.add_tool(next(reports), agent_invocation["agent_name"])
+                    else:
+                        cache.mark_uncacheable("agent_error")
+                        prompt.history.add_tool(
+                            f"ERROR: Agent `{agent_invocation['agent_name']}` not found. Report if surprising after re-verification.",
+                            "agent_invoker"
+                        )
+    def add_direct_answer(self, prompt: models.hass.PromptPayload, tts_text: str, continue_conversation: bool = False):
+        """Records a turn answered without the LLM loop (eg. by the pre-router) as if the supervisor had answered it."""
+        prompt.history.add_user(self._generate_hass_user_prompt(prompt))
+        response = f"<u_out>{tts_text}</u_out>"+(" <continue_conversation />" if continue_conversation else "")
+        prompt.history.add_assistant(response, tts_text)
     def _generate_hass_user_prompt(self, prompt: models.hass.PromptPayload) -> str:
         prompt_text = "\n".join((
             prompt.text,
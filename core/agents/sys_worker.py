@@ -1,18 +1,23 @@
 """System Worker agents for ATLAS."""
 
-from typing import Iterable, Literal, Union
-from dataclasses import dataclass
+from typing import Iterable, Union
 
-from . import Agent
+from . import Agent, Preparation, THINK_CUTOFFS, without_thinking
+from .stream import Flag, FlagTrie, FlagTokenizer, TextBuffer
 from .. import (
-    models
+    models,
+    admission,
+    cache,
+    cancellation,
+    context,
+    tracing,
+    sandbox
 )
 
-import re
 import datetime
-import subprocess
+import re
 import secrets
-import os
+import threading
 
 SYSTEM = """
 You are a specialized agent within ATLAS, a multi-agent AI architecture designed to solve complex problems through collaborative intelligence.
@@ -56,6 +61,15 @@ Once you receive your program's output as a tool response, you should reason abo
 After completing your main task, you should verify whether the task was successfully completed or not.
 Don't run code that would take longer than a few seconds. Implement timeouts for every operation that may take longer than anticipated.
 
+# Memory
+The Python runtime has a `memory` module with the household's memory store, which persists between tasks.
+It's shared by everyone in the household, so a fact about one person should name them (eg. "Alice is allergic to peanuts"):
+- `memory.search(query, k=5)`: the closest memories, best first, as dicts with `id`, `text`, `created` (Unix time) and `score`
+- `memory.add(text)`: remembers one fact (one short sentence per call works best) and returns its id
+- `memory.forget(id)`: removes a memory, eg. one that's outdated
+- `memory.recent(n=10)`: the latest memories
+Check memory before working something out again or asking for it, and remember facts worth keeping, such as what the user asks you to remember.
+
 # Things To Keep In Mind
 Remember that you are talking to the supervisor agent, not to the user.
 You should communicate effectively with the supervisor in order to collectively be an efficient and truly helpful system.
@@ -68,40 +82,32 @@ Do not assume or make up information at any cost.
 [You are currently under development, so not all external tools may be functional.]
 """
 
-@dataclass
-class Flag:
-    type: Literal[
-        "think",
-        "s_out",
-        "python"
-    ]
-    start: bool
-
-class FlagParser:
-    flags: dict[str, Flag] = {
-        r"<think>": Flag("think", True),
-        r"</think>": Flag("think", False),
-        r"<s_out>": Flag("s_out", True),
-        r"</s_out>": Flag("s_out", False),
-        r"<\|python\|>": Flag("python", True),
-        r"</\|python\|>": Flag("python", False)
-    }
-    
-    @classmethod
-    def parse(self, docstr: str) -> Union[Flag, None]:
-        """
-        Go through each flag trigger, check if the last match is at the end.
-        """
-        for pattern, flag in self.flags.items():
-            matches = list(re.finditer(pattern, docstr))
-            if not matches:
-                continue
-            last_match = matches[-1]
-            match_end = last_match.span()[1]
-            if match_end == len(docstr):
-                flag.params = last_match.groupdict()
-                return flag
-        return None
+# code known to change something outside the sandbox; cached answers, which may depend on the old state, are dropped
+SIDE_EFFECTS = re.compile(
+    r"\b(?:requests|httpx|session|client)\.(?:post|put|patch|delete)\b"
+    r"|\bmethod\s*=\s*['\"](?:POST|PUT|PATCH|DELETE)['\"]"
+    r"|\b(?:urlopen|Request)\([^)]*\bdata\s*="
+    r"|/api/services/"
+    r"|\b(?:subprocess|smtplib|paramiko)\b"
+    r"|\bos\.(?:system|popen|kill|remove|unlink|rename|rmdir)\b"
+    r"|\bshutil\.(?:rmtree|move)\b"
+    r"|\bmemory\.(?:add|forget)\b"
+)
+
+class FlagParser(FlagTokenizer):
+    flags = FlagTrie({
+        "<think>": Flag("think", True),
+        "</think>": Flag("think", False),
+        "<s_out>": Flag("s_out", True),
+        "</s_out>": Flag("s_out", False),
+        "<|python|>": Flag("python", True),
+        "</|python|>": Flag("python", False)
+    })
+
+# closing tags of tool calls, generation stops there
+STOP_SEQUENCES = {
+    "python": "</|python|>"
+}
 
 class FlagStater:
     """Keeps state of stream flags"""
@@ -119,57 +125,126 @@ class FlagStater:
 
 class StreamManager:
     """Manages stream elements"""
-    response = ""
-    s_out = ""
-    python = ""
     def __init__(self):
         self.flag_keeper = FlagStater()
-    def feed_char(self, char: str):
-        self.response += char
+        self._response = TextBuffer()
+        self._s_out = TextBuffer()
+        self._python = TextBuffer()
+    @property
+    def response(self) -> str:
+        return self._response.getvalue()
+    @property
+    def s_out(self) -> str:
+        return self._s_out.getvalue()
+    @property
+    def python(self) -> str:
+        return self._python.getvalue()
+    def feed(self, text: str):
+        """Feed a stream segment. A segment never runs past the tag of a flag."""
+        self._response.append(text)
         if self.flag_keeper.think is True:
             return
         if self.flag_keeper.s_out:
-            self.s_out += char
+            self._s_out.append(text)
         if self.flag_keeper.python:
-            self.python += char
-    def handle_flag(self, flag: Flag):
+            self._python.append(text)
+    def handle_flag(self, flag: Flag, tag_length: int = 0):
         if self.flag_keeper.any() is True and flag.start == True:
             # allows only one flag to be active at once. nested flags are ignored.
             return
+        was_active = getattr(self.flag_keeper, flag.type)
         self.flag_keeper.set_flag(flag)
-        if flag.type == "s_out" and flag.start == True and self.s_out:
-            self.s_out += "\n"
-        if flag.type == "s_out" and flag.start == False:
-            self.s_out = self.s_out[:-8].strip()
-        if flag.type == "python" and flag.start == False:
-            self.python = self.python[:-11].strip()
+        if flag.type == "s_out" and flag.start == True and self._s_out:
+            self._s_out.append("\n")
+        if flag.type == "s_out" and flag.start == False and was_active:
+            self._s_out.strip_tag(tag_length)
+        if flag.type == "python" and flag.start == False and was_active:
+            self._python.strip_tag(tag_length)
 
 class StreamReader:
-    def __init__(self, stream: Iterable[str]):
-        self.stream = stream
+    """Splits a completion into flags. With `max_think_tokens`, stops (setting `think_cut`) once reasoning runs longer."""
+    def __init__(self, stream: Iterable[str], max_think_tokens: int = None):
+        self.completion = stream
+        self.stream = iter(stream)
         self.mstream = StreamManager()
+        self.parser = FlagParser()
+        self.max_think_tokens = max_think_tokens
+        self.think_tokens = 0
+        self.think_cut = False
+        self._segments = None
     def __iter__(self):
         return self
     def __next__(self):
-        for i in self.stream:
-            self.mstream.feed_char(i)
-            print(i, end="", flush=True)
-            flag = FlagParser.parse(self.mstream.response)
-            if flag:
-                self.mstream.handle_flag(flag)
-                return flag
-        raise StopIteration
+        while True:
+            if self._segments is None:
+                chunk = next(self.stream, None)
+                if chunk is None:
+                    chunk = self._stopped_tag()
+                    if chunk is None:
+                        raise StopIteration
+                elif self.mstream.flag_keeper.think:
+                    self.think_tokens += 1
+                    if self.max_think_tokens is not None and self.think_tokens > self.max_think_tokens:
+                        self.think_cut = True
+                        self.close()
+                        raise StopIteration
+                tracing.console.write(chunk)
+                self._segments = self.parser.split(chunk)
+            for segment, flag in self._segments:
+                self.mstream.feed(segment)
+                if flag:
+                    self.mstream.handle_flag(flag, self.parser.match_length)
+                    return flag
+            self._segments = None
+    def _stopped_tag(self) -> Union[str, None]:
+        """
+        The provider leaves out the stop sequence that ended generation.
+        If it stopped inside a flag whose closing tag is a stop sequence, that tag is rebuilt.
+        """
+        if getattr(self.completion, "finish_reason", None) != "stop":
+            return None
+        for flag_type, tag in STOP_SEQUENCES.items():
+            if getattr(self.mstream.flag_keeper, flag_type):
+                return tag
+        return None
+    def close(self):
+        """Stops the underlying stream, eg. once a tool call is complete."""
+        if hasattr(self.completion, "close"):
+            self.completion.close()
     def finish(self):
         return self.mstream.response, self.mstream.s_out
 
+class SandboxPreparation(Preparation):
+    """Forks the sandbox session and warms the provider connection on a background thread."""
+    def __init__(self, agent: Agent):
+        self.env_id = secrets.token_hex(16)
+        self._sandbox_ready = threading.Event()
+        threading.Thread(target=self._warm, args=(agent,), daemon=True).start()
+    def _warm(self, agent: Agent):
+        try:
+            sandbox.pool.prepare(self.env_id)
+        except Exception:
+            pass # `run` starts it again, and reports the error
+        finally:
+            self._sandbox_ready.set()
+        agent.llm.warm()
+    def release(self):
+        self._sandbox_ready.wait()
+        sandbox.pool.release(self.env_id)
+
 class SysWorkerAgent(Agent):
     TEMPERATURE = 0.5
+    MAX_FAILED_CALLS = 2 # python calls failing in a row before escalating to the next model
+    CACHEABLE = False # whether answers code ran for may be cached; only for workers whose code can't change anything
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-    def _handle_stream(self, stream: Iterable[str]) -> dict:
-        streamr = StreamReader(stream)
+        self.llm.set_stop_sequence(list(STOP_SEQUENCES.values()))
+        self.llm.set_priority(admission.BACKGROUND) # the user is waiting on the supervisor's turns first
+    def _handle_stream(self, stream: Iterable[str], max_think_tokens: int = None) -> dict:
+        streamr = StreamReader(stream, max_think_tokens)
         for f in streamr:
             if f.type == "python" and f.start == False:
+                streamr.close()
                 python_call = streamr.mstream.python
                 response, s_out = streamr.finish()
                 return {
@@ -180,35 +255,67 @@ class SysWorkerAgent(Agent):
                 }
         response, s_out = streamr.finish()
         return {
-            "_": "finish",
+            "_": "think_cut" if streamr.think_cut else "finish",
             "response": response,
-            "s_out": s_out
+            "s_out": s_out,
+            "unclosed": streamr.mstream.flag_keeper.any() # ended inside a tag
         }
-    def process(self, prompt: str):
+    def prepare(self) -> SandboxPreparation:
+        return SandboxPreparation(self)
+    @tracing.traced("sys_worker.process")
+    def process(self, prompt: str, preparation: SandboxPreparation = None):
         prompt_text = self._generate_prompt(prompt)
-        python_runtime_env_id = secrets.token_hex(16)
+        python_runtime_env_id = preparation.env_id if preparation is not None else secrets.token_hex(16)
         history = [
             {"role": "user", "content": prompt_text}
         ]
         s_out = ""
-        while True:
-            result = self._handle_stream(
-                self.llm.complete(
-                    models.chat.History(history),
-                    SYSTEM,
-                    self.TEMPERATURE
+        cascade = self.cascade()
+        failed_calls = 0
+        think = self.reasoning.think(prompt)
+        try:
+            while True:
+                result = self._handle_stream(
+                    self.llm.complete(
+                        models.chat.History(history) if think else without_thinking(models.chat.History(history)),
+                        SYSTEM,
+                        self.TEMPERATURE,
+                        cascade.model_name
+                    ),
+                    self.reasoning.max_think_tokens if think else None
                 )
-            )
-            print()
-            if result["_"] == "finish":
-                print("\n")
-                s_out += result["s_out"]+"\n"
-                break
-            if result["_"] == "python_call":
-                print("[PYTHON_CODE]:", result["python_call"])
-                history.append({"role": "assistant", "content": result["response"]})
-                python_result = execute_python(result["python_call"], python_runtime_env_id)
-                history.append({"role": "tool", "content": python_result, "tool_call_id": "python"})
+                tracing.console.print()
+                if result["_"] == "think_cut":
+                    THINK_CUTOFFS.inc(agent=self.name)
+                    think = False
+                    continue
+                think = self.reasoning.think(prompt)
+                if result["_"] == "finish":
+                    if result["unclosed"] and cascade.escalate("unclosed_tag"):
+                        continue
+                    tracing.console.print("\n")
+                    s_out += result["s_out"]+"\n"
+                    break
+                if result["_"] == "python_call":
+                    tracing.console.print("[PYTHON_CODE]:", result["python_call"])
+                    history.append({"role": "assistant", "content": context.strip_think(result["response"])})
+                    if SIDE_EFFECTS.search(result["python_call"]):
+                        cache.mark_uncacheable("side_effects", invalidate=True)
+                    elif not self.CACHEABLE:
+                        cache.mark_uncacheable("ran_code") # side effects the pattern misses
+                    python_result = execute_python(result["python_call"], python_runtime_env_id)
+                    history.append({"role": "tool", "content": python_result, "tool_call_id": "python"})
+                    failed_calls = failed_calls+1 if is_error(python_result) else 0
+                    if failed_calls:
+                        cache.mark_uncacheable("sandbox_error")
+                    if failed_calls >= self.MAX_FAILED_CALLS and cascade.escalate("sandbox_errors"):
+                        failed_calls = 0
+        finally:
+            if preparation is not None:
+                preparation.release() # waits for a session still being forked
+            else:
+                sandbox.pool.release(python_runtime_env_id)
+        cascade.served()
         return s_out.strip()
     def _generate_prompt(self, prompt: str) -> str:
         prompt_text = "\n".join((
@@ -219,24 +326,24 @@ class SysWorkerAgent(Agent):
         ))
         return prompt_text
 
+def is_error(python_result: str) -> bool:
+    """Whether a sandbox result is an uncaught exception, a timeout or a crash."""
+    return (
+        "Traceback (most recent call last):" in python_result
+        or python_result.startswith(("TimeoutError:", "SandboxError:"))
+    )
+
 def execute_python(python_call: str, env_id: str = None) -> str:
     if env_id is None:
         env_id = secrets.token_hex(16)
-    path = f"/tmp/{env_id}/"
-    if not os.path.exists(path):
-        os.mkdir(path)
-    script_path = path+f"{secrets.token_hex(8)}.py"
-    with open(script_path, "w") as f:
-        f.write(python_call)
-    result = run_sandboxed(script_path, path)
-    print("[PYTHON_RESULT]:", result)
+    result = run_sandboxed(python_call, env_id)
+    tracing.console.print("[PYTHON_RESULT]:", result)
     return result
 
-def run_sandboxed(script_path, working_dir="/tmp/"):
-    result = subprocess.run([
-        "su", "-c", f"cd {working_dir} && python3 {script_path}", "sandbox"
-    ], capture_output=True, text=True, timeout=30)
-    output = result.stdout
-    if result.stderr:
-        output += result.stderr
-    return output
\ No newline at end of file
+@tracing.traced("sandbox.run")
+def run_sandboxed(code: str, env_id: str, timeout: float = 30) -> str:
+    """If the request is cancelled meanwhile, the session (and its process group) is killed and `Cancelled` raised."""
+    with cancellation.on_cancel(lambda: sandbox.pool.release(env_id)):
+        result = sandbox.pool.run(code, env_id, timeout)
+    cancellation.check()
+    return result
@@ -1,8 +1,23 @@
 """High-level API for ATLAS."""
 
+from contextlib import contextmanager
+from typing import Callable, Iterator
+import os
+import queue
+import threading
+
 from . import (
     models,
-    agents
+    admission,
+    agents,
+    database,
+    context,
+    cache,
+    cancellation,
+    router,
+    llm,
+    sandbox,
+    tracing
 )
 
 class ATLAS:
@@ -12,9 +27,169 @@ class ATLAS:
         self.agents.supervisor.delegate_agents(agents.Agents([
             self.agents.sys_worker
         ]))
-    def process_hass_user(self, prompt: models.hass.PromptPayload) -> dict:
-        continue_conversation = self.agents.supervisor.process(prompt)
-        return models.hass.generate_response_payload(
-            history=prompt.history,
-            continue_conversation=continue_conversation
+        self.agents.supervisor.set_context_budget(context.ContextBudget(
+            config.context.max_prompt_tokens,
+            config.context.tool_output_chars,
+            config.context.summary_tokens,
+            config.database.conversation_cache_size
+        ))
+        self.agents.supervisor.set_max_parallel_agents(config.dispatch.max_parallel_agents)
+        self.agents.supervisor.set_speculative(config.dispatch.speculative)
+        self.router = self._router(config.router)
+        self.responses = cache.ResponseCache(
+            config.cache.ttl,
+            config.cache.time_bucket,
+            config.cache.max_entries,
+            config.database.path if config.cache.persist else None
+        ) if config.cache.enabled else None
+        self._configure_sandbox(config.sandbox, config.memory)
+        self.admission = self._configure_admission(config.admission)
+        tracing.console.enabled = config.debug.echo_stream
+        for agent in self.agents.agents:
+            agent.llm.warm()
+        self.conversations = database.ConversationStore(
+            config.database.path,
+            config.database.conversation_ttl,
+            config.database.conversation_cache_size
+        )
+        self._running: dict[str, cancellation.Token] = {} # conversation id -> token of the request running in it
+        self._running_lock = threading.Lock()
+    def process_hass_user(
+            self,
+            prompt: models.hass.PromptPayload,
+            on_u_out: Callable[[str], None] = None,
+            token: cancellation.Token = None
+        ) -> dict:
+        """
+        If the payload has no `history`, it's loaded from the conversation store and
+        only the messages added by this request are sent back.
+        Raises `cancellation.Cancelled` if `token` (by default, one with the configured deadline) is cancelled,
+        or another request in the same conversation pre-empts this one, and `admission.Rejected` if the user
+        is over their rate or the provider too busy. Nothing is stored then.
+        """
+        if token is None:
+            token = cancellation.Token(self.config.requests.timeout)
+        if self.admission is not None:
+            try:
+                self.admission.admit(prompt.user.id)
+            except admission.Rejected:
+                token.finish()
+                raise
+        with self._preempt(prompt.conversation_id, token), cancellation.scope(token), admission.as_user(prompt.user.id), \
+                tracing.trace() as trace, tracing.span("request"):
+            since = None
+            if not prompt.history_provided and prompt.conversation_id:
+                prompt.history = self.conversations.get(prompt.conversation_id) or prompt.history
+                since = len(prompt.history.history)
+            key = self.responses.key(prompt) if self.responses is not None else None
+            answer = self.router.route(prompt) if self.router is not None else None
+            if answer is None and key is not None:
+                answer = self.responses.get(key)
+            if answer is None:
+                with cache.request() as request:
+                    try:
+                        continue_conversation = self.agents.supervisor.process(prompt, on_u_out=on_u_out)
+                    except (cancellation.Cancelled, admission.Rejected):
+                        self._cache_answer(None, request, None, False) # code that ran may still have changed something
+                        raise
+                self._cache_answer(key, request, prompt.history.history[-1].tts_text, continue_conversation)
+            else:
+                self.agents.supervisor.add_direct_answer(prompt, answer.tts_text, answer.continue_conversation)
+                continue_conversation = answer.continue_conversation
+                if on_u_out is not None:
+                    on_u_out(answer.tts_text)
+            token.check()
+            if prompt.conversation_id:
+                with tracing.span("conversation_store.put"):
+                    self.conversations.put(prompt.conversation_id, prompt.history, since or 0)
+            with tracing.span("serialize"):
+                payload = models.hass.generate_response_payload(
+                    history=prompt.history,
+                    continue_conversation=continue_conversation,
+                    since=since
+                )
+        tracing.console.print("[TRACE]:", trace.summary())
+        return payload
+    @contextmanager
+    def _preempt(self, conversation_id: str, token: cancellation.Token):
+        """Registers `token` as the conversation's running request, cancelling the one it replaces."""
+        if not conversation_id or not self.config.requests.preempt:
+            yield
+            return
+        with self._running_lock:
+            previous = self._running.get(conversation_id)
+            self._running[conversation_id] = token
+        if previous is not None:
+            previous.cancel("preempted")
+        try:
+            yield
+        finally:
+            with self._running_lock:
+                if self._running.get(conversation_id) is token:
+                    del self._running[conversation_id]
+    def _cache_answer(self, key: str, request: cache.Request, tts_text: str, continue_conversation: bool):
+        if self.responses is None:
+            return
+        if request.invalidate:
+            self.responses.invalidate()
+        if key is not None and tts_text and not request.uncacheable:
+            self.responses.put(key, router.Answer(tts_text, continue_conversation))
+    def _router(self, config: models.config.RouterConfig) -> router.PreRouter:
+        if not config.enabled:
+            return None
+        stages = [("patterns", router.PatternStage(config.intents))]
+        if config.provider_config is not None:
+            _llm = llm.factory(config.provider_config)
+            _llm.set_model_name(config.model_name)
+            _llm.warm()
+            stages.append(("llm", router.LLMStage(_llm)))
+        return router.PreRouter(stages)
+    def _configure_admission(self, config: models.config.AdmissionConfig) -> admission.UserLimiter:
+        admission.providers.configure(
+            config.max_concurrent if config.enabled else 0,
+            config.max_queue,
+            config.queue_timeout,
+            config.provider_limits if config.enabled else None
         )
+        if not config.enabled or not config.user_rate:
+            return None
+        return admission.UserLimiter(config.user_rate, config.user_burst)
+    def _configure_sandbox(self, config: models.config.SandboxConfig, memory: models.config.MemoryConfig):
+        pool = sandbox.pool
+        pool.memory_path = os.path.abspath(memory.path) if memory.enabled else None
+        pool.max_output = config.max_output_bytes
+        pool.set_max_concurrent(config.max_concurrent)
+        pool.queue_timeout = config.queue_timeout
+        pool.memory_bytes = config.memory_mb*1024*1024 or None
+        pool.cpu_seconds = config.cpu_seconds or None
+        pool.open_files = config.max_open_files or None
+        pool.workspace_ttl = config.workspace_ttl
+        pool.workspace_max_bytes = config.workspace_max_mb*1024*1024 or None
+    def stream_hass_user(self, prompt: models.hass.PromptPayload, token: cancellation.Token = None) -> Iterator[dict]:
+        """
+        Like `process_hass_user`, but yields frames as the supervisor produces them:
+        a `u_out` frame per sentence of each closed `<u_out>` segment, then one `final` frame with the response payload.
+        Closing the generator before the `final` frame (eg. the client disconnected) cancels the request.
+        """
+        if token is None:
+            token = cancellation.Token(self.config.requests.timeout)
+        frames = queue.Queue()
+        def on_u_out(segment: str):
+            for sentence in models.hass.split_sentences(segment):
+                frames.put({"event": "u_out", "text": sentence})
+        def run():
+            try:
+                frames.put({"event": "final", "data": self.process_hass_user(prompt, on_u_out, token)})
+            except admission.Rejected as e:
+                frames.put({"event": "error", "error": repr(e), "tts_text": e.tts_text, "retry_after": e.retry_after})
+            except Exception as e:
+                frames.put({"event": "error", "error": repr(e)})
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            while True:
+                frame = frames.get()
+                yield frame
+                if frame["event"] != "u_out":
+                    return
+        finally:
+            token.cancel("disconnected") # does nothing once the request finished
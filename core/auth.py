@@ -0,0 +1,77 @@
+"""Bearer token authentication."""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+def _digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+class TokenIndex:
+    """
+    In-memory index of the tokens in an auth token file (one per line), kept as SHA-256 digests.
+    The file is re-read only when its inode, size or mtime change, checked at most every `check_interval` seconds.
+    Rejected tokens are remembered for `negative_ttl` seconds, so repeated bad tokens are answered from memory.
+    A missing or unreadable file rejects everything.
+    """
+    NEGATIVE_CACHE_SIZE = 4096
+    def __init__(self, path: str, check_interval: float = 1.0, negative_ttl: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.negative_ttl = negative_ttl
+        self._digests: tuple[bytes, ...] = ()
+        self._stat: tuple = None
+        self._next_check = 0.0
+        self._rejected: dict[bytes, float] = {}
+        self._lock = threading.Lock()
+    def check(self, token: str) -> bool:
+        if not token:
+            return False
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._refresh(now)
+        digest = _digest(token)
+        expires = self._rejected.get(digest)
+        if expires is not None and now < expires:
+            return False
+        valid = False
+        for known in self._digests: # no early exit, the time taken doesn't depend on which token matched
+            valid |= hmac.compare_digest(digest, known)
+        if not valid:
+            with self._lock:
+                if len(self._rejected) >= self.NEGATIVE_CACHE_SIZE:
+                    self._rejected = {k: v for k, v in self._rejected.items() if v > now}
+                    if len(self._rejected) >= self.NEGATIVE_CACHE_SIZE:
+                        self._rejected.clear()
+                self._rejected[digest] = now+self.negative_ttl
+        return valid
+    def reload(self):
+        """Forces a re-read of the token file."""
+        with self._lock:
+            self._stat = None
+            self._next_check = 0.0
+        self._refresh(time.monotonic())
+    def _refresh(self, now: float):
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now+self.check_interval
+            try:
+                st = os.stat(self.path)
+                stat = (st.st_ino, st.st_dev, st.st_size, st.st_mtime_ns)
+            except OSError:
+                stat = None
+            if stat == self._stat and stat is not None:
+                return
+            digests = ()
+            if stat is not None:
+                try:
+                    with open(self.path) as f:
+                        digests = tuple({_digest(line.strip()) for line in f if line.strip()})
+                except (OSError, UnicodeDecodeError):
+                    stat = None
+            self._digests = digests
+            self._stat = stat
+            self._rejected = {} # tokens may have been added
@@ -0,0 +1,135 @@
+"""Exact-match cache of answers to repeated requests."""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Union
+import contextvars
+import hashlib
+import json
+import threading
+import time
+
+from . import (
+    models,
+    database,
+    router,
+    tracing
+)
+
+LOOKUPS = tracing.registry.counter("atlas_response_cache_total", "Response cache lookups by result (`hit` or `miss`).")
+UNCACHEABLE = tracing.registry.counter("atlas_response_cache_uncacheable_total", "Answers kept out of the response cache, by reason.")
+INVALIDATIONS = tracing.registry.counter("atlas_response_cache_invalidations_total", "Times the response cache was cleared.")
+
+@dataclass
+class Request:
+    """What the agents reported about the answer to the request being processed."""
+    uncacheable: list[str] = field(default_factory=list) # reasons
+    invalidate: bool = False
+
+_request: contextvars.ContextVar[Request] = contextvars.ContextVar("cache_request", default=None)
+
+@contextmanager
+def request():
+    """Collects the `mark_uncacheable` calls of everything run inside it (agent threads included)."""
+    r = Request()
+    token = _request.set(r)
+    try:
+        yield r
+    finally:
+        _request.reset(token)
+
+def mark_uncacheable(reason: str, invalidate: bool = False):
+    """
+    Keeps the answer to the current request out of the cache. With `invalidate`, cached answers are dropped
+    as well, for requests that changed something those answers may depend on.
+    """
+    r = _request.get()
+    if r is None:
+        return
+    if reason not in r.uncacheable:
+        r.uncacheable.append(reason)
+        UNCACHEABLE.inc(reason=reason)
+    r.invalidate |= invalidate
+
+class ResponseCache:
+    """
+    Answers keyed on the normalized utterance, user, device and the `time_bucket` the request time falls in,
+    reused for `ttl` seconds. Only requests that start a conversation are cached, a follow-up depends on what was said.
+    An in-memory LRU of `max_entries`, optionally backed by SQLite at `path` so answers survive restarts.
+    """
+    EVICT_INTERVAL = 60
+    def __init__(self, ttl: float = 300, time_bucket: float = 300, max_entries: int = 1024, path: str = None):
+        self.ttl = ttl
+        self.time_bucket = time_bucket
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[router.Answer, float]] = OrderedDict() # key -> (answer, expiry time)
+        self._lock = threading.Lock()
+        self._last_evict = time.monotonic()
+        self._conn = None
+        if path:
+            self._conn = database.connect(path)
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    tts_text TEXT NOT NULL,
+                    continue_conversation INTEGER NOT NULL,
+                    expires REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires);
+            """)
+    def key(self, prompt: models.hass.PromptPayload) -> Union[str, None]:
+        """The cache key of `prompt`, or `None` if its answer can't be cached."""
+        if not prompt.text or prompt.history.history:
+            return None
+        text = router.normalize(prompt.text)
+        if not text:
+            return None
+        bucket = int(prompt.dt.timestamp()//self.time_bucket)
+        device = prompt.device.id if prompt.device is not None else None
+        return hashlib.sha256(json.dumps([text, prompt.user.id, device, bucket]).encode()).hexdigest()
+    def get(self, key: str) -> Union[router.Answer, None]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT tts_text, continue_conversation, expires FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = (router.Answer(row[0], bool(row[1])), row[2])
+                    self._cache_put(key, entry)
+            if entry is not None and entry[1] <= now:
+                self._entries.pop(key, None)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        LOOKUPS.inc(result="miss" if entry is None else "hit")
+        return entry[0] if entry is not None else None
+    def put(self, key: str, answer: router.Answer):
+        now = time.time()
+        entry = (answer, now+self.ttl)
+        with self._lock:
+            self._cache_put(key, entry)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute("BEGIN")
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO responses (key, tts_text, continue_conversation, expires) VALUES (?, ?, ?, ?)",
+                        (key, answer.tts_text, int(answer.continue_conversation), entry[1])
+                    )
+                    if time.monotonic()-self._last_evict > self.EVICT_INTERVAL:
+                        self._last_evict = time.monotonic()
+                        self._conn.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+    def invalidate(self):
+        """Drops every cached answer."""
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM responses")
+        INVALIDATIONS.inc()
+    def _cache_put(self, key: str, entry: tuple[router.Answer, float]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,131 @@
+"""Request deadlines and cancellation, propagated to everything a request runs (agent threads included)."""
+
+from contextlib import contextmanager
+from typing import Callable
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+
+from . import tracing
+
+CANCELLED = tracing.registry.counter("atlas_requests_cancelled_total", "Requests stopped before they finished, by reason.")
+
+class Cancelled(Exception):
+    """Raised in the work of a cancelled request. `reason` is eg. `deadline`, `preempted` or `disconnected`."""
+    def __init__(self, reason: str):
+        super().__init__(f"Request cancelled: {reason}")
+        self.reason = reason
+
+class Token:
+    """
+    Cancellation state of one request. With a `timeout`, it cancels itself (reason `deadline`) that many seconds
+    after it was created. Callbacks registered with `on_cancel` stop work that's blocked, eg. by killing a process;
+    work that runs in steps calls `check` between them.
+    """
+    def __init__(self, timeout: float = None):
+        self.deadline = time.monotonic()+timeout if timeout else None
+        self.reason: str = None
+        self._finished = False
+        self._callbacks: list[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        if timeout:
+            _deadlines.add(self)
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+    def remaining(self) -> float:
+        """Seconds left until the deadline, `None` without one."""
+        return None if self.deadline is None else max(self.deadline-time.monotonic(), 0)
+    def cancel(self, reason: str):
+        """Cancels the request, unless it already finished or was cancelled."""
+        with self._lock:
+            if self._finished or self.reason is not None:
+                return
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        CANCELLED.inc(reason=reason)
+        for callback in callbacks:
+            callback()
+    def finish(self):
+        """The request is done: later `cancel` calls do nothing."""
+        with self._lock:
+            self._finished = True
+            self._callbacks = []
+    def check(self):
+        """Raises `Cancelled` if the request was cancelled."""
+        if self.reason is not None:
+            raise Cancelled(self.reason)
+    def add_callback(self, callback: Callable[[], None]):
+        """`callback` is called (on the cancelling thread) when the request is cancelled, right away if it already is."""
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return
+        callback()
+    def remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+class _Deadlines:
+    """Cancels tokens once their deadline passes, all of them from one thread."""
+    def __init__(self):
+        self._heap: list[tuple[float, int, Token]] = []
+        self._order = itertools.count() # ties on the deadline
+        self._condition = threading.Condition()
+        self._thread: threading.Thread = None
+    def add(self, token: Token):
+        with self._condition:
+            heapq.heappush(self._heap, (token.deadline, next(self._order), token))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="deadlines", daemon=True)
+                self._thread.start()
+            if self._heap[0][2] is token:
+                self._condition.notify()
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._condition.wait(self._heap[0][0]-time.monotonic() if self._heap else None)
+                token = heapq.heappop(self._heap)[2]
+            token.cancel("deadline") # does nothing if the request finished in time
+
+_deadlines = _Deadlines()
+
+_token: contextvars.ContextVar[Token] = contextvars.ContextVar("cancellation_token", default=None)
+
+@contextmanager
+def scope(token: Token):
+    """Makes `token` the current one for everything run inside it, and finishes it on the way out."""
+    reset = _token.set(token)
+    try:
+        yield token
+    finally:
+        _token.reset(reset)
+        token.finish()
+
+def current() -> Token:
+    """The token of the request being processed, `None` outside of one."""
+    return _token.get()
+
+def check():
+    """Raises `Cancelled` if the current request was cancelled."""
+    token = _token.get()
+    if token is not None:
+        token.check()
+
+@contextmanager
+def on_cancel(callback: Callable[[], None]):
+    """Calls `callback` if the current request is cancelled while inside, eg. to kill what it's waiting on."""
+    token = _token.get()
+    if token is None:
+        yield
+        return
+    token.check()
+    token.add_callback(callback)
+    try:
+        yield
+    finally:
+        token.remove_callback(callback)
@@ -0,0 +1,152 @@
+"""Keeps LLM prompts under a token budget as conversations grow."""
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Hashable
+import re
+import threading
+
+from . import models
+from .models.chat import AssistantMessage, History, ToolMessage, UserMessage
+
+CHARS_PER_TOKEN = 4 # rough estimate, good enough for budgeting without a tokenizer
+MESSAGE_OVERHEAD = 4 # role and separators
+THINK = re.compile(r"<think>.*?</think>\s*", re.DOTALL)
+
+def strip_think(text: str) -> str:
+    return THINK.sub("", text)
+
+def estimate_tokens(text: str) -> int:
+    return len(text)//CHARS_PER_TOKEN+1
+
+def message_tokens(message: models.chat.Message) -> int:
+    return estimate_tokens(message.content)+MESSAGE_OVERHEAD
+
+def truncate(text: str, max_chars: int) -> str:
+    """Keeps the start and end of `text`, cutting the middle."""
+    if len(text) <= max_chars:
+        return text
+    marker = f"\n[... {len(text)-max_chars} characters cut ...]\n"
+    keep = max(max_chars-len(marker), 0)
+    return text[:keep-keep//4]+marker+text[len(text)-keep//4:] if keep else text[:max_chars]
+
+@dataclass
+class _State:
+    """Compacted form of the messages before the current turn of one conversation."""
+    compacted: list = field(default_factory=list) # compacted messages, not folded into the summary
+    source: int = 0 # number of history messages covered (folded or compacted)
+    last: models.chat.Message = None # the last covered message, to detect a different history
+    summary: list[str] = field(default_factory=list) # one line per folded message
+    summary_tokens: int = 0
+
+class ContextBudget:
+    """
+    Fits a history into `max_tokens` (system prompt included) before it's sent to the LLM.
+    `<think>` sections are never resent. Messages before the last user message are also
+    compacted: tool outputs are cut to `tool_output_chars`. If that isn't enough, the oldest messages are folded
+    into a rolling summary of what was said, appended to the system prompt and kept under `summary_tokens`.
+    The work is cached per conversation and only new messages are processed on later calls.
+    As a last resort, messages of the current turn are cut, so a call never exceeds the budget
+    unless the system prompt alone does.
+    """
+    FOLD_TARGET = 0.75 # fold down to this share of the budget, so folding doesn't happen on every turn
+    SUMMARY_LINE_CHARS = 300
+    def __init__(self, max_tokens: int = 24000, tool_output_chars: int = 2000, summary_tokens: int = 1024, cache_size: int = 256):
+        self.max_tokens = max_tokens
+        self.tool_output_chars = tool_output_chars
+        self.summary_tokens = summary_tokens
+        self.cache_size = cache_size
+        self._states: OrderedDict[Hashable, _State] = OrderedDict()
+        self._lock = threading.Lock()
+    def fit(self, history: History, system_prompt: str, key: Hashable = None) -> tuple[History, str]:
+        """
+        Returns the history and system prompt to send. `key` identifies the conversation for caching;
+        without one the history object itself is used, which still saves work between loop turns.
+        """
+        messages = history.history
+        current = max((i for i, m in enumerate(messages) if isinstance(m, UserMessage)), default=0)
+        key = key if key is not None else id(history)
+        with self._lock:
+            state = self._states.pop(key, None)
+        if state is None or state.source > current or (state.source and messages[state.source-1] != state.last):
+            state = _State()
+        for message in messages[state.source:current]:
+            state.compacted.append(self._compact(message))
+        state.source = current
+        state.last = messages[current-1] if current else None
+
+        turn = [self._strip(m) for m in messages[current:]]
+        system_tokens = estimate_tokens(system_prompt or "")+MESSAGE_OVERHEAD
+        turn_tokens = sum(message_tokens(m) for m in turn)
+        old_tokens = sum(message_tokens(m) for m in state.compacted)
+        if system_tokens+state.summary_tokens+old_tokens+turn_tokens > self.max_tokens:
+            target = self.max_tokens*self.FOLD_TARGET
+            while state.compacted and system_tokens+state.summary_tokens+old_tokens+turn_tokens > target:
+                message = state.compacted.pop(0)
+                old_tokens -= message_tokens(message)
+                self._fold(state, message)
+            while state.compacted and not isinstance(state.compacted[0], UserMessage): # start at a user message
+                message = state.compacted.pop(0)
+                old_tokens -= message_tokens(message)
+                self._fold(state, message)
+        with self._lock:
+            self._states[key] = state
+            while len(self._states) > self.cache_size:
+                self._states.popitem(last=False)
+
+        if state.summary:
+            system_prompt = "\n".join((
+                system_prompt or "",
+                "",
+                "Summary of the earlier conversation (older messages were removed):",
+                *state.summary
+            ))
+        turn = self._cut(turn, self.max_tokens-estimate_tokens(system_prompt)-MESSAGE_OVERHEAD-old_tokens)
+        result = History([])
+        result.history = state.compacted+turn
+        return result, system_prompt
+    def _strip(self, message: models.chat.Message) -> models.chat.Message:
+        if isinstance(message, AssistantMessage) and "<think>" in message.content:
+            return AssistantMessage(strip_think(message.content), message.tts_text)
+        return message
+    def _compact(self, message: models.chat.Message) -> models.chat.Message:
+        if isinstance(message, AssistantMessage) and "<think>" in message.content:
+            return AssistantMessage(strip_think(message.content), message.tts_text)
+        if isinstance(message, ToolMessage) and len(message.content) > self.tool_output_chars:
+            return ToolMessage(content=truncate(message.content, self.tool_output_chars), tool_call_id=message.tool_call_id)
+        return message
+    def _fold(self, state: _State, message: models.chat.Message):
+        if isinstance(message, UserMessage):
+            line = "User: "+message.content.split("\n\n")[0].strip()
+        elif isinstance(message, AssistantMessage):
+            if not message.tts_text:
+                return
+            line = "Assistant: "+strip_think(message.tts_text)
+        else:
+            line = f"{message.tool_call_id or 'Tool'} reported: "+message.content
+        line = " ".join(truncate(line, self.SUMMARY_LINE_CHARS).split())
+        state.summary.append(line)
+        state.summary_tokens += estimate_tokens(line)+1
+        while state.summary_tokens > self.summary_tokens and len(state.summary) > 1:
+            state.summary_tokens -= estimate_tokens(state.summary.pop(0))+1
+    def _cut(self, turn: list, budget: int) -> list:
+        """Cuts the longest messages of the current turn until it fits in `budget` tokens."""
+        tokens = [message_tokens(m) for m in turn]
+        excess = sum(tokens)-budget
+        if excess <= 0:
+            return turn
+        turn = list(turn)
+        for i in sorted(range(len(turn)), key=lambda i: -tokens[i]):
+            if excess <= 0:
+                break
+            message = turn[i]
+            keep = max(len(message.content)-(excess+MESSAGE_OVERHEAD)*CHARS_PER_TOKEN, 0)
+            content = truncate(message.content, keep)
+            excess -= tokens[i]-message_tokens(models.chat.Message(content))
+            if isinstance(message, AssistantMessage):
+                turn[i] = AssistantMessage(content, message.tts_text)
+            elif isinstance(message, ToolMessage):
+                turn[i] = ToolMessage(content=content, tool_call_id=message.tool_call_id)
+            else:
+                turn[i] = UserMessage(content=content)
+        return turn
@@ -1 +1,114 @@
-"""Classes for database connection."""
\ No newline at end of file
+"""Classes for database connection."""
+
+from collections import OrderedDict
+from typing import Union
+import json
+import sqlite3
+import threading
+import time
+
+from . import models
+
+def connect(path: str) -> sqlite3.Connection:
+    """Opens a SQLite connection in WAL mode, shareable between threads (guard it with a lock)."""
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _row(message: models.chat.Message) -> dict:
+    """The stored form of a message: what's sent to providers, plus the spoken text of assistant messages."""
+    if isinstance(message, models.chat.AssistantMessage) and message.tts_text != message.content:
+        return {**message.to_message(), "tts_text": message.tts_text}
+    return message.to_message()
+
+class ConversationStore:
+    """
+    Server-side conversation histories keyed by `conversation_id`.
+    Messages are appended to SQLite as they are added (with their `tts_text`), with an in-memory LRU of parsed histories in front.
+    Conversations not updated for `ttl` seconds are evicted from both.
+    """
+    EVICT_INTERVAL = 60
+    def __init__(self, path: str = ":memory:", ttl: float = 3600, cache_size: int = 256):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, tuple[list, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_evict = time.monotonic()
+        self._conn = connect(path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                conversation_id TEXT PRIMARY KEY,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            );
+            CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated);
+        """)
+    def get(self, conversation_id: str) -> Union[models.chat.History, None]:
+        """Returns a copy of the stored history, or `None` if unknown or expired."""
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(conversation_id)
+            if cached is not None and now-cached[1] < self.ttl:
+                self._cache.move_to_end(conversation_id)
+                messages = cached[0]
+            else:
+                row = self._conn.execute(
+                    "SELECT updated FROM conversations WHERE conversation_id = ?", (conversation_id,)
+                ).fetchone()
+                if row is None or now-row[0] >= self.ttl:
+                    return None
+                rows = self._conn.execute(
+                    "SELECT message FROM messages WHERE conversation_id = ? ORDER BY seq", (conversation_id,)
+                ).fetchall()
+                messages = models.chat.History([json.loads(i[0]) for i in rows]).history
+                self._cache_put(conversation_id, messages, row[0])
+        history = models.chat.History([])
+        history.history = list(messages)
+        return history
+    def put(self, conversation_id: str, history: models.chat.History, start: int = 0):
+        """
+        Stores `history`. Messages before index `start` are assumed to be stored already,
+        so only the new ones are written, replacing any stored from `start` on (eg. by a request that loaded
+        the same history and ended with more messages); with `start=0` the stored history is replaced.
+        """
+        now = time.time()
+        new = [_row(m) for m in history.history[start:]]
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM messages WHERE conversation_id = ? AND seq >= ?", (conversation_id, start))
+            self._conn.executemany(
+                "INSERT INTO messages (conversation_id, seq, message) VALUES (?, ?, ?)",
+                [(conversation_id, start+i, json.dumps(m)) for i, m in enumerate(new)]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversations (conversation_id, updated) VALUES (?, ?)",
+                (conversation_id, now)
+            )
+            self._cache_put(conversation_id, list(history.history), now)
+            if time.monotonic()-self._last_evict > self.EVICT_INTERVAL:
+                self._evict(now)
+    def evict_expired(self):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._evict(time.time())
+    def _evict(self, now: float):
+        self._last_evict = time.monotonic()
+        expired = now-self.ttl
+        for conversation_id in [k for k, v in self._cache.items() if v[1] <= expired]:
+            del self._cache[conversation_id]
+        self._conn.execute(
+            "DELETE FROM messages WHERE conversation_id IN (SELECT conversation_id FROM conversations WHERE updated <= ?)",
+            (expired,)
+        )
+        self._conn.execute("DELETE FROM conversations WHERE updated <= ?", (expired,))
+    def _cache_put(self, conversation_id: str, messages: list, updated: float):
+        self._cache[conversation_id] = (messages, updated)
+        self._cache.move_to_end(conversation_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
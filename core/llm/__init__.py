@@ -1,9 +1,76 @@
 """Low-level LLM API utilities."""
 
 from dataclasses import dataclass
-from typing import Iterable
+import time
+from typing import AsyncIterator, Iterable, Iterator, Union
 
-from .. import models
+from .. import models, admission, cancellation, tracing
+
+NO_THINK = "/no_think" # Qwen3 soft switch, appended to the last message: the model answers with an empty think block
+
+class FinishReason(str):
+    """Yielded by providers after the last delta, eg. `FinishReason("stop")`."""
+
+class Completion:
+    """
+    Text deltas of one completion. `finish_reason` is set once the provider reports it.
+    Time to first token, tokens/s and token count are recorded when it's done or closed.
+    If the request it was started for is cancelled, the stream is closed at the next delta and `Cancelled` raised.
+    With a `gate`, the provider is only asked once the gate lets the completion through (timings start then),
+    and the slot is given back when it's done or closed.
+    """
+    def __init__(self, chunks: Iterator[str], gate: admission.ProviderGate = None, priority: int = admission.INTERACTIVE, **labels):
+        self._chunks = chunks
+        self._gate = gate
+        self._priority = priority
+        self._admitted = False
+        self.finish_reason: str = None
+        self.labels = labels
+        self.tokens = 0
+        self._start = time.perf_counter()
+        self._first_token: float = None
+        self._recorded = False
+        self._cancellation = cancellation.current()
+    def __iter__(self) -> Iterator[str]:
+        token = self._cancellation
+        try:
+            if token is not None:
+                token.check()
+            if self._gate is not None:
+                self._gate.acquire(admission.current_user(), self._priority)
+                self._admitted = True
+                self._start = time.perf_counter()
+            for chunk in self._chunks:
+                if token is not None and token.reason is not None:
+                    raise cancellation.Cancelled(token.reason)
+                if isinstance(chunk, FinishReason):
+                    self.finish_reason = str(chunk)
+                elif chunk:
+                    if self._first_token is None:
+                        self._first_token = time.perf_counter()
+                    self.tokens += 1
+                    yield chunk
+        finally:
+            self.close()
+    def close(self):
+        """Stops generation, closing the provider stream."""
+        self._chunks.close()
+        if self._admitted:
+            self._admitted = False
+            self._gate.release()
+        self._record()
+    def _record(self):
+        if self._recorded:
+            return
+        self._recorded = True
+        end = time.perf_counter()
+        tracing.record_span(tracing.Span("llm.complete", self._start, end-self._start, {"tokens": self.tokens, **self.labels}))
+        if self._first_token is None:
+            return
+        tracing.LLM_TTFT_SECONDS.observe(self._first_token-self._start, **self.labels)
+        tracing.LLM_TOKENS.inc(self.tokens, **self.labels)
+        if self.tokens > 1 and end > self._first_token:
+            tracing.LLM_TOKENS_PER_SECOND.observe((self.tokens-1)/(end-self._first_token), **self.labels)
 
 @dataclass
 class LLM:
@@ -11,33 +78,84 @@ class LLM:
     model_name: str = None
     def __init__(self, provider_name:str):
         self.provider_name = provider_name # this is different from the provider name in the config
-        self.stop: str = None
+        self.stop: Union[str, list[str]] = None
         self.model_name: str = None
-    def set_stop_sequence(self, stop: str):
+        self.priority = admission.INTERACTIVE
+    def set_priority(self, priority: int):
+        """Where completions queue when the provider is at its concurrency limit, `admission.INTERACTIVE` or `BACKGROUND`."""
+        self.priority = priority
+    def set_stop_sequence(self, stop: Union[str, list[str]]):
         self.stop = stop
     def set_model_name(self, model_name: str):
         self.model_name = model_name
-    def _complete(self, messages: list, temperature: float = None, stop: str = None) -> Iterable[str]:
+    def _complete(self, messages: list, temperature: float = None, stop: Union[str, list[str]] = None, model: str = None) -> Iterable[str]:
+        """`model` overrides `model_name` for this call."""
+        raise NotImplementedError("Subclasses should implement this method.")
+    async def _acomplete(self, messages: list, temperature: float = None, stop: Union[str, list[str]] = None, model: str = None) -> AsyncIterator[str]:
         raise NotImplementedError("Subclasses should implement this method.")
-    def complete(self, history: models.chat.History, system_prompt: str = None, temperature: float = None) -> Iterable[str]:
+        yield
+    def warm(self):
+        """Opens provider connections ahead of the first request. Optional for providers."""
+    async def awarm(self):
+        """
+        Async version of `warm`, for the pool `acomplete` uses on the running event loop. Pools belong to their loop,
+        so an async caller warms them itself once its loop runs; the server's request path only uses `warm`.
+        """
+    def gate(self) -> admission.ProviderGate:
+        """Where completions queue for a slot of the provider, `None` if it isn't limited."""
+        return admission.providers.get(self.provider_name)
+    def _messages(self, history: models.chat.History, system_prompt: str = None) -> list[dict]:
         messages = history.to_messages()
         if system_prompt:
             messages.insert(0, {"role": "system", "content": system_prompt})
-        for chunk in self._complete(
+        return messages
+    def complete(self, history: models.chat.History, system_prompt: str = None, temperature: float = None, model_name: str = None) -> Completion:
+        """
+        Returns the text deltas as the provider sends them. Close it to stop generating.
+        `model_name` overrides the model set with `set_model_name` for this call.
+        """
+        messages = self._messages(history, system_prompt)
+        model_name = model_name or self.model_name
+        return Completion(
+            self._complete(
+                messages=messages,
+                temperature=temperature,
+                stop=self.stop,
+                model=model_name
+            ),
+            self.gate(),
+            self.priority,
+            provider=self.provider_name,
+            model=model_name
+        )
+    async def acomplete(self, history: models.chat.History, system_prompt: str = None, temperature: float = None, model_name: str = None) -> AsyncIterator[str]:
+        """Async version of `complete`."""
+        messages = self._messages(history, system_prompt)
+        token = cancellation.current()
+        async for chunk in self._acomplete(
             messages=messages,
             temperature=temperature,
-            stop=self.stop
+            stop=self.stop,
+            model=model_name or self.model_name
         ):
-            for i in chunk:
-                yield i
+            if token is not None:
+                token.check()
+            if chunk and not isinstance(chunk, FinishReason):
+                yield chunk
 
 # Import all LLM providers
 from . import (
-    cerebras_cloud
+    cerebras_cloud,
+    openai_compatible,
+    routing,
+    fake
 )
 
 PROVIDERS = {
-    "cerebras": cerebras_cloud.Cerebras
+    "cerebras": cerebras_cloud.Cerebras,
+    "openai": openai_compatible.OpenAICompatible,
+    "routing": routing.Routing,
+    "fake": fake.Fake
 }
 
 def factory(provider_config: models.config.ProviderConfig) -> LLM:
@@ -1,18 +1,72 @@
 """Cerebras LLM wrapper."""
 
+import asyncio
+import threading
+import weakref
+
 import cerebras.cloud.sdk
-from . import LLM
+import httpx
+from . import LLM, FinishReason
 from .. import models
-from typing import Iterable
+from typing import AsyncIterator, Iterable, Union
+
+# one keep-alive connection pool per API key/base URL, shared by every agent on the provider
+POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=8, keepalive_expiry=300)
+_clients: dict[tuple, cerebras.cloud.sdk.Cerebras] = {}
+# event loop -> its clients, since the pool of one loop can't be used from another
+_async_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple, cerebras.cloud.sdk.AsyncCerebras]] = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+def _client_key(provider_config: models.config.ProviderConfig) -> tuple:
+    return provider_config.api_key, provider_config.base_url
+
+def shared_client(provider_config: models.config.ProviderConfig) -> cerebras.cloud.sdk.Cerebras:
+    key = _client_key(provider_config)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = cerebras.cloud.sdk.Cerebras(
+                api_key=provider_config.api_key,
+                base_url=provider_config.base_url,
+                http_client=cerebras.cloud.sdk.DefaultHttpxClient(limits=POOL_LIMITS),
+                warm_tcp_connection=False # done in `warm`, at startup
+            )
+        return _clients[key]
+
+def shared_async_client(provider_config: models.config.ProviderConfig) -> cerebras.cloud.sdk.AsyncCerebras:
+    """The client of the running event loop, created on first use since the connection pool belongs to that loop."""
+    key = _client_key(provider_config)
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = cerebras.cloud.sdk.AsyncCerebras(
+                api_key=provider_config.api_key,
+                base_url=provider_config.base_url,
+                http_client=cerebras.cloud.sdk.DefaultAsyncHttpxClient(limits=POOL_LIMITS),
+                warm_tcp_connection=False
+            )
+        return clients[key]
 
 class Cerebras(LLM):
     def __init__(self, provider_config: models.config.ProviderConfig):
-        self._client = cerebras.cloud.sdk.Cerebras(api_key=provider_config.api_key)
+        self._provider_config = provider_config
+        self._client = shared_client(provider_config)
         super().__init__(provider_config.name)
-    def _complete(self, messages: list, temperature: float = None, stop: str = None) -> Iterable[str]:
+    def warm(self):
+        try:
+            self._client.with_options(timeout=2, max_retries=0).get("/v1/tcp_warming", cast_to=str)
+        except Exception:
+            pass
+    async def awarm(self):
+        try:
+            client = shared_async_client(self._provider_config)
+            await client.with_options(timeout=2, max_retries=0).get("/v1/tcp_warming", cast_to=str)
+        except Exception:
+            pass
+    def _complete(self, messages: list, temperature: float = None, stop: Union[str, list[str]] = None, model: str = None) -> Iterable[str]:
         stream = self._client.chat.completions.create(
             messages=messages,
-            model=self.model_name,
+            model=model or self.model_name,
             temperature=temperature,
             stream=True,
             stop=stop
@@ -20,5 +74,22 @@ class Cerebras(LLM):
         try:
             for chunk in stream:
                 yield chunk.choices[0].delta.content or ""
+                if chunk.choices[0].finish_reason:
+                    yield FinishReason(chunk.choices[0].finish_reason)
         finally:
             stream.close()
+    async def _acomplete(self, messages: list, temperature: float = None, stop: Union[str, list[str]] = None, model: str = None) -> AsyncIterator[str]:
+        stream = await shared_async_client(self._provider_config).chat.completions.create(
+            messages=messages,
+            model=model or self.model_name,
+            temperature=temperature,
+            stream=True,
+            stop=stop
+        )
+        try:
+            async for chunk in stream:
+                yield chunk.choices[0].delta.content or ""
+                if chunk.choices[0].finish_reason:
+                    yield FinishReason(chunk.choices[0].finish_reason)
+        finally:
+            await stream.close()
@@ -0,0 +1,108 @@
+"""Deterministic fake LLM that replays recorded token streams. For benchmarks and offline testing."""
+
+import asyncio
+import json
+import re
+import time
+from typing import AsyncIterator, Iterable, Union
+
+from . import LLM, FinishReason, NO_THINK
+from .. import models
+
+# how the replayed agent is recognised from its system prompt
+AGENT_MARKERS = {
+    "supervisor": "You are the supervisor agent",
+    "sys_worker": "You are the System Worker"
+}
+
+def load_recording(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def replay_chunks(recording: Union[dict, None], messages: list[dict]) -> list[str]:
+    """
+    Picks the recorded stream for a request: the agent from the system prompt, the turn from
+    the number of tool messages since the last user message.
+    Without a matching recording, the last user message is echoed back in a `<u_out>` tag.
+    """
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    last_user = max((i for i, m in enumerate(messages) if m["role"] == "user"), default=0)
+    turn = sum(1 for m in messages[last_user:] if m["role"] == "tool")
+    if recording is not None:
+        for agent, marker in AGENT_MARKERS.items():
+            if marker in system and agent in recording["streams"]:
+                turns = recording["streams"][agent]
+                return turns[min(turn, len(turns)-1)]
+    text = messages[last_user]["content"].split("\n")[0] if messages else ""
+    response = "<u_out>You said: "+text+"</u_out>"
+    return [response[i:i+4] for i in range(0, len(response), 4)]
+
+def stop_at(chunks: list[str], stop: Union[str, list[str], None]) -> list[str]:
+    """Cuts the stream before the first stop sequence, which is left out like a real provider does."""
+    if not stop:
+        return chunks
+    text = "".join(chunks)
+    cut = min((i for i in (text.find(s) for s in ([stop] if isinstance(stop, str) else stop)) if i != -1), default=-1)
+    if cut == -1:
+        return chunks
+    result, length = [], 0
+    for chunk in chunks:
+        if length+len(chunk) >= cut:
+            result.append(chunk[:cut-length])
+            break
+        result.append(chunk)
+        length += len(chunk)
+    return result
+
+THINK = re.compile(r"\s*<think>.*?</think>\s*", re.DOTALL)
+
+def skip_thinking(chunks: list[str]) -> list[str]:
+    """Replaces a leading think block with an empty one, like a model given `NO_THINK`."""
+    match = THINK.match("".join(chunks))
+    if match is None:
+        return chunks
+    result, length = ["<think>\n\n</think>\n\n"], 0
+    for chunk in chunks:
+        if length+len(chunk) > match.end():
+            result.append(chunk[max(match.end()-length, 0):])
+        length += len(chunk)
+    return result
+
+def select_chunks(recording: Union[dict, None], messages: list[dict], stop: Union[str, list[str], None]) -> list[str]:
+    chunks = replay_chunks(recording, messages)
+    if messages and messages[-1]["content"].endswith(NO_THINK):
+        chunks = skip_thinking(chunks)
+    return stop_at(chunks, stop)
+
+class Fake(LLM):
+    """
+    Honours `NO_THINK` by leaving out the recorded reasoning.
+    Provider options (in `llm_providers.toml`):
+    - `recording`: path to a recording JSON, see `benchmarks/recordings`. Echoes the input without one.
+    - `token_delay`: seconds between tokens.
+    - `first_token_delay`: seconds before the first token.
+    """
+    def __init__(self, provider_config: models.config.ProviderConfig):
+        options = provider_config.options or {}
+        self.recording = load_recording(options["recording"]) if options.get("recording") else None
+        self.token_delay = float(options.get("token_delay", 0))
+        self.first_token_delay = float(options.get("first_token_delay", 0))
+        super().__init__(provider_config.name)
+    def _complete(self, messages: list, temperature: float = None, stop: Union[str, list[str]] = None, model: str = None) -> Iterable[str]:
+        chunks = select_chunks(self.recording, messages, stop)
+        if self.first_token_delay:
+            time.sleep(self.first_token_delay)
+        for i, chunk in enumerate(chunks):
+            if self.token_delay and i:
+                time.sleep(self.token_delay)
+            yield chunk
+        yield FinishReason("stop")
+    async def _acomplete(self, messages: list, temperature: float = None, stop: Union[str, list[str]] = None, model: str = None) -> AsyncIterator[str]:
+        chunks = select_chunks(self.recording, messages, stop)
+        if self.first_token_delay:
+            await asyncio.sleep(self.first_token_delay)
+        for i, chunk in enumerate(chunks):
+            if self.token_delay and i:
+                await asyncio.sleep(self.token_delay)
+            yield chunk
+        yield FinishReason("stop")
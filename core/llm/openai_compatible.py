@@ -0,0 +1,97 @@
+"""Wrapper for OpenAI-compatible chat completion servers (llama.cpp, vLLM, Ollama, ...)."""
+
+import asyncio
+import json
+import threading
+import weakref
+
+import httpx
+from . import LLM, FinishReason
+from .. import models
+from typing import AsyncIterator, Iterable, Iterator, Union
+
+POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=8, keepalive_expiry=300)
+TIMEOUT = httpx.Timeout(60, connect=5)
+_clients: dict[str, httpx.Client] = {}
+# event loop -> its clients, since the pool of one loop can't be used from another
+_async_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, httpx.AsyncClient]] = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+def shared_client(base_url: str) -> httpx.Client:
+    with _clients_lock:
+        if base_url not in _clients:
+            _clients[base_url] = httpx.Client(base_url=base_url, limits=POOL_LIMITS, timeout=TIMEOUT)
+        return _clients[base_url]
+
+def shared_async_client(base_url: str) -> httpx.AsyncClient:
+    """The client of the running event loop, created on first use since the connection pool belongs to that loop."""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if base_url not in clients:
+            clients[base_url] = httpx.AsyncClient(base_url=base_url, limits=POOL_LIMITS, timeout=TIMEOUT)
+        return clients[base_url]
+
+def parse_events(lines: Iterator[str]) -> Iterator[str]:
+    """Text deltas and finish reasons from the server-sent events of a streamed completion."""
+    for line in lines:
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        choices = json.loads(data).get("choices") or [{}]
+        yield (choices[0].get("delta") or {}).get("content") or ""
+        if choices[0].get("finish_reason"):
+            yield FinishReason(choices[0]["finish_reason"])
+
+class OpenAICompatible(LLM):
+    """
+    Streams `POST {base_url}/chat/completions`, eg. `base_url = "http://127.0.0.1:8080/v1"`.
+    Provider options (in `llm_providers.toml`):
+    - `model`: the model the server runs, used instead of the agent's model names (which belong to other providers).
+    """
+    def __init__(self, provider_config: models.config.ProviderConfig):
+        if not provider_config.base_url:
+            raise ValueError(f"Provider `{provider_config.name}` needs a `base_url`")
+        options = provider_config.options or {}
+        self.base_url = provider_config.base_url.rstrip("/")
+        self.model = options.get("model")
+        self._headers = {"Authorization": f"Bearer {provider_config.api_key}"} if provider_config.api_key else {}
+        self._client = shared_client(self.base_url)
+        super().__init__(provider_config.name)
+    def warm(self):
+        try:
+            self._client.get("/models", headers=self._headers, timeout=2)
+        except Exception:
+            pass
+    async def awarm(self):
+        try:
+            await shared_async_client(self.base_url).get("/models", headers=self._headers, timeout=2)
+        except Exception:
+            pass
+    def _body(self, messages: list, temperature: float, stop: Union[str, list[str]], model: str) -> dict:
+        body = {"model": self.model or model or self.model_name, "messages": messages, "stream": True}
+        if temperature is not None:
+            body["temperature"] = temperature
+        if stop:
+            body["stop"] = stop
+        return body
+    def _complete(self, messages: list, temperature: float = None, stop: Union[str, list[str]] = None, model: str = None) -> Iterable[str]:
+        with self._client.stream(
+            "POST", "/chat/completions",
+            json=self._body(messages, temperature, stop, model),
+            headers=self._headers
+        ) as response:
+            response.raise_for_status()
+            yield from parse_events(response.iter_lines())
+    async def _acomplete(self, messages: list, temperature: float = None, stop: Union[str, list[str]] = None, model: str = None) -> AsyncIterator[str]:
+        async with shared_async_client(self.base_url).stream(
+            "POST", "/chat/completions",
+            json=self._body(messages, temperature, stop, model),
+            headers=self._headers
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                for chunk in parse_events([line]):
+                    yield chunk
@@ -0,0 +1,212 @@
+"""Routes completions over several providers, with failover and hedged requests."""
+
+import collections
+import contextvars
+import queue
+import statistics
+import threading
+import time
+
+from . import LLM
+from .. import models, admission, cancellation, tracing
+from typing import AsyncIterator, Iterable, Iterator, Union
+
+FAILOVERS = tracing.registry.counter("atlas_llm_backend_failures_total", "Routed completions that failed on a backend, by backend.")
+HEDGES = tracing.registry.counter(
+    "atlas_llm_hedges_total", "Routed completions that sent a hedged request, by the request that answered first (`primary` or `hedge`)."
+)
+BACKEND_TTFT_SECONDS = tracing.registry.histogram("atlas_llm_backend_ttft_seconds", "Time to first token of routed completions, by backend.")
+
+class Backend:
+    """One provider behind a `Routing` LLM, with its rolling time to first token and error cooldown."""
+    def __init__(self, llm: LLM, window: int = 20):
+        self.llm = llm
+        self.ttfts = collections.deque(maxlen=window)
+        self.cooldown_until = 0.0
+        self._lock = threading.Lock() # completions of all requests observe and order concurrently
+    @property
+    def name(self) -> str:
+        return self.llm.provider_name
+    def ttft(self) -> float:
+        """Median of the recent times to first token, 0 before the first."""
+        with self._lock:
+            ttfts = list(self.ttfts)
+        return statistics.median(ttfts) if ttfts else 0.0
+    def observe(self, ttft: float):
+        with self._lock:
+            self.ttfts.append(ttft)
+        BACKEND_TTFT_SECONDS.observe(ttft, backend=self.name)
+    def stream(self, kwargs: dict, priority: int) -> Iterator[str]:
+        """Deltas of a completion, asked for once the gate of this backend's provider lets it through."""
+        gate = self.llm.gate()
+        if gate is not None:
+            gate.acquire(admission.current_user(), priority)
+        try:
+            yield from self.llm._complete(**kwargs)
+        finally:
+            if gate is not None:
+                gate.release()
+    def failed(self, cooldown: float):
+        self.cooldown_until = time.monotonic()+cooldown
+        FAILOVERS.inc(backend=self.name)
+
+class _Attempt:
+    """Consumes one backend's stream on a thread, forwarding `(index, kind, value)` events."""
+    def __init__(self, index: int, backend: Backend, kwargs: dict, priority: int, events: queue.Queue, hedge: bool = False):
+        self.index = index
+        self.backend = backend
+        self.hedge = hedge
+        self.failed = False
+        self.start = time.perf_counter()
+        self._events = events
+        self._cancelled = threading.Event()
+        # in the request's context, so the backend's gate queues it as the request's user and stops on cancellation
+        threading.Thread(target=contextvars.copy_context().run, args=(self._run, kwargs, priority), daemon=True).start()
+    def cancel(self):
+        """The stream is closed as soon as the backend sends anything more."""
+        self._cancelled.set()
+    def _run(self, kwargs: dict, priority: int):
+        chunks = self.backend.stream(kwargs, priority)
+        try:
+            for chunk in chunks:
+                if self._cancelled.is_set():
+                    return
+                self._events.put((self.index, "chunk", chunk))
+            self._events.put((self.index, "end", None))
+        except Exception as e:
+            self._events.put((self.index, "error", e))
+        finally:
+            chunks.close()
+
+class Routing(LLM):
+    """
+    Sends each completion to one of several backends, other providers in `llm_providers.toml`.
+    A backend that fails before its first token is skipped for `cooldown` seconds and the completion moves on
+    to the next one; past the first token, errors are raised. With `hedge_after`, a duplicate request goes to
+    the next backend once the first one misses that deadline for its first token. The stream that produces a
+    token first is kept, the other closed. Hedging applies to `complete`, `acomplete` only fails over.
+    Each backend's completions (hedged ones included) queue at the admission gate of its own provider;
+    one turned away there moves on to the next backend, without a cooldown.
+    Provider options:
+    - `backends`: provider names, in order of preference.
+    - `strategy`: `priority` (that order) or `fastest` (lowest rolling median time to first token first).
+    - `hedge_after`: seconds, no hedging without it.
+    - `cooldown`: seconds a failed backend is tried last, 30 by default.
+    Agents' model names are passed on to every backend, a backend serving one fixed model sets it in its own options.
+    """
+    def __init__(self, provider_config: models.config.ProviderConfig):
+        from . import factory
+        options = provider_config.options or {}
+        if not options.get("backends"):
+            raise ValueError(f"Provider `{provider_config.name}` needs `backends`")
+        if options.get("strategy", "priority") not in ("priority", "fastest"):
+            raise ValueError(f"Unknown routing strategy: {options['strategy']}")
+        self.backends = [Backend(factory(i)) for i in options["backends"]]
+        self.strategy = options.get("strategy", "priority")
+        self.hedge_after = options.get("hedge_after")
+        self.cooldown = options.get("cooldown", 30)
+        super().__init__(provider_config.name)
+    def warm(self):
+        for backend in self.backends:
+            backend.llm.warm()
+    async def awarm(self):
+        for backend in self.backends:
+            await backend.llm.awarm()
+    def gate(self) -> admission.ProviderGate:
+        return None # completions queue at the gates of the backends they're sent to
+    def order(self) -> list[Backend]:
+        """Backends in the order they're tried; those cooling down after an error come last."""
+        now = time.monotonic()
+        backends = self.backends if self.strategy == "priority" else sorted(self.backends, key=Backend.ttft)
+        return sorted(backends, key=lambda i: i.cooldown_until > now)
+    def _complete(self, messages: list, temperature: float = None, stop: Union[str, list[str]] = None, model: str = None) -> Iterable[str]:
+        kwargs = {"messages": messages, "temperature": temperature, "stop": stop, "model": model}
+        if self.hedge_after is None:
+            return self._failover(self.order(), kwargs)
+        return self._hedged(self.order(), kwargs)
+    def _failover(self, backends: list[Backend], kwargs: dict) -> Iterable[str]:
+        for i, backend in enumerate(backends):
+            start = time.perf_counter()
+            chunks = backend.stream(kwargs, self.priority)
+            answered = False
+            try:
+                for chunk in chunks:
+                    if chunk and not answered:
+                        answered = True
+                        backend.observe(time.perf_counter()-start)
+                    yield chunk
+                return
+            except cancellation.Cancelled:
+                raise
+            except admission.Rejected:
+                if i == len(backends)-1:
+                    raise
+            except Exception:
+                backend.failed(self.cooldown)
+                if answered or i == len(backends)-1:
+                    raise
+            finally:
+                chunks.close()
+    def _hedged(self, backends: list[Backend], kwargs: dict) -> Iterable[str]:
+        events = queue.Queue()
+        attempts: list[_Attempt] = []
+        pending = list(backends)
+        def start(hedge: bool = False):
+            attempts.append(_Attempt(len(attempts), pending.pop(0), kwargs, self.priority, events, hedge))
+            return time.monotonic()+self.hedge_after
+        deadline = start()
+        winner = None
+        try:
+            while True:
+                hedging = winner is None and pending and not any(i.hedge and not i.failed for i in attempts)
+                try:
+                    index, kind, value = events.get(timeout=max(deadline-time.monotonic(), 0) if hedging else None)
+                except queue.Empty:
+                    deadline = start(hedge=True)
+                    continue
+                attempt = attempts[index]
+                if winner is not None and attempt is not winner:
+                    continue
+                if kind == "error":
+                    if isinstance(value, cancellation.Cancelled):
+                        raise value
+                    if not isinstance(value, admission.Rejected):
+                        attempt.backend.failed(self.cooldown)
+                    attempt.failed = True
+                    if winner is not None or (not pending and all(i.failed for i in attempts)):
+                        raise value
+                    if all(i.failed for i in attempts):
+                        deadline = start() # fail over
+                    continue
+                if winner is None:
+                    if kind == "chunk" and not value:
+                        continue
+                    winner = attempt
+                    winner.backend.observe(time.perf_counter()-winner.start)
+                    for other in attempts:
+                        if other is not winner:
+                            other.cancel()
+                    if any(i.hedge for i in attempts): # not after a plain failover
+                        HEDGES.inc(request="hedge" if winner.hedge else "primary")
+                if kind == "end":
+                    return
+                yield value
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+    async def _acomplete(self, messages: list, temperature: float = None, stop: Union[str, list[str]] = None, model: str = None) -> AsyncIterator[str]:
+        backends = self.order()
+        for i, backend in enumerate(backends):
+            start = time.perf_counter()
+            answered = False
+            try:
+                async for chunk in backend.llm._acomplete(messages, temperature, stop, model):
+                    if chunk and not answered:
+                        answered = True
+                        backend.observe(time.perf_counter()-start)
+                    yield chunk
+                return
+            except Exception:
+                backend.failed(self.cooldown)
+                if answered or i == len(backends)-1:
+                    raise
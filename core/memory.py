@@ -0,0 +1,277 @@
+"""
+Household memory store, shared by everyone who talks to ATLAS: an append-only SQLite log of short facts with an FTS5 keyword index,
+and an in-memory embedding matrix for vector search.
+
+Self-contained (standard library and NumPy), since the sandbox preloads it as the `memory` module:
+the fork server loads the matrix once and forked sessions share it, catching up on newer rows from the log.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Callable
+
+import numpy as np
+
+Embedder = Callable[[list[str]], np.ndarray] # texts -> (len(texts), dim) float32 rows of unit length
+
+WORDS = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a about an and are as at be by can did do does for from has have how i in is it its me my of on or "
+    "our that the their this to was we what when where which who why will with you your".split()
+)
+RRF_K = 60 # reciprocal rank fusion constant
+KEYWORD_WINDOW = 1000 # bm25 ranks only the newest this many keyword matches, so a common word can't make a lookup scan the index
+
+class HashingEmbedder:
+    """
+    Local embedder without a model: words and their character trigrams hashed into `dim` signed buckets.
+    It matches wording rather than meaning; any `Embedder` with a `name` and `dim` can replace it.
+    """
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+    def features(self, text: str) -> list[str]:
+        features = []
+        for word in WORDS.findall(text.lower()):
+            features.append(word)
+            padded = f"<{word}>"
+            features.extend(padded[i:i+3] for i in range(len(padded)-2))
+        return features
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        rows, columns, signs = [], [], []
+        for i, text in enumerate(texts):
+            for feature in self.features(text):
+                h = zlib.crc32(feature.encode()) # stable across processes, unlike `hash`
+                rows.append(i)
+                columns.append(h%self.dim)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+        vectors = np.zeros((len(texts), self.dim), np.float32)
+        np.add.at(vectors, (np.array(rows, np.intp), np.array(columns, np.intp)), np.array(signs, np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors/norms
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS memories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created REAL NOT NULL,
+        text TEXT NOT NULL,
+        embedding BLOB NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS forgotten (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        memory_id INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(text, content='memories', content_rowid='id');
+    CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+        INSERT INTO memories_fts (rowid, text) VALUES (new.id, new.text);
+    END;
+"""
+
+class MemoryStore:
+    """
+    Memories are only ever appended; `forget` appends to a second log and drops the memory from the keyword index.
+    The embedding matrix is loaded on open and brought up to date from both logs before every search,
+    so writes from other processes show up. `search` ranks by cosine similarity, by FTS5 bm25, or by both fused.
+    The matrix is kept one row per dimension, so a sparse query (like the hashing embedder's) only reads
+    the rows of its non-zero dimensions. Connections are per process, the store can be used across `fork`.
+    """
+    def __init__(self, path: str, embedder: Embedder = None):
+        self.path = path
+        self.embedder = embedder or HashingEmbedder()
+        self._lock = threading.Lock()
+        self._conns: dict[int, sqlite3.Connection] = {}
+        self._ids = np.zeros(0, np.int64)
+        self._matrix = np.zeros((self.embedder.dim, 0), np.float32) # transposed: dimensions x memories
+        self._alive = np.zeros(0, bool)
+        self._count = 0
+        self._last_id = 0
+        self._last_forgotten = 0
+        with self._lock:
+            conn = self._conn()
+            conn.executescript(SCHEMA)
+            self._check_embedder(conn)
+            self._sync(conn)
+    def __len__(self) -> int:
+        with self._lock:
+            self._sync(self._conn())
+            return int(self._alive[:self._count].sum())
+    def add(self, text: str) -> int:
+        """Stores `text` and returns its id."""
+        return self.add_many([text])[0]
+    def add_many(self, texts: list[str]) -> list[int]:
+        """Stores several memories in one transaction, embedded in one batch."""
+        vectors = self.embedder(texts)
+        now = time.time()
+        with self._lock:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                ids = [
+                    conn.execute(
+                        "INSERT INTO memories (created, text, embedding) VALUES (?, ?, ?)", (now, text, vector.tobytes())
+                    ).lastrowid
+                    for text, vector in zip(texts, vectors)
+                ]
+            self._sync(conn)
+        return ids
+    def forget(self, memory_id: int) -> bool:
+        """Removes a memory from search results. Returns whether it existed."""
+        with self._lock:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT text FROM memories WHERE id = ?", (memory_id,)).fetchone()
+                if row is None or conn.execute("SELECT 1 FROM forgotten WHERE memory_id = ?", (memory_id,)).fetchone():
+                    return False
+                conn.execute("INSERT INTO forgotten (memory_id) VALUES (?)", (memory_id,))
+                conn.execute("INSERT INTO memories_fts (memories_fts, rowid, text) VALUES ('delete', ?, ?)", (memory_id, row[0]))
+            self._sync(conn)
+        return True
+    def recent(self, n: int = 10) -> list[dict]:
+        """The last `n` memories, newest first."""
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT id, created, text FROM memories WHERE id NOT IN (SELECT memory_id FROM forgotten) ORDER BY id DESC LIMIT ?",
+                (n,)
+            ).fetchall()
+        return [{"id": i, "created": created, "text": text} for i, created, text in rows]
+    def search(self, query: str, k: int = 5, mode: str = "hybrid") -> list[dict]:
+        """
+        The `k` best matches, best first, as `{"id", "created", "text", "score"}`.
+        `mode` is `vector`, `keyword`, or `hybrid` (reciprocal rank fusion of both).
+        """
+        if mode not in ("vector", "keyword", "hybrid"):
+            raise ValueError(f"Unknown search mode: {mode}")
+        query_vector = self.embedder([query])[0] if mode != "keyword" else None
+        with self._lock:
+            conn = self._conn()
+            self._sync(conn)
+            if mode == "vector":
+                ranked = self._vector(query_vector, k)
+            elif mode == "keyword":
+                ranked = self._keyword(conn, query, k)
+            else:
+                fused: dict[int, float] = {}
+                for results in (self._vector(query_vector, k*2), self._keyword(conn, query, k*2)):
+                    for rank, (memory_id, _) in enumerate(results):
+                        fused[memory_id] = fused.get(memory_id, 0.0)+1/(RRF_K+rank+1)
+                ranked = sorted(fused.items(), key=lambda i: -i[1])[:k]
+            if not ranked:
+                return []
+            rows = {i: (created, text) for i, created, text in conn.execute(
+                f"SELECT id, created, text FROM memories WHERE id IN ({','.join('?'*len(ranked))})", [i for i, _ in ranked]
+            )}
+        return [{"id": i, "created": rows[i][0], "text": rows[i][1], "score": score} for i, score in ranked if i in rows]
+    def _vector(self, query_vector: np.ndarray, k: int) -> list[tuple[int, float]]:
+        n = self._count
+        if not n:
+            return []
+        dims = np.flatnonzero(query_vector)
+        if len(dims) < len(query_vector)//2:
+            scores = query_vector[dims]@self._matrix[dims, :n]
+        else:
+            scores = query_vector@self._matrix[:, :n]
+        scores[~self._alive[:n]] = -np.inf
+        k = min(k, n)
+        top = np.argpartition(-scores, k-1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self._ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+    def _keyword(self, conn: sqlite3.Connection, query: str, k: int) -> list[tuple[int, float]]:
+        words = list(dict.fromkeys(WORDS.findall(query.lower())))
+        words = [i for i in words if i not in STOPWORDS] or words
+        if not words:
+            return []
+        return [(i, -score) for i, score in conn.execute(
+            """
+                SELECT rowid, bm25(memories_fts) FROM memories_fts WHERE memories_fts MATCH :match AND rowid >= (
+                    SELECT coalesce(min(rowid), 0) FROM (
+                        SELECT rowid FROM memories_fts WHERE memories_fts MATCH :match ORDER BY rowid DESC LIMIT :window
+                    )
+                ) ORDER BY bm25(memories_fts) LIMIT :k
+            """,
+            {"match": " OR ".join(f'"{i}"' for i in words), "window": KEYWORD_WINDOW, "k": k}
+        )]
+    def _conn(self) -> sqlite3.Connection:
+        """This process's connection; one opened before a `fork` must not be used after it."""
+        pid = os.getpid()
+        conn = self._conns.get(pid)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._conns = {pid: conn} # drops, without closing, connections inherited from the parent
+        return conn
+    def _check_embedder(self, conn: sqlite3.Connection):
+        """Re-embeds the stored memories if they were embedded by another embedder."""
+        row = conn.execute("SELECT value FROM meta WHERE key = 'embedder'").fetchone()
+        if row is not None and row[0] == self.embedder.name:
+            return
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT id, text FROM memories").fetchall()
+            for start in range(0, len(rows), 1024):
+                batch = rows[start:start+1024]
+                vectors = self.embedder([text for _, text in batch])
+                conn.executemany(
+                    "UPDATE memories SET embedding = ? WHERE id = ?",
+                    [(vector.tobytes(), memory_id) for (memory_id, _), vector in zip(batch, vectors)]
+                )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('embedder', ?)", (self.embedder.name,))
+    def _sync(self, conn: sqlite3.Connection):
+        """Appends memories and applies forgets logged since the last sync."""
+        rows = conn.execute("SELECT id, embedding FROM memories WHERE id > ? ORDER BY id", (self._last_id,)).fetchall()
+        if rows:
+            n = self._count+len(rows)
+            if n > len(self._ids):
+                capacity = max(n, len(self._ids)*2, 1024)
+                self._ids = np.resize(self._ids, capacity)
+                self._alive = np.resize(self._alive, capacity)
+                matrix = np.zeros((self.embedder.dim, capacity), np.float32)
+                matrix[:, :self._count] = self._matrix[:, :self._count]
+                self._matrix = matrix
+            self._ids[self._count:n] = [i for i, _ in rows]
+            self._matrix[:, self._count:n] = np.frombuffer(b"".join(e for _, e in rows), np.float32).reshape(len(rows), -1).T
+            self._alive[self._count:n] = True
+            self._count = n
+            self._last_id = rows[-1][0]
+        for seq, memory_id in conn.execute("SELECT seq, memory_id FROM forgotten WHERE seq > ? ORDER BY seq", (self._last_forgotten,)):
+            i = np.searchsorted(self._ids[:self._count], memory_id)
+            if i < self._count and self._ids[i] == memory_id:
+                self._alive[i] = False
+            self._last_forgotten = seq
+
+store: MemoryStore = None # the store opened with `open_default`, used by the functions below
+unavailable: str = None # why there's no store, if known
+
+def open_default(path: str, embedder: Embedder = None) -> MemoryStore:
+    global store
+    store = MemoryStore(path, embedder)
+    return store
+
+def _default() -> MemoryStore:
+    if store is None:
+        raise RuntimeError(unavailable or "The memory store isn't configured")
+    return store
+
+def add(text: str) -> int:
+    """Remembers `text` (one fact per call works best) and returns its id."""
+    return _default().add(text)
+
+def search(query: str, k: int = 5, mode: str = "hybrid") -> list[dict]:
+    """Memories matching `query`, best first, as `{"id", "created", "text", "score"}`."""
+    return _default().search(query, k, mode)
+
+def forget(memory_id: int) -> bool:
+    return _default().forget(memory_id)
+
+def recent(n: int = 10) -> list[dict]:
+    return _default().recent(n)
@@ -1,28 +1,41 @@
 """Models for chat messages."""
 
-import datetime
-from dataclasses import dataclass, InitVar
-from typing import Union
-from . import chat
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import ClassVar, Union
 
-@dataclass
+@dataclass(slots=True)
 class Message:
+    """
+    Messages aren't edited once created (replace them instead), so `to_message` serializes each one once.
+    """
+    role: ClassVar[str] = None
     content: str
+    _message: dict = field(default=None, init=False, repr=False, compare=False)
+    def to_message(self) -> dict:
+        """The message as sent to providers. Cached and shared, don't modify it."""
+        if self._message is None:
+            self._message = self._serialize()
+        return self._message
+    def _serialize(self) -> dict:
+        return {"role": self.role, "content": self.content}
 
-@dataclass
+@dataclass(slots=True)
 class UserMessage(Message):
-    role: InitVar = "user"
+    role: ClassVar[str] = "user"
     content: str
 
-@dataclass
+@dataclass(slots=True)
 class ToolMessage(Message):
-    role: InitVar = "tool"
+    role: ClassVar[str] = "tool"
     content: str
     tool_call_id: str = ""
+    def _serialize(self) -> dict:
+        return {"role": self.role, "content": self.content, "tool_call_id": self.tool_call_id}
 
-@dataclass
+@dataclass(slots=True)
 class AssistantMessage(Message):
-    role: InitVar = "assistant"
+    role: ClassVar[str] = "assistant"
     content: str
     tts_text: str = None
     def __init__(self, content: str, tts_text: str = None):
@@ -30,33 +43,51 @@ class AssistantMessage(Message):
             tts_text = content
         self.content = content
         self.tts_text = tts_text
+        self._message = None
 
-@dataclass
 class History:
-    history: list[UserMessage | AssistantMessage | ToolMessage] = None
+    """
+    `history` is a plain list of messages: append to it, or assign a new list for any other change.
+    `to_messages` keeps the serialized list between calls and only serializes what was appended since.
+    """
+    __slots__ = ("_history", "_messages", "_last")
     def __init__(self, history: list):
-        self.history = []
-        for msg in history:
-            self.history.append(create_message(**msg))
+        self._history = [create_message(**msg) for msg in history]
+        self._messages: list[dict] = []
+        self._last = None # the message `_messages` ends with
+    @property
+    def history(self) -> list[Union[UserMessage, AssistantMessage, ToolMessage]]:
+        return self._history
+    @history.setter
+    def history(self, history: list):
+        self._history = history
+        self._messages = []
+        self._last = None
+    def __repr__(self) -> str:
+        return f"History(history={self._history!r})"
+    def __eq__(self, other) -> bool:
+        return isinstance(other, History) and self._history == other._history
     def add(self, message: Union[UserMessage, AssistantMessage, ToolMessage]):
-        self.history.append(message)
+        self._history.append(message)
     def add_user(self, content: str):
-        self.history.append(create_message("user", content))
+        self._history.append(create_message("user", content))
     def add_assistant(self, content: str, tts_text:str = None):
-        self.history.append(create_message("assistant", content, tts_text=tts_text))
+        self._history.append(create_message("assistant", content, tts_text=tts_text))
     def add_tool(self, content: str, tool_call_id: str = ""):
-        self.history.append(create_message("tool", content, tool_call_id=tool_call_id))
+        self._history.append(create_message("tool", content, tool_call_id=tool_call_id))
     def to_messages(self, i: int = None) -> list[dict]:
-        history = []
-        for message in list(reversed(self.history))[:i]:
-            d = {
-                "role": message.role,
-                "content": message.content
-            }
-            if isinstance(message, ToolMessage):
-                d["tool_call_id"] = message.tool_call_id
-            history.append(d)
-        return list(reversed(history))
+        """The messages as sent to providers, only the last `i` with `i`. A new list, of shared dicts."""
+        history, messages = self._history, self._messages
+        n = len(messages)
+        if n > len(history) or (n and history[n-1] is not self._last): # not just appended to
+            messages.clear()
+            n = 0
+        if n < len(history):
+            messages.extend(m.to_message() for m in islice(history, n, None))
+            self._last = history[-1]
+        if i is None:
+            return messages.copy()
+        return messages[-i:] if i else []
 
 def create_message(
         role: str, 
@@ -9,6 +9,8 @@ class ProviderConfig:
     name: str
     provider_name: str
     api_key: str
+    base_url: str = None # for self-hosted or mock endpoints
+    options: dict = None # any other provider specific keys
 
 @dataclass
 class ProvidersConfig:
@@ -19,18 +21,127 @@ class AgentConfig:
     name: str
     provider_config: ProviderConfig
     model_name: str
+    models: list[str] = None # model cascade, cheapest first; just `model_name` if not configured
+    think: str = "think" # reasoning mode: `think`, `no_think` or `auto` (no thinking for short requests)
+    max_think_tokens: int = None # cut off reasoning past this many streamed tokens and re-prompt without it
+    timeout: float = None # seconds the supervisor waits for this agent's report
+    def __post_init__(self):
+        if not self.models:
+            self.models = [self.model_name]
+
+@dataclass
+class DatabaseConfig:
+    path: str = "atlas.db"
+    conversation_ttl: float = 3600
+    conversation_cache_size: int = 256
+
+@dataclass
+class ContextConfig:
+    max_prompt_tokens: int = 24000 # estimated tokens per supervisor LLM call, system prompt included
+    tool_output_chars: int = 2000 # agent reports from earlier turns are cut to this
+    summary_tokens: int = 1024 # rolling summary of messages dropped from the prompt
+
+@dataclass
+class CacheConfig:
+    enabled: bool = True
+    ttl: float = 300 # seconds an answer is reused
+    time_bucket: float = 300 # answers are reused only for requests within the same window of this many seconds
+    max_entries: int = 1024
+    persist: bool = False # keep answers in the database so they survive restarts
+
+@dataclass
+class SandboxConfig:
+    max_output_bytes: int = 16384 # per channel and call; the head and tail are kept past it
+    max_concurrent: int = 4 # python calls running at once, across all agents
+    queue_timeout: float = 30 # seconds a call waits for a slot before it's rejected
+    memory_mb: int = 2048 # address space per session, 0 for no limit
+    cpu_seconds: float = 20 # CPU time per call, 0 for no limit
+    max_open_files: int = 256 # per session, 0 for no limit
+    workspace_ttl: float = 600 # seconds before the directory of an ended session is removed
+    workspace_max_mb: int = 1024 # all session directories together, 0 for no limit; ended ones are removed oldest first past it
+
+@dataclass
+class MemoryConfig:
+    enabled: bool = True
+    path: str = "memory.db" # opened by the sandbox user, who needs write access to it and its folder
+
+@dataclass
+class DispatchConfig:
+    max_parallel_agents: int = 1 # agents the supervisor may invoke in one turn, run at once; past 1, stop sequences aren't used
+    speculative: bool = False # warm agents up while their invocation streams, start them when it closes
+
+@dataclass
+class RouterConfig:
+    enabled: bool = True
+    intents: list[str] = None # pattern intents to answer directly, all of them by default
+    provider_config: ProviderConfig = None # optional small model, asked before falling through to the supervisor
+    model_name: str = None
+
+@dataclass
+class RequestsConfig:
+    timeout: float = 60 # seconds before a request is cancelled, 0 for no deadline
+    preempt: bool = True # a new request in a conversation cancels the one still running in it
+
+@dataclass
+class AdmissionConfig:
+    enabled: bool = True
+    user_rate: float = 0.5 # requests per second each user may make on average, 0 for no limit
+    user_burst: int = 5 # requests a user may make in a row before the rate applies
+    max_concurrent: int = 8 # LLM completions streaming at once per provider, 0 for no limit
+    provider_limits: dict = None # `max_concurrent` of individual providers, by name
+    max_queue: int = 32 # completions waiting per provider; more are turned away at once
+    queue_timeout: float = 15 # seconds a completion waits for a slot before it's turned away
+
+@dataclass
+class DebugConfig:
+    echo_stream: bool = False # echo LLM streams, tool calls and traces to the console
 
 @dataclass
 class Config:
     providers: ProvidersConfig
     agent_backends: list[AgentConfig]
+    database: DatabaseConfig
+    context: ContextConfig
+    cache: CacheConfig
+    router: RouterConfig
+    dispatch: DispatchConfig
+    sandbox: SandboxConfig
+    memory: MemoryConfig
+    requests: RequestsConfig
+    admission: AdmissionConfig
+    debug: DebugConfig
     def __init__(self, config_folder: str):
+        config_file = os.path.join(config_folder, "config.toml")
+        config = self._load_config(config_file)
+        self.database = DatabaseConfig(**config.get("database", {}))
+        self.context = ContextConfig(**config.get("context", {}))
+        self.cache = CacheConfig(**config.get("cache", {}))
+        self.dispatch = DispatchConfig(**config.get("dispatch", {}))
+        self.sandbox = SandboxConfig(**config.get("sandbox", {}))
+        self.memory = MemoryConfig(**config.get("memory", {}))
+        self.requests = RequestsConfig(**config.get("requests", {}))
+        self.admission = AdmissionConfig(**config.get("admission", {}))
+        self.debug = DebugConfig(**config.get("debug", {}))
+
         llm_providers_file = os.path.join(config_folder, "llm_providers.toml")
         self.providers = ProvidersConfig()
         llm_providers = self._load_config(llm_providers_file)
         for k,v in llm_providers.items():
-            setattr(self.providers, k, ProviderConfig(k, v.get("provider"), v.get("api_key")))
+            options = {i: j for i, j in v.items() if i not in ("provider", "api_key", "base_url")}
+            setattr(self.providers, k, ProviderConfig(k, v.get("provider"), v.get("api_key"), v.get("base_url"), options))
+        for provider in vars(self.providers).values():
+            # routing providers name their backends, other providers
+            if provider is not None and provider.provider_name == "routing" and provider.options.get("backends"):
+                provider.options["backends"] = [self.providers.__getattribute__(i) for i in provider.options["backends"]]
         
+        router = config.get("router", {})
+        self.router = RouterConfig(
+            router.get("enabled", True),
+            router.get("intents"),
+            self.providers.__getattribute__(router["provider"]) if router.get("provider") else None,
+            router.get("model_name")
+        )
+
         agent_backends_file = os.path.join(config_folder, "agent_backends.toml")
         self.agent_backends = []
         agent_backends = self._load_config(agent_backends_file)
@@ -38,7 +149,11 @@ class Config:
             agent_config = AgentConfig(
                 k,
                 self.providers.__getattribute__(v.get("provider")),
-                v.get("model_name")
+                v.get("model_name") or (v.get("models") or [None])[0],
+                v.get("models"),
+                v.get("think", "think"),
+                v.get("max_think_tokens"),
+                v.get("timeout")
             )
             self.agent_backends.append(agent_config)
     def _load_config(self, config_file: str):
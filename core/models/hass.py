@@ -1,6 +1,7 @@
 """Models for Home Assistant."""
 
 import datetime
+import re
 from dataclasses import dataclass
 from typing import Union
 from . import chat
@@ -42,6 +43,7 @@ class PromptPayload:
     text: str = None
     dt: datetime.datetime = None
     history: History = None
+    history_provided: bool = None
     conversation_id: str = None
     user: User = None
     device: Device = None
@@ -50,16 +52,19 @@ class PromptPayload:
         if not isinstance(payload, dict): raise TypeError("`payload` must be `dict`")
         self.text = payload.get("input_text")
         self.dt = datetime.datetime.fromtimestamp(payload.get("timest", 0))
-        self.history = History(payload.get("history"))
+        # without `history`, the history is looked up by `conversation_id` server-side
+        self.history_provided = payload.get("history") is not None
+        self.history = History(payload.get("history") or [])
         self.conversation_id = payload.get("conversation_id")
         self.user = User(payload.get("user_info"))
         self.device = Device(payload.get("device_info")) if payload.get("device_info") else None
         self.message = create_message("user", self.text)
 
-def generate_response_payload(history: History, content:str = None, tts_text: str = None, continue_conversation: bool = False) -> dict:
+def generate_response_payload(history: History, content:str = None, tts_text: str = None, continue_conversation: bool = False, since: int = None) -> dict:
     """
     Generates response payload from history.
     If last message in history is not an `AssistantMessage`, one will be added from `content` and `tts_text`.
+    If `since` is given, only messages from that index on are returned (as `new_messages`) instead of the whole `new_history`.
     """
     if not isinstance(history.history[-1], AssistantMessage):
         if content is None:
@@ -69,8 +74,18 @@ def generate_response_payload(history: History, content:str = None, tts_text: st
         if tts_text is None:
             raise ValueError("`tts_text` must be provided if last message in history is not `AssistantMessage`")
         history.add_assistant(content, tts_text)
-    return {
+    payload = {
         "tts_text": tts_text or history.history[-1].tts_text,
-        "new_history": history.to_messages(),
         "continue_conversation": continue_conversation
-    }
\ No newline at end of file
+    }
+    if since is None:
+        payload["new_history"] = history.to_messages()
+    else:
+        payload["new_messages"] = history.to_messages()[since:]
+    return payload
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def split_sentences(text: str) -> list[str]:
+    """Splits TTS text at sentence boundaries, so each sentence can be spoken as soon as it's ready."""
+    return [i for i in _SENTENCE_END.split(text.strip()) if i]
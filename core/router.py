@@ -0,0 +1,136 @@
+"""Pre-router that answers simple requests before they reach the supervisor."""
+
+from dataclasses import dataclass
+from typing import Callable, Iterable, Union
+import re
+
+from . import (
+    models,
+    llm,
+    context,
+    tracing
+)
+from .models.chat import AssistantMessage, History
+
+ROUTED = tracing.registry.counter("atlas_router_total", "Requests by the pre-router stage that answered them (`supervisor` when none did).")
+
+@dataclass
+class Answer:
+    tts_text: str
+    continue_conversation: bool = False
+
+Stage = Callable[[models.hass.PromptPayload], Union[Answer, None]]
+
+WAKE_WORDS = re.compile(r"^(?:(?:hey|hi|ok|okay)\s+)?atlas\s+|^(?:please|so)\s+|\s+please$")
+PUNCTUATION = re.compile(r"[^\w\s']+")
+U_OUT = re.compile(r"<u_out>(.*?)</u_out>", re.DOTALL)
+TAG = re.compile(r"<[^<>]*>")
+
+def normalize(text: str) -> str:
+    """Lower case, without punctuation, leading wake words or a trailing "please"."""
+    text = " ".join(PUNCTUATION.sub(" ", text.lower()).split())
+    previous = None
+    while previous != text:
+        previous, text = text, WAKE_WORDS.sub("", text).strip()
+    return text
+
+def _time(match: re.Match, prompt: models.hass.PromptPayload) -> Answer:
+    return Answer(f"It's {prompt.dt.strftime('%I:%M %p').lstrip('0')}.")
+
+def _date(match: re.Match, prompt: models.hass.PromptPayload) -> Answer:
+    return Answer(f"Today is {prompt.dt.strftime('%A, %B')} {prompt.dt.day}, {prompt.dt.year}.")
+
+def spoken_text(message: AssistantMessage) -> str:
+    """
+    What was said out loud in `message`. Its `tts_text`, unless that's just the raw content (histories sent
+    by the client have no other), in which case the closed `<u_out>` segments, outside of reasoning.
+    """
+    if message.tts_text and message.tts_text != message.content:
+        return message.tts_text
+    segments = (TAG.sub("", i).strip() for i in U_OUT.findall(context.strip_think(message.content)))
+    return "\n".join(i for i in segments if i)
+
+def _repeat(match: re.Match, prompt: models.hass.PromptPayload) -> Union[Answer, None]:
+    for message in reversed(prompt.history.history):
+        if isinstance(message, AssistantMessage):
+            text = spoken_text(message)
+            if text:
+                return Answer(text)
+    return None
+
+def _greeting(match: re.Match, prompt: models.hass.PromptPayload) -> Answer:
+    name = f", {prompt.user.name}" if prompt.user.name else ""
+    return Answer(f"Hello{name}. How can I help?", continue_conversation=True)
+
+# name: (full-utterance pattern on normalized text, handler); a handler returning `None` falls through
+INTENTS: dict[str, tuple[str, Callable[[re.Match, models.hass.PromptPayload], Union[Answer, None]]]] = {
+    "time": (
+        r"(?:what(?:'s| is)? the (?:current )?time(?: now| right now)?|what time is it(?: now| right now)?|time|current time|tell me the time)",
+        _time
+    ),
+    "date": (
+        r"(?:what(?:'s| is)? (?:the date|today's date)(?: today)?|what day is (?:it|today)(?: today)?|today's date|date today|what's today)",
+        _date
+    ),
+    "repeat": (
+        r"(?:repeat(?: that| it)?(?: again)?|say (?:that|it) again|what did you (?:just )?say|come again|pardon)",
+        _repeat
+    ),
+    "greeting": (
+        r"(?:hi|hello|hey|hey there|hello there|good (?:morning|afternoon|evening)|yo)",
+        _greeting
+    )
+}
+
+class PatternStage:
+    """Matches the whole normalized utterance against a table of compiled intent patterns."""
+    def __init__(self, intents: Iterable[str] = None):
+        names = list(INTENTS) if intents is None else list(intents)
+        for name in names:
+            if name not in INTENTS:
+                raise ValueError(f"Unknown intent: {name}")
+        self.intents = [(name, re.compile(INTENTS[name][0]), INTENTS[name][1]) for name in names]
+    def __call__(self, prompt: models.hass.PromptPayload) -> Union[Answer, None]:
+        if not prompt.text or len(prompt.text) > 80:
+            return None
+        text = normalize(prompt.text)
+        for name, pattern, handler in self.intents:
+            match = pattern.fullmatch(text)
+            if match is not None:
+                return handler(match, prompt)
+        return None
+
+LLM_SYSTEM = """
+You are the fast path of a voice assistant for Home Assistant.
+If the user's message is small talk or a question you can answer fully and correctly without any tools, devices, memory or the Internet, reply with only the spoken answer: plain text, at most two sentences.
+Otherwise, or if unsure, reply with exactly: PASS
+""".strip()
+
+class LLMStage:
+    """Asks a small, fast model to answer; it passes anything it can't answer on its own."""
+    TEMPERATURE = 0.0
+    PASS = "PASS"
+    def __init__(self, _llm: llm.LLM):
+        self.llm = _llm
+    def __call__(self, prompt: models.hass.PromptPayload) -> Union[Answer, None]:
+        history = History([])
+        history.add_user(prompt.text)
+        text = "".join(self.llm.complete(history, LLM_SYSTEM, self.TEMPERATURE))
+        text = context.strip_think(text).strip()
+        if not text or self.PASS in text:
+            return None
+        return Answer(text)
+
+class PreRouter:
+    """Runs the stages in order; the first answer wins. `route` returns `None` to hand the request to the supervisor."""
+    def __init__(self, stages: list[tuple[str, Stage]]):
+        self.stages = stages
+    @tracing.traced("router")
+    def route(self, prompt: models.hass.PromptPayload) -> Union[Answer, None]:
+        for name, stage in self.stages:
+            answer = stage(prompt)
+            if answer is not None:
+                ROUTED.inc(stage=name)
+                return answer
+        ROUTED.inc(stage="supervisor")
+        return None
@@ -0,0 +1,312 @@
+"""Warm Python sandbox sessions for agents that run code."""
+
+import atexit
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+from .. import cancellation, tracing
+
+FORKSERVER = os.path.join(os.path.dirname(__file__), "forkserver.py")
+MEMORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), "memory.py")
+WORKSPACES = os.path.join(tempfile.gettempdir(), "atlas-workspaces")
+
+QUEUE_SECONDS = tracing.registry.histogram("atlas_sandbox_queue_seconds", "Time python calls waited for a free sandbox slot.")
+REJECTED = tracing.registry.counter("atlas_sandbox_rejected_total", "Python calls not run because no sandbox slot freed up in time.")
+REAPED = tracing.registry.counter("atlas_sandbox_workspaces_reaped_total", "Workspace directories removed, by reason.")
+
+class Session:
+    """One sandbox interpreter, with globals kept between calls."""
+    def __init__(self, sock: socket.socket, pid: int):
+        self.sock = sock
+        self.pid = pid
+        self.rfile = sock.makefile("r")
+        self.wfile = sock.makefile("w")
+        self.calls = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+    def run(self, code: str, timeout: float, max_output: int, cpu_seconds: float = None) -> dict:
+        self.calls += 1
+        self.sock.settimeout(timeout)
+        self.wfile.write(json.dumps({"code": code, "max_output": max_output, "cpu_seconds": cpu_seconds})+"\n")
+        self.wfile.flush()
+        line = self.rfile.readline()
+        self.last_used = time.monotonic()
+        if not line:
+            raise ConnectionError("Sandbox session died")
+        return json.loads(line)
+    def kill(self):
+        """Kills the session and everything the code started (its process group)."""
+        if self.pid:
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        self.close()
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class _Slots:
+    """A counting semaphore whose waits end early when the current request is cancelled."""
+    def __init__(self, n: int):
+        self.free = n
+        self._condition = threading.Condition()
+    def acquire(self, timeout: float) -> bool:
+        """Whether a slot was taken within `timeout` seconds, before the request was cancelled."""
+        deadline = time.monotonic()+timeout
+        token = cancellation.current()
+        if token is not None:
+            token.add_callback(self._wake)
+        try:
+            with self._condition:
+                while not self.free:
+                    remaining = deadline-time.monotonic()
+                    if remaining <= 0 or (token is not None and token.cancelled):
+                        return False
+                    self._condition.wait(remaining)
+                self.free -= 1
+                return True
+        finally:
+            if token is not None:
+                token.remove_callback(self._wake)
+    def release(self):
+        with self._condition:
+            self.free += 1
+            self._condition.notify_all()
+    def _wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+class SandboxPool:
+    """
+    Hands out warm sandbox sessions keyed by runtime environment id.
+    Sessions are forked from a fork server running as the sandbox user, which has already imported
+    the common modules, so a call doesn't pay for `su`, interpreter startup or imports.
+    Sessions are recycled after `max_calls` calls or `idle_timeout` seconds unused,
+    and the fork server itself after `max_forks` sessions.
+    Stdout and stderr are each capped at `max_output` bytes (head and tail kept) inside the session.
+
+    At most `max_concurrent` calls run at once, others queue for up to `queue_timeout` seconds.
+    Each session is limited to `memory_bytes` of address space and `open_files` descriptors, and each call
+    to `cpu_seconds` of CPU time; `None` leaves a limit as it is. On timeout the session's whole process group is killed.
+    Sessions work in their own directory under `workspace_root`. Directories of ended sessions are removed
+    once unused for `workspace_ttl` seconds, or oldest first while all of them together exceed `workspace_max_bytes`.
+    With a `memory_path`, code can `import memory` (`core.memory`, opened on that file by the fork server).
+    """
+    COMMAND = ["su", "-c", "python3 -", "sandbox"]
+    REAP_INTERVAL = 60
+    def __init__(
+        self, max_calls: int = 50, idle_timeout: float = 300, max_forks: int = 500, max_output: int = 16384,
+        max_concurrent: int = 4, queue_timeout: float = 30,
+        memory_bytes: int = None, cpu_seconds: float = None, open_files: int = None,
+        workspace_root: str = WORKSPACES, workspace_ttl: float = 600, workspace_max_bytes: int = None,
+        memory_path: str = None
+    ):
+        self.max_calls = max_calls
+        self.idle_timeout = idle_timeout
+        self.max_forks = max_forks
+        self.max_output = max_output
+        self.queue_timeout = queue_timeout
+        self.memory_bytes = memory_bytes
+        self.cpu_seconds = cpu_seconds
+        self.open_files = open_files
+        self.workspace_root = workspace_root
+        self.workspace_ttl = workspace_ttl
+        self.workspace_max_bytes = workspace_max_bytes
+        self.memory_path = memory_path
+        self._slots = _Slots(max_concurrent)
+        self._sessions: dict[str, Session] = {}
+        self._lock = threading.Lock()
+        self._server: subprocess.Popen = None
+        self._server_path: str = None
+        self._forks = 0
+        self._next_reap = 0.0
+    def set_max_concurrent(self, max_concurrent: int):
+        """Calls already running or queued keep the slots they were counted against."""
+        self._slots = _Slots(max_concurrent)
+    def run(self, code: str, env_id: str, timeout: float = 30) -> str:
+        """
+        Runs `code` in the session for `env_id`. Returns its output as laid out by `format_result`.
+        `timeout` counts from when the call gets a slot, not while it queues.
+        Raises `Cancelled` without running the code if the request is cancelled before it starts.
+        """
+        slots = self._slots
+        t = time.perf_counter()
+        acquired = slots.acquire(timeout=self.queue_timeout)
+        QUEUE_SECONDS.observe(time.perf_counter()-t)
+        if not acquired:
+            cancellation.check()
+            REJECTED.inc()
+            return f"SandboxBusy: no Python runtime was free for {self.queue_timeout} seconds, the code was not run. Variables were kept."
+        try:
+            cancellation.check()
+            session = self._acquire(env_id)
+            try:
+                cancellation.check() # cancelled from here on, the session is found and killed
+            except cancellation.Cancelled:
+                self._drop(env_id, session)
+                raise
+            with session.lock:
+                try:
+                    result = session.run(code, timeout, self.max_output, self.cpu_seconds)
+                except (TimeoutError, socket.timeout):
+                    self._drop(env_id, session)
+                    return f"TimeoutError: execution took longer than {timeout} seconds and was killed. Variables were lost."
+                except (ConnectionError, OSError, ValueError) as e:
+                    self._drop(env_id, session)
+                    return f"SandboxError: the Python runtime crashed ({e}). Variables were lost."
+        finally:
+            slots.release()
+        if session.calls >= self.max_calls:
+            self.release(env_id)
+        return format_result(result)
+    def prepare(self, env_id: str):
+        """Starts the session for `env_id` ahead of its first `run`."""
+        self._acquire(env_id)
+    def release(self, env_id: str):
+        """Ends the session for `env_id`, if any."""
+        with self._lock:
+            session = self._sessions.pop(env_id, None)
+        if session is not None:
+            session.kill()
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._stop_server()
+        for session in sessions:
+            session.kill()
+    def _drop(self, env_id: str, session: Session):
+        with self._lock:
+            if self._sessions.get(env_id) is session:
+                del self._sessions[env_id]
+        session.kill()
+    def reap_workspaces(self):
+        """Removes the directories of ended sessions that are too old, then the oldest while over the size cap."""
+        now = time.time()
+        with self._lock:
+            active = set(self._sessions)
+        try:
+            entries = [i for i in os.scandir(self.workspace_root) if i.is_dir(follow_symlinks=False)]
+        except OSError:
+            return
+        workspaces = [] # (last modified, size, path) of ended sessions
+        total = 0
+        for entry in entries:
+            modified, size = _usage(entry.path)
+            total += size
+            if entry.name in active:
+                continue
+            if now-modified > self.workspace_ttl:
+                self._remove_workspace(entry.path, "expired")
+                total -= size
+            else:
+                workspaces.append((modified, size, entry.path))
+        if self.workspace_max_bytes is not None:
+            for modified, size, path in sorted(workspaces):
+                if total <= self.workspace_max_bytes:
+                    break
+                self._remove_workspace(path, "size")
+                total -= size
+    def _remove_workspace(self, path: str, reason: str):
+        shutil.rmtree(path, ignore_errors=True)
+        if not os.path.lexists(path):
+            REAPED.inc(reason=reason)
+    def _acquire(self, env_id: str) -> Session:
+        with self._lock:
+            self._reap_idle()
+            if time.monotonic() >= self._next_reap:
+                self._next_reap = time.monotonic()+self.REAP_INTERVAL
+                threading.Thread(target=self.reap_workspaces, daemon=True).start()
+            session = self._sessions.get(env_id)
+            if session is None:
+                session = self._sessions[env_id] = self._fork(env_id)
+            return session
+    def _reap_idle(self):
+        now = time.monotonic()
+        for env_id, session in list(self._sessions.items()):
+            if now-session.last_used > self.idle_timeout and not session.lock.locked():
+                del self._sessions[env_id]
+                session.kill()
+    def _fork(self, env_id: str) -> Session:
+        if self._server is None or self._server.poll() is not None or self._forks >= self.max_forks:
+            self._start_server()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._server_path)
+        sock.sendall((json.dumps({
+            "env_id": env_id,
+            "workspace": os.path.join(self.workspace_root, env_id),
+            "memory_bytes": self.memory_bytes,
+            "open_files": self.open_files
+        })+"\n").encode())
+        session = Session(sock, 0)
+        session.pid = json.loads(session.rfile.readline())["pid"]
+        self._forks += 1
+        return session
+    def _start_server(self):
+        self._stop_server()
+        self._server = subprocess.Popen(self.COMMAND, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        modules = {}
+        if self.memory_path:
+            with open(MEMORY) as f:
+                modules["memory"] = f.read()
+        self._server.stdin.write(f"MODULES = {modules!r}\nMEMORY_PATH = {self.memory_path!r}\n")
+        with open(FORKSERVER) as f:
+            self._server.stdin.write(f.read())
+        self._server.stdin.close()
+        self._server_path = self._server.stdout.readline().strip()
+        if not self._server_path:
+            raise RuntimeError("Sandbox fork server failed to start")
+        self._forks = 0
+    def _stop_server(self):
+        # running sessions are separate processes and outlive the fork server
+        if self._server is not None and self._server.poll() is None:
+            self._server.terminate()
+            try:
+                self._server.wait(5)
+            except subprocess.TimeoutExpired:
+                self._server.kill()
+        self._server = None
+
+def format_result(result: dict) -> str:
+    """
+    Stdout, then stderr under a `STDERR:` header. A channel the session cut (head and tail kept)
+    carries its note of the size it had, where bytes were left out.
+    """
+    output = ""
+    for channel in ("stdout", "stderr"):
+        text = result[channel]
+        if not text and not result.get(f"{channel}_bytes"):
+            continue
+        if channel == "stderr":
+            text = "STDERR:\n"+text
+        if output and not output.endswith("\n"):
+            output += "\n"
+        output += text
+    return output
+
+def _usage(path: str) -> tuple[float, int]:
+    """Latest modification time and total size of the files under `path`."""
+    modified, size = 0.0, 0
+    for root, dirs, files in os.walk(path):
+        for name in [root, *(os.path.join(root, i) for i in files)]:
+            try:
+                st = os.lstat(name)
+            except OSError:
+                continue
+            modified = max(modified, st.st_mtime)
+            if name != root:
+                size += st.st_size
+    return modified, size
+
+pool = SandboxPool()
+atexit.register(pool.close)
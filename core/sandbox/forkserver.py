@@ -0,0 +1,262 @@
+"""
+Sandbox fork server. Not imported: `core.sandbox` pipes this file into `python3 -` running as the sandbox user,
+after assignments of `MODULES` (name -> source of modules to preload) and `MEMORY_PATH`.
+
+Pre-imports common modules once, opens the memory store, then forks a session process per connection.
+A session keeps its globals between calls, so variables persist for a whole sys_worker task.
+
+Protocol (JSON lines over a Unix socket):
+    -> {"env_id": "...", "workspace": "/tmp/...", "memory_bytes": 2147483648, "open_files": 256}
+                                                <- {"pid": 1234}
+    -> {"code": "...", "max_output": 16384, "cpu_seconds": 20}
+                                                <- {"stdout": "...", "stderr": "...", "stdout_bytes": 12, "stderr_bytes": 0}
+
+Output is drained from pipes as it's written. Past `max_output` bytes per channel, only the head and tail are kept,
+so a session's memory doesn't depend on what the code prints. `*_bytes` are the sizes before truncation.
+
+A session's address space and open files are capped for its lifetime (inherited by anything it starts),
+its CPU time per call. Past the CPU limit the code gets a `CPULimitExceeded` exception.
+"""
+
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import re
+import resource
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import types
+
+PRELOAD = [
+    "json", "re", "math", "datetime", "time", "subprocess", "shutil", "pathlib",
+    "urllib.request", "http.client", "ssl", "csv", "sqlite3",
+    "requests", "numpy", "pandas"
+]
+
+for name in PRELOAD:
+    try:
+        __import__(name)
+    except Exception:
+        pass
+
+def install(name: str, source: str) -> types.ModuleType:
+    module = types.ModuleType(name)
+    exec(compile(source, f"<{name}>", "exec"), module.__dict__)
+    sys.modules[name] = module
+    return module
+
+for name, source in globals().get("MODULES", {}).items():
+    try:
+        install(name, source)
+    except Exception:
+        pass
+
+if globals().get("MEMORY_PATH") and "memory" in sys.modules:
+    # the embedding matrix is loaded once here, sessions share it and catch up on newer memories
+    try:
+        sys.modules["memory"].open_default(MEMORY_PATH)
+    except Exception as e:
+        sys.modules["memory"].unavailable = f"The memory store couldn't be opened: {e}"
+
+DEFAULT_MAX_OUTPUT = 16384
+PIPE_SIZE = 1 << 20
+DRAIN_INTERVAL = 0.005 # polled rather than a blocking read, which would take the GIL from the code on every write
+DRAIN_TIMEOUT = 0.5 # background processes the code started may hold the pipes open
+ANSI = re.compile(r"\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[@-Z\\-_])")
+CONTROL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+
+class CPULimitExceeded(Exception):
+    pass
+
+def _on_cpu_limit(signum, frame):
+    raise CPULimitExceeded("the call used up its CPU time and was stopped")
+
+def set_limit(limit: int, value: int):
+    """Lowers the soft and hard `limit` to `value` (never raises the hard limit)."""
+    if not value:
+        return
+    _, hard = resource.getrlimit(limit)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(limit, (value, value))
+
+@contextmanager
+def cpu_limit(seconds: float):
+    """
+    Raises `CPULimitExceeded` in the code once it used `seconds` of CPU time. RLIMIT_CPU counts for the whole
+    process, so the soft limit is moved to the time already used plus `seconds` and back after the call.
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if not seconds:
+        yield
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime+usage.ru_stime+seconds)+1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    previous = signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        signal.signal(signal.SIGXCPU, previous)
+
+class Capture:
+    """
+    Drains a pipe on a thread, keeping at most the first and last `limit/2` bytes.
+    `text` stops draining: output written after it (by background processes) is dropped.
+    """
+    def __init__(self, fd: int, limit: int):
+        self.fd = fd
+        self.head_limit = limit//2
+        self.tail_limit = limit-self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self._stopped = False
+        self._lock = threading.Lock()
+        os.set_blocking(fd, False)
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+    def _drain(self):
+        try:
+            while not self._stopped:
+                try:
+                    data = os.read(self.fd, PIPE_SIZE)
+                except BlockingIOError:
+                    time.sleep(DRAIN_INTERVAL)
+                    continue
+                if not data:
+                    break
+                with self._lock:
+                    if self._stopped:
+                        break
+                    self.total += len(data)
+                    room = self.head_limit-len(self.head)
+                    if room > 0:
+                        self.head += data[:room]
+                        data = data[room:]
+                    if data:
+                        self.tail += data
+                        if len(self.tail) > self.tail_limit:
+                            del self.tail[:len(self.tail)-self.tail_limit]
+        finally:
+            os.close(self.fd)
+    def text(self) -> str:
+        """The output, with a note of the size it had where bytes were left out."""
+        self.thread.join(DRAIN_TIMEOUT)
+        with self._lock:
+            self._stopped = True
+            head, tail = bytes(self.head), bytes(self.tail)
+        omitted = self.total-len(head)-len(tail)
+        if omitted <= 0:
+            return sanitize(head+tail)
+        return sanitize(head)+f"\n[... {omitted} of {self.total} bytes omitted ...]\n"+sanitize(tail)
+
+def sanitize(data: bytes) -> str:
+    """Text fit for a prompt: no terminal escapes or control characters, binary data summarised."""
+    text = data.decode(errors="replace")
+    text = ANSI.sub("", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = CONTROL.sub("", text)
+    if text and text.count("\ufffd") > len(text)//10:
+        return f"[{len(data)} bytes of binary output]"
+    return text
+
+def execute(code: str, namespace: dict, max_output: int = DEFAULT_MAX_OUTPUT, cpu_seconds: float = None) -> dict:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    (out_r, out_w), (err_r, err_w) = os.pipe(), os.pipe()
+    for fd in (out_w, err_w):
+        try:
+            fcntl.fcntl(fd, getattr(fcntl, "F_SETPIPE_SZ", 1031), PIPE_SIZE)
+        except OSError:
+            pass
+    out, err = Capture(out_r, max_output), Capture(err_r, max_output)
+    os.dup2(out_w, 1)
+    os.dup2(err_w, 2)
+    os.close(out_w)
+    os.close(err_w)
+    try:
+        with cpu_limit(cpu_seconds):
+            exec(compile(code, "<python>", "exec"), namespace)
+    except SystemExit:
+        pass
+    except BaseException as e:
+        # skip the fork server's frames, the traceback should look like the script ran on its own
+        exception = traceback.TracebackException(type(e), e, e.__traceback__.tb_next)
+        exception.stack = traceback.StackSummary.from_list(
+            [i for i in exception.stack if i.filename != execute.__code__.co_filename]
+        )
+        sys.stderr.write("".join(exception.format()))
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # closes the last write ends held by this process, the drain threads see EOF
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        os.close(saved[0])
+        os.close(saved[1])
+    return {
+        "stdout": out.text(),
+        "stderr": err.text(),
+        "stdout_bytes": out.total,
+        "stderr_bytes": err.total
+    }
+
+def session(conn: socket.socket):
+    # own process group, so a timeout can kill everything the code started
+    os.setsid()
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    rfile = conn.makefile("r")
+    wfile = conn.makefile("w")
+    hello = json.loads(rfile.readline())
+    workdir = hello.get("workspace") or os.path.join(tempfile.gettempdir(), hello["env_id"])
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    set_limit(resource.RLIMIT_AS, hello.get("memory_bytes"))
+    set_limit(resource.RLIMIT_NOFILE, hello.get("open_files"))
+    wfile.write(json.dumps({"pid": os.getpid()})+"\n")
+    wfile.flush()
+    namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+    for line in rfile:
+        request = json.loads(line)
+        result = execute(request["code"], namespace, request.get("max_output", DEFAULT_MAX_OUTPUT), request.get("cpu_seconds"))
+        wfile.write(json.dumps(result)+"\n")
+        wfile.flush()
+
+def main():
+    sockdir = tempfile.mkdtemp(prefix="atlas-sandbox-")
+    path = os.path.join(sockdir, "forkserver.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    print(path, flush=True)
+    def shutdown(*_):
+        os.unlink(path)
+        os.rmdir(sockdir)
+        os._exit(0)
+    signal.signal(signal.SIGTERM, shutdown)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN) # auto-reap sessions
+    while True:
+        conn, _ = server.accept()
+        if os.fork() == 0:
+            server.close()
+            try:
+                session(conn)
+            finally:
+                os._exit(0)
+        conn.close()
+
+main()
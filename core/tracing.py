@@ -0,0 +1,193 @@
+"""Latency tracing, Prometheus-style metrics and the debug console sink."""
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import contextvars
+import functools
+import math
+import sys
+import threading
+import time
+from typing import Union
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+RATE_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, math.inf)
+
+def _labels_text(labels: tuple) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+class Histogram:
+    """Histogram family; one set of buckets per label combination."""
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {} # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0]*len(self.buckets)+[0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = _labels_text(key)
+                sep = "," if labels else ""
+                for bound, count in zip(self.buckets, series):
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f'{self.name}_bucket{{{labels}{sep}le="{le}"}} {count}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series[-2]}")
+                lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._series: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+    def inc(self, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0)+value
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._series.items()):
+                lines.append(f"{self.name}{{{_labels_text(key)}}} {value}")
+        return lines
+
+class Gauge(Counter):
+    """A value that goes up and down, eg. a queue depth."""
+    def set(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = value
+    def render(self) -> list[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Union[Histogram, Counter, Gauge]] = {}
+        self._lock = threading.Lock()
+    def histogram(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        with self._lock:
+            return self.metrics.setdefault(name, Histogram(name, help, buckets))
+    def counter(self, name: str, help: str) -> Counter:
+        with self._lock:
+            return self.metrics.setdefault(name, Counter(name, help))
+    def gauge(self, name: str, help: str) -> Gauge:
+        with self._lock:
+            return self.metrics.setdefault(name, Gauge(name, help))
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render())+"\n"
+
+registry = Registry()
+
+SPAN_SECONDS = registry.histogram("atlas_span_seconds", "Duration of traced pipeline stages.")
+LLM_TTFT_SECONDS = registry.histogram("atlas_llm_ttft_seconds", "Time to first token of LLM completions.")
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "atlas_llm_tokens_per_second", "Streaming rate of LLM completions, after the first token.", RATE_BUCKETS
+)
+LLM_TOKENS = registry.counter("atlas_llm_tokens_total", "Streamed LLM tokens (provider deltas).")
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    duration: float = None
+    attrs: dict = field(default_factory=dict)
+
+@dataclass
+class Trace:
+    """Spans of one request, in the order they finished."""
+    spans: list[Span] = field(default_factory=list)
+    def summary(self) -> str:
+        return " ".join(f"{i.name}={i.duration*1000:.1f}ms" for i in self.spans)
+
+_trace: contextvars.ContextVar[Trace] = contextvars.ContextVar("trace", default=None)
+
+def current_trace() -> Union[Trace, None]:
+    return _trace.get()
+
+@contextmanager
+def trace():
+    """Collects the spans of everything run inside it (on this thread/context)."""
+    t = Trace()
+    token = _trace.set(t)
+    try:
+        yield t
+    finally:
+        _trace.reset(token)
+
+def record_span(span: Span):
+    SPAN_SECONDS.observe(span.duration, span=span.name)
+    t = _trace.get()
+    if t is not None:
+        t.spans.append(span)
+
+@contextmanager
+def span(name: str, **attrs):
+    s = Span(name, time.perf_counter(), attrs=attrs)
+    try:
+        yield s
+    finally:
+        s.duration = time.perf_counter()-s.start
+        record_span(s)
+
+def traced(name: str):
+    """Decorator version of `span`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class DebugSink:
+    """
+    Console echo of streamed output. Off unless enabled, and buffered:
+    written out on newlines or once `buffer_size` characters are pending, not one syscall per token.
+    """
+    def __init__(self, enabled: bool = False, buffer_size: int = 4096):
+        self.enabled = enabled
+        self.buffer_size = buffer_size
+        self._buffer: list[str] = []
+        self._pending = 0
+        self._lock = threading.Lock()
+    def write(self, text: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._buffer.append(text)
+            self._pending += len(text)
+            if "\n" in text or self._pending >= self.buffer_size:
+                self._flush()
+    def print(self, *args, sep: str = " ", end: str = "\n"):
+        if self.enabled:
+            self.write(sep.join(str(i) for i in args)+end)
+    def flush(self):
+        with self._lock:
+            self._flush()
+    def _flush(self):
+        if self._buffer:
+            sys.stdout.write("".join(self._buffer))
+            sys.stdout.flush()
+            self._buffer = []
+            self._pending = 0
+
+console = DebugSink()
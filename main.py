@@ -2,7 +2,10 @@
 
 import bottle
 import json
+import math
 import os
+import socketserver
+import wsgiref.simple_server
 import core
 from core import models
 
@@ -16,23 +19,20 @@ class JSONBottle(bottle.Bottle):
 
 app = JSONBottle()
 
-atlas = core.atlas.ATLAS(models.config.Config('config/'))
+CONFIG_FOLDER = os.environ.get('ATLAS_CONFIG', 'config/')
 
-def _check_auth_token(token):
-    try:
-        auth_file = os.path.join('config/auth/', 'auth_tokens')
-        if not os.path.exists(auth_file):
-            return False
-        with open(auth_file) as f:
-            valid_tokens = {line.strip() for line in f if line.strip()}
-        return token in valid_tokens
-    except:
-        return False
+atlas = core.atlas.ATLAS(models.config.Config(CONFIG_FOLDER))
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, wsgiref.simple_server.WSGIServer):
+    """Handles each request on its own thread, so one household doesn't wait on another."""
+    daemon_threads = True
+
+auth_tokens = core.auth.TokenIndex(os.path.join(CONFIG_FOLDER, 'auth', 'auth_tokens'))
 
 def require_auth(func):
     def wrapper(*args, **kwargs):
         auth_token = bottle.request.headers.get('Authorization')
-        if not auth_token or not _check_auth_token(auth_token):
+        if not auth_tokens.check(auth_token):
             bottle.response.status = 401
             return {"error": "Unauthorized"}
         return func(*args, **kwargs)
@@ -42,11 +42,41 @@ def require_auth(func):
 @require_auth
 def process_hass_user():
     prompt = models.hass.PromptPayload(bottle.request.json)
-    response_payload = atlas.process_hass_user(prompt)
+    token = core.cancellation.Token(atlas.config.requests.timeout)
+    try:
+        response_payload = atlas.process_hass_user(prompt, token=token)
+    except core.cancellation.Cancelled as e:
+        # past the deadline, or the user spoke again in the conversation
+        bottle.response.status = 504 if e.reason == "deadline" else 409
+        return {"success": False, "error": str(e)}
+    except core.admission.Rejected as e:
+        # over the user's rate or the provider's queue; the client can speak `tts_text`
+        bottle.response.status = 429
+        bottle.response.set_header("Retry-After", str(max(math.ceil(e.retry_after), 1)))
+        return {"success": False, "error": str(e), "data": {"tts_text": e.tts_text, "continue_conversation": False}}
     return {
         "success": True,
         "data": response_payload
     }
 
+@app.route("/process_hass_user/stream", method="POST")
+@require_auth
+def process_hass_user_stream():
+    """
+    Same as `/process_hass_user`, but streams JSON lines so TTS can start on the first sentence.
+    The request is cancelled if the client disconnects (noticed when the next frame can't be sent).
+    """
+    prompt = models.hass.PromptPayload(bottle.request.json)
+    token = core.cancellation.Token(atlas.config.requests.timeout)
+    bottle.response.content_type = "application/x-ndjson"
+    return (json.dumps(frame)+"\n" for frame in atlas.stream_hass_user(prompt, token))
+
+@app.route("/metrics", method="GET")
+@require_auth
+def metrics():
+    """Prometheus-style latency histograms and counters."""
+    bottle.response.content_type = "text/plain; version=0.0.4"
+    return core.tracing.registry.render()
+
 if __name__ == "__main__":
-    bottle.run(app, host='0.0.0.0', port=8054)
+    bottle.run(app, host='0.0.0.0', port=8054, server_class=ThreadingWSGIServer)
@@ -0,0 +1,108 @@
+"""Rate limits per user and fair, prioritized queues per LLM provider."""
+
+import threading
+import time
+
+import pytest
+
+from core import admission, cancellation, models
+from core.llm import LLM, routing
+
+def queue(gate: admission.ProviderGate, *waiters: tuple[str, int]) -> list[str]:
+    """Queues `(user, priority)` completions behind one holding the only slot, and returns the order they get it in."""
+    gate.acquire("holder")
+    order = []
+    lock = threading.Lock()
+    def wait(name: str, user: str, priority: int):
+        gate.acquire(user, priority)
+        with lock:
+            order.append(name)
+        gate.release()
+    threads = []
+    for i, (user, priority) in enumerate(waiters):
+        threads.append(threading.Thread(target=wait, args=(f"{user}{i}", user, priority)))
+        threads[-1].start()
+        while gate._waiting < i+1:
+            time.sleep(0.001)
+    gate.release()
+    for thread in threads:
+        thread.join(2)
+    return order
+
+def test_interactive_ahead_of_background():
+    gate = admission.ProviderGate("p", 1)
+    assert queue(gate, ("a", admission.BACKGROUND), ("b", admission.INTERACTIVE)) == ["b1", "a0"]
+
+def test_users_take_turns():
+    gate = admission.ProviderGate("p", 1)
+    order = queue(gate, ("a", admission.INTERACTIVE), ("a", admission.INTERACTIVE), ("a", admission.INTERACTIVE), ("b", admission.INTERACTIVE))
+    assert order == ["a0", "b3", "a1", "a2"]
+
+def test_full_queue_rejects_at_once():
+    gate = admission.ProviderGate("p", 1, max_queue=0)
+    gate.acquire("a")
+    with pytest.raises(admission.Rejected) as e:
+        gate.acquire("b")
+    assert e.value.reason == "queue_full"
+
+def test_queue_timeout_rejects():
+    gate = admission.ProviderGate("p", 1, queue_timeout=0.05)
+    gate.acquire("a")
+    with pytest.raises(admission.Rejected) as e:
+        gate.acquire("b")
+    assert e.value.reason == "queue_timeout"
+    assert gate._waiting == 0
+    gate.release()
+    gate.acquire("b") # the abandoned waiter doesn't take the freed slot
+
+def test_cancel_while_queued():
+    gate = admission.ProviderGate("p", 1, queue_timeout=5)
+    gate.acquire("a")
+    token = cancellation.Token()
+    threading.Timer(0.05, token.cancel, args=("preempted",)).start()
+    t = time.monotonic()
+    with cancellation.scope(token), pytest.raises(cancellation.Cancelled):
+        gate.acquire("b")
+    assert time.monotonic()-t < 1
+    assert gate._waiting == 0
+
+def test_user_over_rate_is_rejected():
+    limiter = admission.UserLimiter(rate=1, burst=2)
+    limiter.admit("a")
+    limiter.admit("a")
+    with pytest.raises(admission.Rejected) as e:
+        limiter.admit("a")
+    assert 0 < e.value.retry_after <= 1
+    limiter.admit("b")
+
+class Backend(LLM):
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.streaming = 0
+        self.most = 0
+        self.lock = threading.Lock()
+    def _complete(self, messages: list, temperature: float = None, stop=None, model: str = None):
+        with self.lock:
+            self.streaming += 1
+            self.most = max(self.most, self.streaming)
+        time.sleep(0.02)
+        yield "Hi"
+        with self.lock:
+            self.streaming -= 1
+
+@pytest.mark.parametrize("hedge_after", [None, 0.001])
+def test_routed_completions_queue_at_backend_gate(monkeypatch, hedge_after: float):
+    monkeypatch.setattr(admission, "providers", admission.ProviderGates(0, limits={"cerebras": 1}))
+    backend = Backend("cerebras")
+    llm = routing.Routing.__new__(routing.Routing)
+    LLM.__init__(llm, "routed")
+    llm.backends = [routing.Backend(backend), routing.Backend(backend)] # two endpoints of one provider
+    llm.strategy = "priority"
+    llm.hedge_after = hedge_after
+    llm.cooldown = 30
+    threads = [threading.Thread(target=lambda: list(llm.complete(models.chat.History([])))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(2)
+    assert backend.most == 1
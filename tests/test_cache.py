@@ -0,0 +1,85 @@
+"""Answers reused for repeated requests, and what keeps them out."""
+
+import time
+
+from core import cache, models, router
+from core.agents import sys_worker
+from core.llm import LLM
+
+def prompt(text: str = "What's the capital of France?", timest: int = 1760000000, history: list = None) -> models.hass.PromptPayload:
+    return models.hass.PromptPayload({
+        "input_text": text,
+        "timest": timest,
+        "history": history,
+        "user_info": {"id": "u1", "name": "Alice", "is_admin": False, "is_owner": True}
+    })
+
+def test_key_normalizes_utterance():
+    responses = cache.ResponseCache()
+    assert responses.key(prompt("What's the capital of France?")) == responses.key(prompt("what's the capital of france"))
+
+def test_key_depends_on_time_bucket():
+    responses = cache.ResponseCache(time_bucket=300)
+    assert responses.key(prompt(timest=1760000000)) != responses.key(prompt(timest=1760000000+300))
+
+def test_follow_up_is_not_cached():
+    assert cache.ResponseCache().key(prompt(history=[{"role": "user", "content": "hi"}])) is None
+
+def test_expired_answer_is_not_reused():
+    responses = cache.ResponseCache(ttl=0.05)
+    responses.put("k", router.Answer("Paris.", False))
+    assert responses.get("k").tts_text == "Paris."
+    time.sleep(0.1)
+    assert responses.get("k") is None
+
+def test_least_recently_used_is_evicted():
+    responses = cache.ResponseCache(max_entries=2)
+    responses.put("a", router.Answer("A", False))
+    responses.put("b", router.Answer("B", False))
+    responses.get("a")
+    responses.put("c", router.Answer("C", False))
+    assert responses.get("b") is None
+    assert responses.get("a") is not None
+
+def test_persisted_answers_survive_restart_until_invalidated(tmp_path):
+    path = str(tmp_path/"atlas.db")
+    cache.ResponseCache(path=path).put("k", router.Answer("Paris.", True))
+    responses = cache.ResponseCache(path=path)
+    assert responses.get("k") == router.Answer("Paris.", True)
+    responses.invalidate()
+    assert cache.ResponseCache(path=path).get("k") is None
+
+def test_mark_uncacheable_outside_request_does_nothing():
+    cache.mark_uncacheable("agent_error")
+    with cache.request() as request:
+        cache.mark_uncacheable("agent_error")
+        cache.mark_uncacheable("agent_error")
+    assert request.uncacheable == ["agent_error"]
+    assert not request.invalidate
+
+class Scripted(LLM):
+    def __init__(self, turns: list[list[str]]):
+        super().__init__("scripted")
+        self.turns = list(turns)
+    def _complete(self, messages: list, temperature: float = None, stop=None, model: str = None):
+        yield from self.turns.pop(0)
+
+def run_code(monkeypatch, code: str) -> cache.Request:
+    monkeypatch.setattr(sys_worker, "execute_python", lambda code, env_id=None: "")
+    agent = sys_worker.SysWorkerAgent("sys_worker", Scripted([
+        [f"<|python|>\n{code}\n</|python|>"],
+        ["<s_out>Done.</s_out>"]
+    ]), "small")
+    with cache.request() as request:
+        agent.process("Turn on the kitchen lights")
+    return request
+
+def test_answer_code_ran_for_is_not_cached(monkeypatch):
+    request = run_code(monkeypatch, "s = requests.Session()\ns.post(url, json={'entity_id': 'light.kitchen'})")
+    assert request.uncacheable == ["ran_code"]
+    assert not request.invalidate
+
+def test_known_side_effect_invalidates(monkeypatch):
+    request = run_code(monkeypatch, "requests.post(url, json={'entity_id': 'light.kitchen'})")
+    assert request.uncacheable == ["side_effects"]
+    assert request.invalidate
@@ -0,0 +1,66 @@
+"""Request tokens, and work that stops when its request is cancelled."""
+
+import os
+import threading
+import time
+
+import pytest
+
+from core import cancellation, sandbox
+
+def test_deadline_cancels():
+    token = cancellation.Token(0.05)
+    time.sleep(0.2)
+    assert token.reason == "deadline"
+    with pytest.raises(cancellation.Cancelled):
+        token.check()
+
+def test_finished_token_is_not_cancelled():
+    token = cancellation.Token(0.05)
+    with cancellation.scope(token):
+        pass
+    time.sleep(0.2)
+    assert not token.cancelled
+
+def test_on_cancel_calls_back_while_inside():
+    calls = []
+    with cancellation.scope(cancellation.Token()) as token:
+        with cancellation.on_cancel(lambda: calls.append("inside")):
+            token.cancel("preempted")
+        with pytest.raises(cancellation.Cancelled):
+            with cancellation.on_cancel(lambda: calls.append("after")):
+                pass
+    assert calls == ["inside"]
+
+def test_callback_of_cancelled_token_runs_at_once():
+    token = cancellation.Token()
+    token.cancel("disconnected")
+    calls = []
+    token.add_callback(lambda: calls.append(1))
+    assert calls == [1]
+
+def test_queued_sandbox_call_does_not_run_once_cancelled(tmp_path):
+    pool = sandbox.SandboxPool(max_concurrent=1, queue_timeout=5, workspace_root=str(tmp_path))
+    pool.COMMAND = ["python3", "-"]
+    marker = tmp_path/"ran"
+    pool._slots.acquire(0) # held by another call
+    token = cancellation.Token()
+    raised = []
+    def call():
+        with cancellation.scope(token):
+            try:
+                pool.run(f"open({str(marker)!r}, 'w').close()", "env")
+            except cancellation.Cancelled as e:
+                raised.append(e.reason)
+    thread = threading.Thread(target=call)
+    t = time.monotonic()
+    thread.start()
+    time.sleep(0.1)
+    token.cancel("preempted")
+    thread.join(2)
+    assert raised == ["preempted"]
+    assert time.monotonic()-t < 1 # didn't wait for the slot
+    pool._slots.release()
+    time.sleep(0.1)
+    assert not os.path.exists(marker)
+    pool.close()
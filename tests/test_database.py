@@ -0,0 +1,51 @@
+"""Conversation histories in `ConversationStore`."""
+
+from core import database, models
+
+def history() -> models.chat.History:
+    h = models.chat.History([])
+    h.add_user("is the garage door closed")
+    h.add_assistant("<think>check it</think>\n\n<|agent| sys_worker>garage door state</|agent|>", "")
+    h.add_tool("closed", "sys_worker")
+    h.add_assistant("<think>done</think>\n\n<u_out>Yes, it's closed.</u_out>", "Yes, it's closed.")
+    return h
+
+def test_round_trip_after_eviction(tmp_path):
+    store = database.ConversationStore(str(tmp_path/"atlas.db"), cache_size=1)
+    store.put("a", history())
+    store.put("b", history()) # evicts `a` from the in-memory cache
+    for restored in (store.get("a"), database.ConversationStore(str(tmp_path/"atlas.db")).get("a")):
+        assert restored.history == history().history
+        assert restored.history[-1].tts_text == "Yes, it's closed."
+        assert restored.history[1].tts_text == ""
+
+def test_appended_messages_keep_tts_text(tmp_path):
+    store = database.ConversationStore(str(tmp_path/"atlas.db"), cache_size=1)
+    h = history()
+    store.put("a", h)
+    h.add_user("and the porch light")
+    h.add_assistant("<u_out>It's off.</u_out>", "It's off.")
+    store.put("a", h, 4)
+    store.put("b", history())
+    assert store.get("a").history[-1].tts_text == "It's off."
+
+def test_stored_messages_sent_to_providers_without_tts_text(tmp_path):
+    store = database.ConversationStore(str(tmp_path/"atlas.db"), cache_size=1)
+    store.put("a", history())
+    store.put("b", history())
+    assert all(set(m) <= {"role", "content", "tool_call_id"} for m in store.get("a").to_messages())
+
+def test_later_writer_replaces_longer_turn(tmp_path):
+    path = str(tmp_path/"atlas.db")
+    store = database.ConversationStore(path)
+    store.put("a", history())
+    first, second = store.get("a"), store.get("a") # two requests in the same conversation
+    first.add_user("open it")
+    first.add_assistant("<|agent| sys_worker>open the garage door</|agent|>", "")
+    first.add_tool("opened", "sys_worker")
+    first.add_assistant("<u_out>Opened.</u_out>", "Opened.")
+    second.add_user("never mind")
+    second.add_assistant("<u_out>Okay.</u_out>", "Okay.")
+    store.put("a", first, 4)
+    store.put("a", second, 4)
+    assert database.ConversationStore(path).get("a").history == second.history
@@ -0,0 +1,63 @@
+"""The household memory store sandboxed code reaches as `memory`."""
+
+import os
+
+from core import memory
+
+def store(tmp_path) -> memory.MemoryStore:
+    return memory.MemoryStore(str(tmp_path/"memory.db"))
+
+def test_add_and_search(tmp_path):
+    s = store(tmp_path)
+    s.add_many(["Alice is allergic to peanuts", "The garage code is 4821", "Bob likes jazz in the evening"])
+    assert s.search("what is Alice allergic to", k=1)[0]["text"] == "Alice is allergic to peanuts"
+    assert len(s) == 3
+
+def test_forgotten_memories_are_not_found(tmp_path):
+    s = store(tmp_path)
+    memory_id = s.add("The garage code is 4821")
+    assert s.forget(memory_id)
+    assert not s.forget(memory_id)
+    for mode in ("vector", "keyword", "hybrid"):
+        assert s.search("garage code", mode=mode) == []
+    assert s.recent() == []
+    assert len(s) == 0
+
+def test_hybrid_ranks_matches_of_both_first(tmp_path):
+    s = store(tmp_path)
+    s.add_many(["Carol waters the garden on Sundays", "The garden gate sticks", "Carol prefers tea"])
+    vector = [i["text"] for i in s.search("Carol garden", k=3, mode="vector")]
+    keyword = [i["text"] for i in s.search("Carol garden", k=3, mode="keyword")]
+    hybrid = [i["text"] for i in s.search("Carol garden", k=3)]
+    assert hybrid[0] == "Carol waters the garden on Sundays"
+    assert set(hybrid) == set(vector) | set(keyword)
+
+def test_other_store_catches_up(tmp_path):
+    first, second = store(tmp_path), store(tmp_path)
+    memory_id = first.add("Dave feeds the cat at 7")
+    assert second.search("who feeds the cat")[0]["id"] == memory_id
+    second.forget(memory_id)
+    assert first.search("who feeds the cat") == []
+
+def test_sessions_forked_after_open_share_the_store(tmp_path):
+    s = store(tmp_path)
+    s.add("Erin's birthday is in May")
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0: # a sandbox session
+        try:
+            found = s.search("Erin birthday")[0]["text"] == "Erin's birthday is in May"
+            s.add("Erin wants a bike")
+            os.write(w, b"1" if found else b"0")
+        finally:
+            os._exit(0)
+    os.close(w)
+    assert os.read(r, 1) == b"1"
+    os.waitpid(pid, 0)
+    assert s.recent(1)[0]["text"] == "Erin wants a bike"
+    assert s.search("Erin bike", k=1)[0]["text"] == "Erin wants a bike"
+
+def test_stored_memories_are_re_embedded_for_another_embedder(tmp_path):
+    store(tmp_path).add("Frank plays chess on Tuesdays")
+    s = memory.MemoryStore(str(tmp_path/"memory.db"), memory.HashingEmbedder(64))
+    assert s.search("chess", k=1, mode="vector")[0]["text"] == "Frank plays chess on Tuesdays"
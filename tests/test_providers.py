@@ -0,0 +1,19 @@
+"""Provider clients shared by agents."""
+
+import asyncio
+
+from core import models
+from core.llm import cerebras_cloud, openai_compatible
+
+def test_async_client_per_event_loop():
+    config = models.config.ProviderConfig("cerebras", "cerebras", "key", "http://127.0.0.1:1")
+    async def clients():
+        return (
+            openai_compatible.shared_async_client("http://127.0.0.1:1/v1"),
+            openai_compatible.shared_async_client("http://127.0.0.1:1/v1"),
+            cerebras_cloud.shared_async_client(config),
+            cerebras_cloud.shared_async_client(config)
+        )
+    first, second = asyncio.run(clients()), asyncio.run(clients())
+    assert first[0] is first[1] and first[2] is first[3]
+    assert first[0] is not second[0] and first[2] is not second[2]
@@ -0,0 +1,41 @@
+"""Pre-router intents."""
+
+from core import models, router
+
+def prompt(text: str, history: list[dict] = None) -> models.hass.PromptPayload:
+    return models.hass.PromptPayload({
+        "input_text": text,
+        "timest": 1760000000,
+        "history": history,
+        "user_info": {"id": "u1", "name": "Alice", "is_admin": False, "is_owner": True}
+    })
+
+def repeat(history: list[dict]) -> router.Answer:
+    return router.PatternStage(["repeat"])(prompt("repeat that", history))
+
+def test_repeat_client_history_speaks_u_out_only():
+    answer = repeat([
+        {"role": "user", "content": "will it rain tomorrow"},
+        {"role": "assistant", "content": "<think>Check the forecast.</think>\n\n<|agent| sys_worker>forecast</|agent|>"},
+        {"role": "tool", "content": "60% rain", "tool_call_id": "sys_worker"},
+        {"role": "assistant", "content": (
+            "<think>It will <u_out>not</u_out> matter.</think>\n\n<u_out>Probably, there's a 60 percent chance.</u_out>"
+            " <u_out>Take an umbrella.</u_out> <continue_conversation />"
+        )}
+    ])
+    assert answer.tts_text == "Probably, there's a 60 percent chance.\nTake an umbrella."
+
+def test_repeat_skips_messages_without_u_out():
+    answer = repeat([
+        {"role": "assistant", "content": "<u_out>It's sunny.</u_out>"},
+        {"role": "user", "content": "thanks"},
+        {"role": "assistant", "content": "<think>Nothing to say.</think>"}
+    ])
+    assert answer.tts_text == "It's sunny."
+
+def test_repeat_uses_distinct_tts_text():
+    answer = repeat([{"role": "assistant", "content": "<u_out>It's sunny.</u_out>", "tts_text": "It is sunny today."}])
+    assert answer.tts_text == "It is sunny today."
+
+def test_repeat_without_anything_said_falls_through():
+    assert repeat([{"role": "assistant", "content": "<think>hm</think>"}]) is None
@@ -0,0 +1,32 @@
+"""Completions routed over several backends."""
+
+from core import models
+from core.llm import LLM, routing
+
+class Backend(LLM):
+    def __init__(self, name: str, chunks: list[str], fail: bool = False):
+        super().__init__(name)
+        self.chunks = chunks
+        self.fail = fail
+    def _complete(self, messages: list, temperature: float = None, stop=None, model: str = None):
+        if self.fail:
+            raise ConnectionError(f"{self.provider_name} is down")
+        yield from self.chunks
+
+def router(*backends: Backend) -> routing.Routing:
+    llm = routing.Routing.__new__(routing.Routing)
+    LLM.__init__(llm, "routed")
+    llm.backends = [routing.Backend(i) for i in backends]
+    llm.strategy = "priority"
+    llm.hedge_after = 5
+    llm.cooldown = 30
+    return llm
+
+def hedges() -> dict:
+    return dict(routing.HEDGES._series)
+
+def test_failover_is_not_counted_as_hedged():
+    before = hedges()
+    llm = router(Backend("a", [], fail=True), Backend("b", ["Hello", " there"]))
+    assert "".join(llm.complete(models.chat.History([]))) == "Hello there"
+    assert hedges() == before
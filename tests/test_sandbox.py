@@ -0,0 +1,64 @@
+"""Sandbox call results as agents get them, and the workspaces sessions leave behind."""
+
+import os
+import time
+
+import pytest
+
+from core import sandbox
+
+def test_stdout_only():
+    assert sandbox.format_result({"stdout": "42\n", "stderr": "", "stdout_bytes": 3, "stderr_bytes": 0}) == "42\n"
+
+def test_stderr_is_labelled():
+    result = {"stdout": "partial", "stderr": "Traceback (most recent call last):\n...\n", "stdout_bytes": 7, "stderr_bytes": 40}
+    assert sandbox.format_result(result) == "partial\nSTDERR:\nTraceback (most recent call last):\n...\n"
+
+def test_silent_call():
+    assert sandbox.format_result({"stdout": "", "stderr": "", "stdout_bytes": 0, "stderr_bytes": 0}) == ""
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = sandbox.SandboxPool(max_output=100, workspace_root=str(tmp_path))
+    pool.COMMAND = ["python3", "-"]
+    yield pool
+    pool.close()
+
+def test_truncated_output_notes_its_size_once(pool):
+    output = pool.run("print('a'*49); print('m'*9900); print('z'*49)", "env")
+    assert output == "a"*49+"\n\n[... 9901 of 10001 bytes omitted ...]\n"+"z"*49+"\n"
+
+def test_output_of_background_processes_stops_being_drained(pool):
+    pool.run("import subprocess; subprocess.Popen(['sh', '-c', 'sleep 2; echo late'])", "env") # holds stdout
+    # the drain threads of this call, not those of the last
+    assert pool.run("import threading, time; time.sleep(0.1); print(threading.active_count())", "env") == "3\n"
+
+def workspace(root, name: str, size: int, age: float):
+    path = root/name
+    path.mkdir()
+    (path/"data").write_bytes(b"x"*size)
+    modified = time.time()-age
+    for i in (path/"data", path):
+        os.utime(i, (modified, modified))
+
+def reaped() -> dict:
+    return dict(sandbox.REAPED._series)
+
+def test_reaper_removes_oldest_past_size_cap(tmp_path):
+    workspace(tmp_path, "old", 600, 30)
+    workspace(tmp_path, "new", 600, 10)
+    pool = sandbox.SandboxPool(workspace_root=str(tmp_path), workspace_max_bytes=1000)
+    pool.reap_workspaces()
+    assert sorted(os.listdir(tmp_path)) == ["new"]
+
+def test_reaper_without_size_cap_keeps_recent(tmp_path):
+    workspace(tmp_path, "new", 600, 10)
+    sandbox.SandboxPool(workspace_root=str(tmp_path), workspace_max_bytes=None).reap_workspaces()
+    assert os.listdir(tmp_path) == ["new"]
+
+def test_workspace_left_behind_is_not_counted(tmp_path, monkeypatch):
+    workspace(tmp_path, "old", 10, 3600)
+    monkeypatch.setattr(sandbox.shutil, "rmtree", lambda path, ignore_errors=False: None)
+    before = reaped()
+    sandbox.SandboxPool(workspace_root=str(tmp_path), workspace_ttl=600).reap_workspaces()
+    assert reaped() == before
@@ -0,0 +1,123 @@
+"""Supervisor turns streamed to `on_u_out`, and the agents they invoke."""
+
+import threading
+import time
+
+from core import agents, models
+from core.agents import Agent
+from core.llm import LLM
+
+class Scripted(LLM):
+    """Answers each completion with the next scripted list of deltas."""
+    def __init__(self, turns: list[list[str]]):
+        super().__init__("scripted")
+        self.turns = list(turns)
+    def _complete(self, messages: list, temperature: float = None, stop=None, model: str = None):
+        yield from self.turns.pop(0)
+
+def prompt(text: str = "what's on the calendar for tomorrow afternoon") -> models.hass.PromptPayload:
+    return models.hass.PromptPayload({
+        "input_text": text,
+        "timest": 1760000000,
+        "user_info": {"id": "u1", "name": "Alice", "is_admin": False, "is_owner": True}
+    })
+
+def supervisor(turns: list[list[str]]) -> agents.supervisor.SupervisorAgent:
+    agent = agents.supervisor.SupervisorAgent("supervisor", Scripted(turns), "small", ["small", "large"])
+    agent.delegate_agents(agents.Agents([]))
+    return agent
+
+def test_escalated_turn_is_not_said_twice():
+    agent = supervisor([
+        ["<u_out>Let me check.</u_out>", "<u_out>You have", " a dentist appointment"], # unclosed, escalated
+        ["<u_out>Let me check.</u_out>", "<u_out>You have a dentist appointment at 3.</u_out>"]
+    ])
+    said = []
+    agent.process(prompt(), on_u_out=said.append)
+    assert said == ["Let me check.", "You have a dentist appointment at 3."]
+    assert agent.llm.turns == []
+
+def test_retried_turn_says_what_it_adds():
+    agent = supervisor([
+        ["<u_out>Checking.</u_out>", "<|agent| calendar>tomorrow</|agent|>"], # unknown agent, escalated
+        ["<u_out>Checking.</u_out>", "<u_out>Nothing is planned tomorrow.</u_out>"]
+    ])
+    said = []
+    p = prompt()
+    agent.process(p, on_u_out=said.append)
+    assert said == ["Checking.", "Nothing is planned tomorrow."]
+    assert p.history.history[-1].tts_text == "Checking.\nNothing is planned tomorrow."
+
+class Worker(Agent):
+    """Reports after `delay` seconds, or once `barrier` is passed."""
+    def __init__(self, delay: float = 0, barrier: threading.Barrier = None, timeout: float = None):
+        super().__init__("sys_worker", Scripted([]), "small")
+        self.delay = delay
+        self.barrier = barrier
+        self.timeout = timeout
+        self.ran = 0
+    def process(self, prompt: str, **kwargs) -> str:
+        self.ran += 1
+        if self.barrier is not None:
+            self.barrier.wait(2)
+        time.sleep(self.delay)
+        return f"Done: {prompt}"
+
+def test_timeout_counts_from_start():
+    worker = Worker(delay=0.15, timeout=0.25)
+    dispatcher = agents.supervisor.AgentDispatcher(1)
+    assert dispatcher.run([(worker, "a"), (worker, "b")]) == ["Done: a", "Done: b"]
+
+class Invoker(LLM):
+    """Invokes sys_worker, then answers once it reported."""
+    def __init__(self):
+        super().__init__("invoker")
+    def _complete(self, messages: list, temperature: float = None, stop=None, model: str = None):
+        yield "<u_out>Done.</u_out>" if messages[-1]["role"] == "tool" else "<|agent| sys_worker>lights</|agent|>"
+
+def test_requests_dont_share_agent_threads():
+    worker = Worker(barrier=threading.Barrier(2))
+    agent = agents.supervisor.SupervisorAgent("supervisor", Invoker(), "small")
+    agent.delegate_agents(agents.Agents([worker]))
+    def request(reports: list):
+        p = prompt()
+        agent.process(p)
+        reports.append(p.history.history[-2].content)
+    reports = []
+    threads = [threading.Thread(target=request, args=(reports,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert reports == ["Done: lights"]*2
+
+class Prepared(agents.Preparation):
+    def __init__(self):
+        self.released = 0
+    def release(self):
+        self.released += 1
+
+def test_abort_releases_preparations_of_queued_invocations():
+    blocker = Worker(barrier=threading.Barrier(2))
+    dispatcher = agents.supervisor.AgentDispatcher(1)
+    speculative = agents.supervisor.SpeculativeDispatch(dispatcher, {"sys_worker": blocker})
+    preparation = Prepared()
+    speculative.closed({"agent_name": "sys_worker", "prompt": "a"})
+    speculative.submitted.append(dispatcher.submit(blocker, "b", preparation)) # queued behind "a"
+    speculative.abort()
+    blocker.barrier.abort()
+    assert preparation.released == 1
+    assert blocker.ran == 1
+
+def test_retried_turn_doesnt_run_invocations_twice():
+    worker = Worker()
+    agent = supervisor([
+        ["<|agent| sys_worker>lights</|agent|>", "<|agent| calendar>tomorrow</|agent|>"], # unknown agent, escalated
+        ["<|agent| sys_worker>lights</|agent|>"],
+        ["<u_out>Done.</u_out>"]
+    ])
+    agent.delegate_agents(agents.Agents([worker]))
+    agent.set_max_parallel_agents(2)
+    agent.set_speculative(True)
+    agent.process(prompt())
+    assert worker.ran == 1